@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the cost of raising for an error response with a large HTML body, as
+from a misbehaving plugin: building the message by beautifying the whole body
+as the client used to, against APIError, which formats a truncated raw body.
+
+usage: PYTHONPATH=. python benchmarks/error_path.py [body_kb] [iterations]
+"""
+
+import sys
+import timeit
+
+from requests.models import Request, Response
+from requests.structures import CaseInsensitiveDict
+
+from wordpress.exceptions import APIError
+from wordpress.helpers import UrlUtils
+
+
+def error_response(body_kb):
+    response = Response()
+    response.status_code = 500
+    response.headers = CaseInsensitiveDict({'Content-Type': 'text/html; charset=UTF-8'})
+    response.encoding = 'utf-8'
+    row = b'<tr><td class="x">Fatal error</td><td>in /wp-content/plugins/a/b.php:12</td></tr>\n'
+    response._content = b'<html><body><table>' + row * (body_kb * 1024 // len(row)) + b'</table></body></html>'
+    response.request = Request('GET', 'http://woo.test/wp-json/wc/v3/products').prepare()
+    response.url = response.request.url
+    return response
+
+
+def legacy_message(response):
+    return "API call to %s returned \nCODE: %s\n%s \nHEADERS: %s" % (
+        response.request.url,
+        str(response.status_code),
+        UrlUtils.beautify_response(response),
+        str(response.headers)
+    )
+
+
+def main(body_kb=5120, iterations=5):
+    response = error_response(body_kb)
+    print("error response with a %d KB body, %d iterations" % (body_kb, iterations))
+    legacy = timeit.timeit(lambda: legacy_message(response), number=iterations) / iterations
+    fast = timeit.timeit(lambda: str(APIError.for_response(response)), number=iterations) / iterations
+    print("  beautified message   %10.2f ms" % (legacy * 1000))
+    print("  APIError             %10.3f ms" % (fast * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
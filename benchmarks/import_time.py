@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""
+Measures the cost of 'import wordpress' in fresh interpreters, as short lived
+CLI processes pay it: wall time, peak memory growth and modules loaded, and
+which third party packages besides requests got imported.
+
+Python 2 has no 'python -X importtime', so each run times the import itself.
+On Python 3.7+ run 'python -X importtime -c "import wordpress"' for a per module
+breakdown.
+
+usage: PYTHONPATH=. python benchmarks/import_time.py [runs]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+MEASURE = """
+import json, os, resource, sys, time
+before = set(sys.modules)
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.time()
+import wordpress
+elapsed = time.time() - started
+third_party = sorted(set(
+    name.split('.')[0] for name, module in sys.modules.items()
+    if module is not None and name not in before
+    and 'packages' in (getattr(module, '__file__', None) or '')
+) - set(['requests']))
+print(json.dumps({
+    'ms': elapsed * 1000,
+    'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+    'modules': len(set(sys.modules) - before),
+    'third_party': third_party,
+}))
+"""
+
+
+def measure():
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output([sys.executable, '-c', MEASURE], cwd=root)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(runs=10):
+    results = [measure() for _ in range(runs)]
+    times = sorted(result['ms'] for result in results)
+    print("import wordpress, %d runs" % runs)
+    print("  time       min %.1f ms, median %.1f ms" % (times[0], times[len(times) // 2]))
+    print("  peak rss   +%d KB" % results[-1]['rss_kb'])
+    print("  modules    %d" % results[-1]['modules'])
+    print("  3rd party  %s" % (", ".join(results[-1]['third_party']) or "none besides requests"))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the cost of encoding a request body for a bulk product push: the
+client's old path, a character loop to decide whether there was data followed
+by json.dumps and a separate UTF-8 encode, against JSONBackend.dumps with each
+JSON library installed. The payload is a WooCommerce products/batch create of
+products carrying large meta_data arrays.
+
+usage: PYTHONPATH=. python benchmarks/json_encode.py [products] [iterations]
+"""
+
+import sys
+import timeit
+from json import dumps as jsonencode
+
+from wordpress.serializers import JSONBackend
+
+
+def product(index):
+    return {
+        'name': u'Pröduct %d' % index,
+        'type': 'variable',
+        'sku': 'SKU-%06d' % index,
+        'regular_price': '%d.99' % (index % 100),
+        'description': u'<p>Crème brûlée, ' + 'lorem ipsum dolor sit amet ' * 20 + '</p>',
+        'categories': [{'id': 9}, {'id': 14}],
+        'images': [{'src': 'https://example.com/wp-content/uploads/%d-%d.jpg' % (index, i)} for i in range(3)],
+        'attributes': [{'name': 'Size', 'options': ['S', 'M', 'L', 'XL'], 'variation': True}],
+        'meta_data': [{'key': '_custom_%d' % i, 'value': 'value %d' % i} for i in range(50)],
+    }
+
+
+def legacy_encode(data):
+    cond = (data is not None)
+    isTrue = True
+    trueStr = "True"
+    counter = 0
+    for counter, condChar in enumerate(str(bool(cond))):
+        if counter >= len(trueStr) or condChar != trueStr[counter]:
+            isTrue = False
+        counter += 1
+    if str(bool(isTrue)) == trueStr:
+        data = jsonencode(data, ensure_ascii=False).encode('utf-8')
+    return data
+
+
+def main(products=100, iterations=50):
+    payload = {'create': [product(index) for index in range(products)]}
+    cases = [('legacy json', legacy_encode)]
+    for name in JSONBackend.names:
+        try:
+            cases.append((name, JSONBackend(name).dumps))
+        except UserWarning:
+            print("%s is not installed" % name)
+    size = len(legacy_encode(payload))
+    print("batch of %d products, %d KB encoded" % (products, size // 1024))
+    print("%-14s %10s %10s %8s" % ("encoder", "ms/body", "MB/s", "KB"))
+    for name, encode in cases:
+        seconds = timeit.timeit(lambda: encode(payload), number=iterations) / iterations
+        print("%-14s %10.2f %10.1f %8d" % (
+            name, seconds * 1000, size / seconds / 1e6, len(encode(payload)) // 1024
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares OAuth.add_params_sign against the signing path it replaced, which
+sorted the params with a quadratic scan, normalized and sorted them twice and
+keyed a new HMAC for every request. Checks both give the same signed urls
+for plain params. With list and nested params they differ, as the legacy path
+kept only the first include[] value and sorted nested keys as whole strings,
+where the server keeps the order they are sent in.
+
+usage: PYTHONPATH=. python benchmarks/oauth_sign.py [iterations]
+"""
+
+import sys
+import timeit
+from hmac import new as HMAC
+from hashlib import sha1, sha256
+import binascii
+
+try:
+    from urllib.parse import quote, parse_qsl, urlparse
+except ImportError:
+    from urllib import quote
+    from urlparse import parse_qsl, urlparse
+
+from wordpress.api import API
+from wordpress.helpers import UrlUtils
+
+
+class LegacySigner(object):
+    """ The signing path as it was before the fast path """
+
+    def __init__(self, oauth):
+        self.oauth = oauth
+
+    def add_params_sign(self, method, url, params, sign_key=None):
+        if isinstance(params, dict):
+            params = params.items()
+        urlparse_result = urlparse(url)
+        if urlparse_result.query:
+            params += parse_qsl(urlparse_result.query)
+        params = self.sorted_params(params)
+        params_without_signature = []
+        for key, value in params:
+            if key != "oauth_signature":
+                params_without_signature.append((key, value))
+        signature = self.generate_oauth_signature(method, params_without_signature, url, sign_key)
+        params = params_without_signature + [("oauth_signature", signature)]
+        query_string = self.flatten_params(params)
+        return UrlUtils.substitute_query(url, query_string)
+
+    def generate_oauth_signature(self, method, params, url, key=None):
+        base_request_uri = quote(UrlUtils.substitute_query(url), "")
+        query_string = quote(self.flatten_params(params), '~')
+        string_to_sign = "&".join([method, base_request_uri, query_string])
+        if key is None:
+            key = "%s&" % self.oauth.consumer_secret
+        if self.oauth.signature_method == 'HMAC-SHA1':
+            hmac_mod = sha1
+        else:
+            hmac_mod = sha256
+        sig = HMAC(key, string_to_sign, hmac_mod)
+        return binascii.b2a_base64(sig.digest())[:-1]
+
+    @classmethod
+    def sorted_params(cls, params):
+        ordered = []
+        base_keys = sorted(set(k.split('[')[0] for k, v in params))
+        keys_seen = []
+        for base in base_keys:
+            for key, value in params:
+                if key == base or key.startswith(base + '['):
+                    if key not in keys_seen:
+                        ordered.append((key, value))
+                        keys_seen.append(key)
+        return ordered
+
+    @classmethod
+    def flatten_params(cls, params):
+        params = [
+            (quote(key, ''), quote(UrlUtils.get_value_like_as_php(value), ''))
+            for key, value in params
+        ]
+        params = cls.sorted_params(params)
+        return "&".join(["%s=%s" % (key, value) for key, value in params])
+
+
+def main(iterations=20000):
+    api = API(
+        url="http://woo.test",
+        consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+        consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+    )
+    oauth = api.oauth
+    legacy = LegacySigner(oauth)
+    # name, url, whether the legacy path signs it the same
+    cases = [
+        ('bare', api.requester.endpoint_url('products'), True),
+        ('query', api.requester.endpoint_url(
+            'products?page=2&per_page=100&orderby=date&order=desc&status=publish'
+        ), True),
+        ('include[]', api.requester.endpoint_url(
+            'products?' + '&'.join('include[]=%d' % i for i in range(100))
+        ), False),
+        ('30 params', api.requester.endpoint_url(
+            'products?' + '&'.join('filter[meta_%d]=%d' % (i, i) for i in range(30))
+        ), False),
+    ]
+    params = [
+        ("oauth_consumer_key", oauth.consumer_key),
+        ("oauth_nonce", "166182658461433445531477041328"),
+        ("oauth_signature_method", "HMAC-SHA1"),
+        ("oauth_timestamp", 1477041328),
+    ]
+    print("%-12s %12s %12s %8s" % ("case", "legacy us", "fast us", "speedup"))
+    for name, url, same in cases:
+        if same:
+            assert oauth.add_params_sign("GET", url, list(params)) \
+                == legacy.add_params_sign("GET", url, list(params)), name
+        number = max(iterations // (10 if name == 'include[]' else 1), 1)
+        legacy_time = timeit.timeit(
+            lambda: legacy.add_params_sign("GET", url, list(params)), number=number
+        )
+        fast_time = timeit.timeit(
+            lambda: oauth.add_params_sign("GET", url, list(params)), number=number
+        )
+        print("%-12s %12.1f %12.1f %7.1fx" % (
+            name, legacy_time / number * 1e6, fast_time / number * 1e6, legacy_time / fast_time
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the cost of an include[] query of many IDs: building it into the
+endpoint string, which signing then parses back out with parse_qsl, against
+passing params, flattened straight into the pairs that get signed. Both give a
+signed url for a GET with OAuth1, as used over plain http.
+
+usage: PYTHONPATH=. python benchmarks/query_params.py [ids] [iterations]
+"""
+
+import sys
+import timeit
+
+from wordpress.api import API
+from wordpress.helpers import UrlUtils
+
+
+def main(ids=500, iterations=200):
+    api = API(
+        url="http://woo.test/shop",
+        consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+        consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+        version="wc/v3"
+    )
+    include = list(range(1000, 1000 + ids))
+
+    def string_path():
+        endpoint = 'products?' + '&'.join('include[]=%d' % id_ for id_ in include) \
+            + '&per_page=%d&orderby=include' % ids
+        return api.oauth.get_oauth_url(api.requester.endpoint_url(endpoint), 'GET')
+
+    def params_path():
+        query = UrlUtils.flatten_query([
+            ('include', include), ('per_page', ids), ('orderby', 'include')
+        ])
+        return api.oauth.get_oauth_url(api.requester.endpoint_url('products'), 'GET', query)
+
+    print("signed GET with %d include[] ids" % ids)
+    print("%-14s %10s" % ("case", "ms/url"))
+    for name, func in [('string query', string_path), ('params', params_path)]:
+        seconds = timeit.timeit(func, number=iterations) / iterations
+        print("%-14s %10.3f" % (name, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares what a sync job holding many products pays when it needs three fields
+of each: full objects as dicts, against _fields selected objects as dicts and
+as Records. Reports the JSON bytes transferred and decoded per object, the
+size of each object itself (not counting the shared field values), and the
+time to decode a page of 100 and convert it.
+
+usage: PYTHONPATH=. python benchmarks/records.py [iterations]
+"""
+
+import json
+import sys
+import timeit
+
+from wordpress.records import FieldSelection
+
+
+def product(index):
+    return {
+        'id': index, 'name': 'Product %d' % index, 'slug': 'product-%d' % index,
+        'date_modified_gmt': '2024-01-01T00:00:00', 'type': 'simple', 'status': 'publish',
+        'description': '<p>' + 'lorem ipsum dolor sit amet ' * 40 + '</p>',
+        'short_description': '<p>lorem ipsum</p>', 'sku': 'SKU-%d' % index, 'price': '9.99',
+        'regular_price': '9.99', 'sale_price': '', 'stock_quantity': 3, 'weight': '',
+        'categories': [{'id': 9, 'name': 'Clothing', 'slug': 'clothing'}],
+        'images': [{'id': i, 'src': 'https://example.com/%d.jpg' % i, 'alt': ''} for i in range(3)],
+        'attributes': [], 'meta_data': [{'id': i, 'key': '_k%d' % i, 'value': 'v'} for i in range(20)],
+        '_links': {'self': [{'href': 'https://example.com/wp-json/wc/v3/products/%d' % index}]},
+    }
+
+
+def main(iterations=200):
+    fields = ['id', 'name', 'date_modified_gmt']
+    selection = FieldSelection(fields)
+    full = json.dumps([product(index) for index in range(100)])
+    sparse = json.dumps([
+        dict((field, item[field]) for field in fields) for item in json.loads(full)
+    ])
+    cases = [
+        ('full dicts', full, lambda text: json.loads(text)),
+        ('_fields dicts', sparse, lambda text: json.loads(text)),
+        ('_fields records', sparse, lambda text: [selection.record(item) for item in json.loads(text)]),
+    ]
+    print("page of 100 products, %s" % ", ".join(fields))
+    print("%-16s %12s %12s %12s" % ("case", "bytes/obj", "obj bytes", "ms/page"))
+    for name, text, decode in cases:
+        seconds = timeit.timeit(lambda: decode(text), number=iterations) / iterations
+        item = decode(text)[0]
+        print("%-16s %12d %12d %12.3f" % (
+            name, len(text) // 100, sys.getsizeof(item), seconds * 1000
+        ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
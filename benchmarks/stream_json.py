@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares decoding a large JSON array response by reading the whole body and
+decoding it at once, as response.json() does, against JSONArrayParser yielding
+one item at a time as chunks arrive. Each mode runs in a fresh interpreter so
+its peak memory can be measured. The body is generated chunk by chunk, as it
+would arrive from the socket.
+
+usage: PYTHONPATH=. python benchmarks/stream_json.py [items] [json_backend]
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+MEASURE = """
+import json, resource, sys, time
+from wordpress.serializers import JSONBackend, JSONArrayParser
+
+mode, count, backend = sys.argv[1], int(sys.argv[2]), JSONBackend.from_value(sys.argv[3] or None)
+item = {'id': 0, 'name': 'Product', 'description': '<p>' + 'lorem ipsum ' * 200 + '</p>',
+        'meta_data': [{'id': i, 'key': '_meta_%d' % i, 'value': 'x' * 20} for i in range(20)]}
+
+def chunks(chunk_size=65536):
+    pending = [b'[']
+    size = 1
+    for index in range(count):
+        item['id'] = index
+        text = (b',' if index else b'') + json.dumps(item).encode('utf-8')
+        pending.append(text)
+        size += len(text)
+        if size >= chunk_size:
+            yield b''.join(pending)
+            pending, size = [], 0
+    pending.append(b']')
+    yield b''.join(pending)
+
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+started = time.time()
+decoded = 0
+if mode == 'whole':
+    decoded = len(backend.loads(b''.join(chunks())))
+else:
+    for _ in JSONArrayParser.iter_items(chunks(), backend.loads):
+        decoded += 1
+print(json.dumps({
+    'items': decoded,
+    'ms': (time.time() - started) * 1000,
+    'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss,
+}))
+"""
+
+
+def measure(mode, items, backend):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, '-c', MEASURE, mode, str(items), backend], cwd=root
+    )
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def main(items=5000, backend=''):
+    print("%d items of about 3 KB each" % items)
+    for mode in ['whole', 'stream']:
+        result = measure(mode, items, backend)
+        assert result['items'] == items
+        print("  %-7s %10.1f ms  peak rss +%d KB" % (mode, result['ms'], result['rss_kb']))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) if arg.isdigit() else arg for arg in sys.argv[1:]])
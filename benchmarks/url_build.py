@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+"""
+Compares the cost of building a request url: joining every component per
+request as endpoint_url used to, endpoint_url on the precomputed base url, and
+filling in a Route template. Also the per-request is_ssl check, parsed each
+time before and now cached.
+
+usage: PYTHONPATH=. python benchmarks/url_build.py [iterations]
+"""
+
+import sys
+import timeit
+
+from wordpress.api import API
+from wordpress.helpers import StrUtils, UrlUtils
+
+
+def legacy_endpoint_url(requester, endpoint, api_version=None):
+    endpoint = StrUtils.decapitate(endpoint, '/')
+    return UrlUtils.join_components([
+        requester.url,
+        requester.api,
+        api_version or requester.api_version,
+        endpoint
+    ])
+
+
+def main(iterations=100000):
+    api = API(
+        url="https://woo.test/shop",
+        consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+        consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+        version="wc/v2"
+    )
+    requester = api.requester
+    route = api.route('products/{id}/variations/{vid}')
+    endpoint = 'products/%d/variations/%d' % (12, 34)
+    assert legacy_endpoint_url(requester, endpoint) == requester.endpoint_url(endpoint) \
+        == route.url(id=12, vid=34)
+
+    cases = [
+        ('join per request', lambda: legacy_endpoint_url(
+            requester, 'products/%d/variations/%d' % (12, 34)
+        )),
+        ('endpoint_url', lambda: requester.endpoint_url(
+            'products/%d/variations/%d' % (12, 34)
+        )),
+        ('route.url', lambda: route.url(id=12, vid=34)),
+        ('is_ssl parsed', lambda: UrlUtils.is_ssl(requester.url)),
+        ('is_ssl cached', lambda: requester.is_ssl),
+    ]
+    print("%-18s %10s" % ("case", "us/call"))
+    for name, func in cases:
+        seconds = timeit.timeit(func, number=iterations)
+        print("%-18s %10.2f" % (name, seconds / iterations * 1e6))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
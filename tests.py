@@ -10,12 +10,38 @@ from collections import OrderedDict
 import wordpress
 from wordpress import oauth
 from wordpress import __default_api_version__, __default_api__
-from wordpress.helpers import UrlUtils, SeqUtils, StrUtils
+from wordpress.helpers import UrlUtils, SeqUtils, StrUtils, PoolUtils
 from wordpress.transport import API_Requests_Wrapper
 from wordpress.api import API
 from wordpress.oauth import OAuth
+from wordpress.cache import ResponseCache, MemoryCache, FileCache
+from wordpress.retry import RetryPolicy
+from wordpress.ratelimit import TokenBucket, FileTokenBucket
+from wordpress.tokens import MemoryTokenStore, FileTokenStore, OAuth2TokenManager, OAuth2Grant
+from wpoauth2.oauth2 import OAuth2
+from wordpress.discovery import RouteTable
+from wordpress.exceptions import APIError, RateLimited, AuthError, ServerError
+from wordpress.serializers import JSONBackend, JSONArrayParser
+from wordpress.bulk import IdFetch
+from wordpress.records import Record, FieldSelection
+from wordpress.sync import DeltaSync, MemoryCheckpointStore, FileCheckpointStore
+from wordpress.export import Exporter, Compression
+from requests.exceptions import ConnectionError
 import random
 import platform
+import json
+import threading
+import time
+import socket
+import os
+import subprocess
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
 
 try:
     from urllib.parse import urlencode, quote, unquote, parse_qs, parse_qsl, urlparse, urlunparse
@@ -40,6 +66,78 @@ def debug_on(*exceptions):
         return wrapper
     return decorator
 
+class LocalServer(ThreadingMixIn, HTTPServer):
+    """ Stand-in API server on a free local port that echoes each request back
+    as JSON, optionally after a delay, so clients can be tested offline """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.requests = []
+        self.connections = []
+        HTTPServer.__init__(self, ('127.0.0.1', 0), LocalRequestHandler)
+
+    def process_request(self, request, client_address):
+        self.connections.append(request)
+        ThreadingMixIn.process_request(self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        # clients hanging up on kept-alive connections is expected
+        pass
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def __enter__(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        # end the handler threads still waiting on kept-alive connections
+        for connection in self.connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+class LocalRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # send each response in one write, avoiding delayed ACK stalls
+    wbufsize = -1
+
+    def handle_request(self):
+        length = int(self.headers.get('content-length') or 0)
+        body = self.rfile.read(length) if length else b''
+        record = {
+            'method': self.command,
+            'path': urlparse(self.path).path,
+            'query': dict(parse_qsl(urlparse(self.path).query)),
+            'authorization': self.headers.get('authorization'),
+            'body': body.decode('utf-8'),
+        }
+        self.server.requests.append(record)
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        content = json.dumps(record).encode('utf-8')
+        self.send_response(201 if self.command == 'POST' else 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_OPTIONS = handle_request
+
+    def log_message(self, *args):
+        pass
+
 class WordpressTestCase(unittest.TestCase):
     """Test case for the client methods."""
 
@@ -182,11 +280,1779 @@ class WordpressTestCase(unittest.TestCase):
         check_sorted(['d', 'b[c]', 'b[a]', 'b[b]', 'c'], ['b[c]', 'b[a]', 'b[b]', 'c', 'd'])
         check_sorted(['a1', 'b[c]', 'b[a]', 'b[b]', 'a2'], ['a1', 'a2', 'b[c]', 'b[a]', 'b[b]'])
 
+class PaginationTestCases(unittest.TestCase):
+    def setUp(self):
+        self.api = wordpress.API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        )
+        self.requested = []
+
+    def paged_mock(self, total_items, headers_for_page=None):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            query = dict(parse_qsl(url.query))
+            self.requested.append(query)
+            page, per_page = int(query['page']), int(query['per_page'])
+            total_pages = (total_items + per_page - 1) // per_page
+            items = [
+                {'id': i} for i in range((page - 1) * per_page, min(page * per_page, total_items))
+            ]
+            headers = {'X-WP-Total': str(total_items), 'X-WP-TotalPages': str(total_pages)}
+            if headers_for_page:
+                headers = headers_for_page(page, total_pages)
+            return {'status_code': 200,
+                    'headers': headers,
+                    'content': json.dumps(items)}
+        return woo_test_mock
+
+    def test_iter_collection(self):
+        with HTTMock(self.paged_mock(25)):
+            items = list(self.api.iter_collection('products?status=publish', per_page=10))
+        self.assertEqual([item['id'] for item in items], list(range(25)))
+        self.assertEqual([query['page'] for query in self.requested], ['1', '2', '3'])
+        self.assertTrue(all(query['status'] == 'publish' for query in self.requested))
+
+    def test_iter_collection_link_header(self):
+        def link_headers(page, total_pages):
+            if page < total_pages:
+                return {'Link': '<http://woo.test/wp-json/wp/v2/posts?page=%d>; rel="next"' % (page + 1)}
+            return {'Link': '<http://woo.test/wp-json/wp/v2/posts?page=%d>; rel="prev"' % (page - 1)}
+
+        with HTTMock(self.paged_mock(7, link_headers)):
+            items = list(self.api.iter_collection('posts', per_page=3))
+        self.assertEqual([item['id'] for item in items], list(range(7)))
+        self.assertEqual(len(self.requested), 3)
+
+    def test_iter_collection_without_headers(self):
+        with HTTMock(self.paged_mock(6, lambda page, total_pages: {})):
+            items = list(self.api.iter_collection('posts', per_page=3))
+        self.assertEqual(len(items), 6)
+        # the last full page gives no hint that it is the last
+        self.assertEqual(len(self.requested), 3)
+
+    def test_iter_collection_legacy_envelope(self):
+        @all_requests
+        def woo_test_mock(*args, **kwargs):
+            """ URL Mock """
+            return {'status_code': 200,
+                    'headers': {'X-WC-TotalPages': '1'},
+                    'content': json.dumps({'products': [{'id': 1}, {'id': 2}]})}
+
+        with HTTMock(woo_test_mock):
+            items = list(self.api.iter_collection('products'))
+        self.assertEqual(items, [{'id': 1}, {'id': 2}])
+
+    def test_iter_collection_concurrent(self):
+        with HTTMock(self.paged_mock(95)):
+            items = list(self.api.iter_collection('products', per_page=10, concurrency=4))
+        self.assertEqual([item['id'] for item in items], list(range(95)))
+        self.assertEqual(len(self.requested), 10)
+        nonces = [query['oauth_nonce'] for query in self.requested]
+        self.assertEqual(len(set(nonces)), len(nonces))
+
+    def test_iter_collection_concurrent_unordered(self):
+        with HTTMock(self.paged_mock(95)):
+            items = list(self.api.iter_collection(
+                'products', per_page=10, concurrency=4, ordered=False
+            ))
+        self.assertEqual(sorted(item['id'] for item in items), list(range(95)))
+
+    def test_iter_collection_concurrent_without_total(self):
+        with HTTMock(self.paged_mock(6, lambda page, total_pages: {})):
+            items = list(self.api.iter_collection('posts', per_page=3, concurrency=4))
+        self.assertEqual([item['id'] for item in items], list(range(6)))
+        self.assertEqual([query['page'] for query in self.requested], ['1', '2', '3'])
+
+class QueryParamsTestCases(unittest.TestCase):
+    def setUp(self):
+        self.requested = []
+
+    def api(self, url, **kwargs):
+        return API(
+            url=url,
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            **kwargs
+        )
+
+    def mock(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requested.append(parse_qsl(url.query))
+            return {'status_code': 200, 'content': '[]'}
+        return woo_test_mock
+
+    def test_signed(self):
+        api = self.api("http://woo.test", cache=ResponseCache(ttls={"posts": 60}))
+        with HTTMock(self.mock()):
+            api.get('posts?status=publish', params={'include': [5, 4], 'orderby': 'include'})
+            # the query is part of the cache key
+            api.get('posts?status=publish', params={'include': [5, 4], 'orderby': 'include'})
+            api.get('posts?status=publish', params={'include': [6], 'orderby': 'include'})
+            api.delete('posts/1', params={'force': True})
+        query = dict(self.requested[0])
+        self.assertEqual([query['include[0]'], query['include[1]']], ['5', '4'])
+        self.assertEqual(query['orderby'], 'include')
+        self.assertEqual(query['status'], 'publish')
+        self.assertIn('oauth_signature', query)
+        self.assertEqual(len(self.requested), 3)
+        self.assertEqual(dict(self.requested[2])['force'], '1')
+
+    def test_basic_auth(self):
+        api = self.api("https://woo.test")
+        with HTTMock(self.mock()):
+            api.get('products', params={'include': [5, 4], 'filter': {'limit': 2}})
+        query = self.requested[0]
+        self.assertEqual([value for key, value in query if key == 'include[]'], ['5', '4'])
+        self.assertIn(('filter[limit]', '2'), query)
+        self.assertNotIn('oauth_signature', dict(query))
+
+class RecordTestCases(unittest.TestCase):
+    def test_selection(self):
+        self.assertEqual(FieldSelection().query(), [])
+        self.assertEqual(FieldSelection(['id', 'title']).query(), [('_fields', 'id,title')])
+        self.assertEqual(FieldSelection(embed=True).query(), [('_embed', '1')])
+        # embedding with a field list needs the links among the fields
+        self.assertEqual(FieldSelection(['id'], ['author', 'wp:term']).query(), [
+            ('_fields', 'id,_links,_embedded'), ('_embed', 'author,wp:term')
+        ])
+        selection = FieldSelection(['id', 'meta.color', 'meta.size'])
+        self.assertEqual(selection.record_type.__slots__, ('id', 'meta'))
+        self.assertIs(selection.record_type, FieldSelection(['id', 'meta']).record_type)
+        self.assertEqual(FieldSelection().record({'id': 1}), {'id': 1})
+        # fields that can't be slots keep items as dicts
+        self.assertEqual(FieldSelection(['id', 'acf-field']).record({'id': 1, 'acf-field': 2}),
+                         {'id': 1, 'acf-field': 2})
+        self.assertIsNone(FieldSelection(['id', 'get']).record_type)
+        self.assertIsNone(FieldSelection(['class']).record_type)
+
+    def test_record(self):
+        record = FieldSelection(['id', 'title', '_embedded'], True).record(
+            {'id': 7, 'title': {'rendered': 'Hi'}, '_links': {}}
+        )
+        self.assertEqual(record.id, 7)
+        self.assertEqual(record['title'], {'rendered': 'Hi'})
+        self.assertIsNone(record._embedded)
+        self.assertEqual(record.get('missing', 1), 1)
+        self.assertEqual(record, {'id': 7, 'title': {'rendered': 'Hi'}, '_embedded': None, '_links': {}})
+        self.assertEqual(list(record._asdict()), ['id', 'title', '_embedded', '_links'])
+        self.assertRaises(KeyError, lambda: record['missing'])
+        with self.assertRaises(AttributeError):
+            record.id = 8
+        # no per object __dict__
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_get_and_iter_collection(self):
+        requested = []
+        api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        )
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            requested.append(dict(parse_qsl(url.query)))
+            return {'status_code': 200,
+                    'headers': {'X-WP-TotalPages': '1'},
+                    'content': json.dumps([{'id': 1, 'title': 'a'}, {'id': 2, 'title': 'b'}])}
+
+        with HTTMock(woo_test_mock):
+            api.get('posts', fields=['id', 'title'], embed=True)
+            records = list(api.iter_collection('posts', fields=['id', 'title']))
+            streamed = list(api.iter_items('posts', fields=['id', 'title']))
+            # a plain response needs no Record type, whatever the field names
+            self.assertEqual(api.get('posts', fields=['id', 'acf-field']).status_code, 200)
+        self.assertEqual(requested[0]['_fields'], 'id,title,_links,_embedded')
+        self.assertEqual(requested[0]['_embed'], '1')
+        self.assertIn('oauth_signature', requested[0])
+        self.assertEqual(requested[1]['_fields'], 'id,title')
+        self.assertEqual([(record.id, record.title) for record in records], [(1, 'a'), (2, 'b')])
+        self.assertEqual(streamed, records)
+
+class AsyncAPITestCases(unittest.TestCase):
+    def setUp(self):
+        self.consumer_key = "ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        self.consumer_secret = "cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+
+    def test_oauth1_signed_requests(self):
+        with LocalServer(delay=0.05) as server:
+            api = wordpress.AsyncAPI(
+                url=server.url,
+                consumer_key=self.consumer_key,
+                consumer_secret=self.consumer_secret,
+                max_in_flight=20
+            )
+            start = time.time()
+            results = [api.get("products/%d" % i) for i in range(40)]
+            responses = api.gather(results)
+            elapsed = time.time() - start
+            api.close()
+
+        self.assertEqual(
+            [response.json()['path'] for response in responses],
+            ["/wp-json/wp/v2/products/%d" % i for i in range(40)]
+        )
+        nonces = set(request['query']['oauth_nonce'] for request in server.requests)
+        self.assertEqual(len(nonces), 40)
+        # 40 requests of 50ms each over 20 workers, well under the 2s serial time
+        self.assertLess(elapsed, 1.0)
+
+    def test_write_methods(self):
+        with LocalServer() as server:
+            api = wordpress.AsyncAPI(
+                url=server.url,
+                consumer_key=self.consumer_key,
+                consumer_secret=self.consumer_secret
+            )
+            post = api.post("products", {"name": "test"}).get()
+            put = api.put("products/1", {"name": "test"}).get()
+            delete = api.delete("products/1").get()
+            api.close()
+        self.assertEqual(post.status_code, 201)
+        self.assertEqual(json.loads(post.json()['body']), {"name": "test"})
+        self.assertEqual(put.json()['method'], 'PUT')
+        self.assertEqual(delete.json()['method'], 'DELETE')
+
+    def test_bearer_token(self):
+        with LocalServer() as server:
+            api = wordpress.AsyncAPI(
+                url=server.url,
+                consumer_key=self.consumer_key,
+                consumer_secret=self.consumer_secret,
+                oauth_version=2,
+                token='abc123'
+            )
+            response = api.get("posts").get()
+            api.close()
+        self.assertEqual(response.json()['authorization'], 'Bearer abc123')
+        self.assertNotIn('oauth_signature', response.json()['query'])
+
+    def test_basic_auth_over_ssl(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            return {'status_code': 200,
+                    'content': json.dumps({'authorization': request.headers.get('Authorization')})}
+
+        api = wordpress.AsyncAPI(
+            url="https://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret
+        )
+        with HTTMock(woo_test_mock):
+            response = api.get("products").get()
+        api.close()
+        self.assertTrue(response.json()['authorization'].startswith('Basic '))
+
+    def test_query_string_auth(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            return {'status_code': 200,
+                    'content': json.dumps(dict(parse_qsl(url.query)))}
+
+        api = wordpress.AsyncAPI(
+            url="https://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            query_string_auth=True
+        )
+        with HTTMock(woo_test_mock):
+            response = api.get("products").get()
+        api.close()
+        self.assertEqual(response.json()['consumer_key'], self.consumer_key)
+
+    def test_errors_raise_on_get(self):
+        @all_requests
+        def woo_test_mock(*args, **kwargs):
+            """ URL Mock """
+            return {'status_code': 500,
+                    'content': 'Internal Server Error'}
+
+        api = wordpress.AsyncAPI(
+            url="http://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret
+        )
+        with HTTMock(woo_test_mock):
+            result = api.get("products")
+            self.assertRaises(AssertionError, result.get)
+        api.close()
+
+    def test_iter_collection(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            page = int(dict(parse_qsl(url.query))['page'])
+            return {'status_code': 200,
+                    'headers': {'X-WP-TotalPages': '3'},
+                    'content': json.dumps([{'id': page}])}
+
+        api = wordpress.AsyncAPI(
+            url="http://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret
+        )
+        with HTTMock(woo_test_mock):
+            items = list(api.iter_collection("products"))
+        api.close()
+        self.assertEqual(items, [{'id': 1}, {'id': 2}, {'id': 3}])
+
+class ThreadSafetyTestCases(unittest.TestCase):
+    def setUp(self):
+        self.consumer_key = "ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        self.consumer_secret = "cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+
+    def run_threads(self, count, target):
+        threads = [threading.Thread(target=target) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def test_thread_sessions(self):
+        requester = API_Requests_Wrapper(url='https://woo.test')
+        sessions = []
+        self.run_threads(4, lambda: sessions.extend([requester.session, requester.session]))
+        self.assertEqual(len(set(map(id, sessions))), 4)
+        self.assertTrue(all(
+            session.get_adapter('https://woo.test') is requester.adapter for session in sessions
+        ))
+
+        shared_requester = API_Requests_Wrapper(url='https://woo.test', thread_sessions=False)
+        sessions = []
+        self.run_threads(4, lambda: sessions.append(shared_requester.session))
+        self.assertEqual(len(set(map(id, sessions))), 1)
+
+    def test_single_flight_3leg_discovery(self):
+        api = API(
+            url="http://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            oauth1a_3leg=True,
+            wp_user='test_user',
+            wp_pass='test_pass',
+            callback='http://127.0.0.1/oauth1_callback'
+        )
+        discoveries = []
+
+        @urlmatch(path=r'.*wp-json.*')
+        def woo_api_mock(*args, **kwargs):
+            """ URL Mock """
+            discoveries.append(1)
+            time.sleep(0.05)
+            return {'status_code': 200,
+                    'content': json.dumps({'authentication': {'oauth1': {}}})}
+
+        results = []
+        with HTTMock(woo_api_mock):
+            self.run_threads(8, lambda: results.append(api.oauth.authentication))
+        self.assertEqual(len(discoveries), 1)
+        self.assertEqual(results, [{'oauth1': {}}] * 8)
+
+    def measure_throughput(self, server, thread_count, request_count, **kwargs):
+        api = API(
+            url=server.url,
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            pool_maxsize=32,
+            **kwargs
+        )
+        endpoints = ["products/%d" % i for i in range(request_count)]
+        paths = []
+        lock = threading.Lock()
+
+        def worker():
+            while True:
+                with lock:
+                    if not endpoints:
+                        return
+                    endpoint = endpoints.pop()
+                paths.append(api.get(endpoint).json()['path'])
+
+        start = time.time()
+        self.run_threads(thread_count, worker)
+        elapsed = time.time() - start
+        self.assertEqual(
+            sorted(paths), sorted("/wp-json/wp/v2/products/%d" % i for i in range(request_count))
+        )
+        return request_count / elapsed
+
+    def test_throughput_scaling(self):
+        """ Stress a shared client from 1 to 32 threads against a server taking 10ms a request """
+        for kwargs in [{}, {'thread_sessions': False}]:
+            with LocalServer(delay=0.01) as server:
+                throughput = dict(
+                    (thread_count, self.measure_throughput(server, thread_count, 64, **kwargs))
+                    for thread_count in [1, 2, 4, 8, 16, 32]
+                )
+            self.assertGreater(throughput[8], 3 * throughput[1])
+            self.assertGreater(throughput[32], 3 * throughput[1])
+
+class BatchTestCases(unittest.TestCase):
+    def setUp(self):
+        self.consumer_key = "ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        self.consumer_secret = "cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        self.requests = []
+
+    def api(self, version):
+        return API(
+            url="https://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            version=version
+        )
+
+    def test_wc_batch(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requests.append(url.path)
+            body = json.loads(request.body)
+            response = {}
+            for action in ['create', 'update', 'delete']:
+                response[action] = []
+                for item in body.get(action, []):
+                    if action == 'delete':
+                        item = {'id': item}
+                    if item.get('id') == 13:
+                        item = {'id': 13, 'error': {'code': 'woocommerce_rest_invalid_id', 'message': 'Invalid ID.'}}
+                    response[action].append(item)
+            return {'status_code': 200,
+                    'content': json.dumps(response)}
+
+        with HTTMock(woo_test_mock):
+            report = self.api('wc/v2').batch(
+                'products',
+                create=[{'name': 'new %d' % i} for i in range(10)],
+                update=[{'id': i, 'regular_price': '9.99'} for i in range(200)],
+                delete=[500, 501],
+                concurrency=2
+            )
+
+        self.assertEqual(self.requests, ['/wp-json/wc/v2/products/batch'] * 3)
+        self.assertEqual(report.requests, 3)
+        self.assertEqual(len(report.created), 10)
+        self.assertEqual([item['id'] for item in report.updated], [i for i in range(200) if i != 13])
+        self.assertEqual(report.deleted, [{'id': 500}, {'id': 501}])
+        self.assertEqual(len(report.errors), 1)
+        self.assertEqual(report.errors[0]['action'], 'update')
+        self.assertEqual(report.errors[0]['item'], {'id': 13, 'regular_price': '9.99'})
+        self.assertFalse(report.ok)
+
+    def test_wp_batch(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requests.append(url.path)
+            body = json.loads(request.body)
+            self.assertTrue(len(body['requests']) <= 25)
+            responses = []
+            for sub_request in body['requests']:
+                status = 404 if sub_request['path'].endswith('/404') else 200
+                responses.append({'status': status, 'body': sub_request})
+            return {'status_code': 207,
+                    'content': json.dumps({'responses': responses})}
+
+        with HTTMock(woo_test_mock):
+            report = self.api('wp/v2').batch(
+                'posts',
+                create=[{'title': 'post %d' % i} for i in range(20)],
+                update=[{'id': i, 'title': 'updated'} for i in range(10)],
+                delete=[404, {'id': 7, 'force': True}]
+            )
+
+        self.assertEqual(self.requests, ['/wp-json/batch/v1'] * 2)
+        self.assertEqual(len(report.created), 20)
+        self.assertEqual(report.created[0]['path'], '/wp/v2/posts')
+        self.assertEqual(report.updated[3], {'method': 'PUT', 'path': '/wp/v2/posts/3', 'body': {'title': 'updated'}})
+        self.assertEqual(report.deleted, [{'method': 'DELETE', 'path': '/wp/v2/posts/7', 'body': {'force': True}}])
+        self.assertEqual([error['item'] for error in report.errors], [404])
+
+    def test_wp_batch_without_id(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            body = json.loads(request.body)
+            return {'status_code': 207,
+                    'content': json.dumps({'responses': [
+                        {'status': 200, 'body': sub_request} for sub_request in body['requests']
+                    ]})}
+
+        with HTTMock(woo_test_mock):
+            report = self.api('wp/v2').batch(
+                'posts',
+                update=[{'id': 1, 'title': 'a'}, {'title': 'no id'}],
+                delete=[{'force': True}, 2]
+            )
+        self.assertEqual(len(report.updated), 1)
+        self.assertEqual(len(report.deleted), 1)
+        self.assertEqual([(error['action'], error['item']) for error in report.errors], [
+            ('update', {'title': 'no id'}), ('delete', {'force': True})
+        ])
+        self.assertEqual(report.errors[0]['error'], "update item has no id")
+
+    def test_failed_chunk(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            body = json.loads(request.body)
+            if body['update'][0]['id'] == 0:
+                return {'status_code': 502, 'content': 'Bad Gateway'}
+            return {'status_code': 200,
+                    'content': json.dumps(body)}
+
+        with HTTMock(woo_test_mock):
+            report = self.api('wc/v2').batch(
+                'products',
+                update=[{'id': i} for i in range(15)],
+                chunk_size=10
+            )
+        self.assertEqual(len(report.updated), 5)
+        self.assertEqual([error['item']['id'] for error in report.errors], list(range(10)))
+
+    def test_legacy_api(self):
+        api = API(
+            url="https://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            api='wc-api',
+            version='v3'
+        )
+        self.assertRaises(UserWarning, api.batch, 'products', update=[{'id': 1}])
+
+class GetManyTestCases(unittest.TestCase):
+    def setUp(self):
+        self.api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            version="wc/v3"
+        )
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def mock(self, fail_id=None):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            query = parse_qsl(url.query)
+            include = [int(value) for key, value in query if key.startswith('include[')]
+            with self.lock:
+                self.requested.append((request.url, dict(query), include))
+            # checked as the server checks it, from the query as sent
+            if not verify_php_signature(self.api.oauth, request.method, request.url):
+                return {'status_code': 401, 'content': '{"code": "woocommerce_rest_authentication_error"}'}
+            if fail_id in include:
+                return {'status_code': 500, 'content': '{}'}
+            self.assertLessEqual(len(include), int(dict(query)['per_page']))
+            # every seventh ID doesn't exist
+            return {'status_code': 200,
+                    'content': json.dumps([{'id': id_} for id_ in include if id_ % 7])}
+        return woo_test_mock
+
+    def test_get_many(self):
+        ids = list(range(1, 1001))
+        with HTTMock(self.mock()):
+            result = self.api.get_many('products', ids + [5, 6])
+        self.assertEqual(len(self.requested), 10)
+        self.assertEqual(result.requests, 10)
+        self.assertTrue(all(len(url) <= IdFetch.url_max for url, query, include in self.requested))
+        self.assertEqual(sorted(sum((include for _, _, include in self.requested), [])), ids)
+        self.assertEqual(sorted(result), [id_ for id_ in ids if id_ % 7])
+        self.assertEqual(result[8], {'id': 8})
+        self.assertEqual(sorted(result.missing), [id_ for id_ in ids if not id_ % 7])
+        self.assertFalse(result.errors)
+        self.assertFalse(result.ok)
+
+    def test_signed_chunks(self):
+        # more than 10 IDs, where sorting the numbered keys as strings would put include[10] before include[2]
+        with HTTMock(self.mock()):
+            result = self.api.get_many('products', list(range(1, 31)), params={'filter': {'b': 1, 'a': 2}})
+        self.assertFalse(result.errors)
+        self.assertEqual(result.requests, 1)
+        self.assertEqual(self.requested[0][2], list(range(1, 31)))
+
+    def test_url_limit(self):
+        ids = [10 ** 30 + i for i in range(300)]
+        with HTTMock(self.mock()):
+            result = self.api.get_many('products', ids, chunk_size=500)
+        self.assertTrue(all(len(url) <= IdFetch.url_max for url, query, include in self.requested))
+        self.assertGreater(len(self.requested), 3)
+        self.assertEqual(len(result) + len(result.missing), 300)
+
+    def test_fields_params_and_errors(self):
+        with HTTMock(self.mock(fail_id=150)):
+            result = self.api.get_many(
+                'products', [str(id_) for id_ in range(1, 251)], fields=['name'],
+                params={'status': 'any'}, concurrency=1
+            )
+        query = self.requested[0][1]
+        self.assertEqual(query['_fields'], 'name,id')
+        self.assertEqual(query['status'], 'any')
+        # keyed by the IDs as given, as records of the fields
+        self.assertEqual((result['1'].id, result['1'].name), (1, None))
+        self.assertEqual(sorted(result.errors, key=int), [str(id_) for id_ in range(101, 201)])
+        self.assertIsInstance(result.errors['150'], ServerError)
+        self.assertEqual(len(result) + len(result.missing), 150)
+
+class DeltaSyncTestCases(unittest.TestCase):
+    def setUp(self):
+        self.api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            version="wc/v3"
+        )
+        # id -> modified second, as an offset from a base time
+        self.items = dict((id_, id_ // 10) for id_ in range(1, 96))
+        self.queries = []
+        self.upserted = []
+        self.on_request = None
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def modified(self, offset):
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(1700000000 + offset))
+
+    def mock(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            query = dict(parse_qsl(url.query))
+            self.queries.append(query)
+            if self.on_request:
+                self.on_request(len(self.queries))
+            items = sorted(self.items.items(), key=lambda item: (item[1], -item[0]))
+            if 'modified_after' in query:
+                self.assertEqual(query['dates_are_gmt'], 'true')
+                items = [item for item in items if self.modified(item[1]) > query['modified_after']]
+            self.assertEqual((query['orderby'], query['order']), ('modified', 'asc'))
+            page, per_page = int(query['page']), int(query['per_page'])
+            page_items = items[(page - 1) * per_page:page * per_page]
+            return {'status_code': 200,
+                    'headers': {
+                        'X-WP-TotalPages': str(max((len(items) + per_page - 1) // per_page, 1)),
+                        'Date': 'Wed, 01 Jan 2020 00:00:00 GMT',
+                    },
+                    'content': json.dumps([
+                        {'id': id_, 'date_modified_gmt': self.modified(offset), 'name': 'p%d' % id_}
+                        for id_, offset in page_items
+                    ])}
+        return woo_test_mock
+
+    def sync(self, store, **kwargs):
+        with HTTMock(self.mock()):
+            return self.api.delta_sync(
+                'products', lambda item: self.upserted.append(item['id']), store,
+                per_page=7, **kwargs
+            )
+
+    def test_delta_sync(self):
+        store = MemoryCheckpointStore()
+        report = self.sync(store)
+        self.assertEqual(sorted(self.upserted), sorted(self.items))
+        self.assertEqual(report.upserts, 95)
+        # the server clock hasn't passed the last second, so it's synced again
+        self.assertEqual(report.watermark, {'modified_gmt': self.modified(8), 'id': 89})
+        self.upserted = []
+        first_query = len(self.queries)
+        self.sync(store)
+        self.assertEqual(sorted(self.upserted), list(range(90, 96)))
+        # from the second before the watermark, which modified_after excludes
+        self.assertEqual(self.queries[first_query]['modified_after'], self.modified(7))
+        self.upserted = []
+        self.items[3] = self.items[50] = 20
+        self.items[96] = 21
+        self.sync(store)
+        self.assertEqual(sorted(self.upserted), [3, 50, 90, 91, 92, 93, 94, 95, 96])
+
+    def test_settled(self):
+        store = MemoryCheckpointStore()
+        for id_ in self.items:
+            self.items[id_] = -3 * 10 ** 8
+        report = self.sync(store)
+        self.assertEqual(report.watermark, {'modified_gmt': self.modified(-3 * 10 ** 8), 'id': 95})
+        self.upserted = []
+        self.assertEqual(self.sync(store).upserts, 0)
+
+    def test_resume_after_crash(self):
+        store = FileCheckpointStore(os.path.join(self.directory, 'sync.json'))
+        calls = {'count': 0}
+
+        def crashing_upsert(item):
+            calls['count'] += 1
+            if calls['count'] == 40:
+                raise IOError("database went away")
+            self.upserted.append(item['id'])
+
+        with HTTMock(self.mock()):
+            with self.assertRaises(IOError):
+                self.api.delta_sync('products', crashing_upsert, store, per_page=7)
+            stored = DeltaSync(self.api, 'products', None, store).watermark
+            self.assertLess(stored['id'], 40)
+            report = self.api.delta_sync('products', crashing_upsert, store, per_page=7)
+        self.assertEqual(sorted(set(self.upserted)), sorted(self.items))
+        # only the items after the stored watermark, in the second being synced, are passed again
+        self.assertLessEqual(len(self.upserted), 95 + 10)
+        self.assertEqual(report.watermark['id'], 89)
+
+    def test_changes_during_run(self):
+        # items modified while the run is paging move to the end
+        def on_request(count):
+            if count == 5:
+                self.items[1] = self.items[2] = 30
+        self.on_request = on_request
+        self.sync(MemoryCheckpointStore())
+        self.assertEqual(sorted(set(self.upserted)), sorted(self.items))
+        self.assertEqual(self.upserted.count(1), 2)
+
+    def test_fields(self):
+        self.sync(MemoryCheckpointStore(), fields=['name'])
+        self.assertEqual(self.queries[0]['_fields'], 'name,id,date_modified_gmt,modified_gmt')
+        self.assertEqual(len(self.upserted), 95)
+
+class ExportTestCases(unittest.TestCase):
+    def setUp(self):
+        self.api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            version="wc/v3"
+        )
+        self.pages = []
+        self.fail_page = None
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'products.jsonl')
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            query = dict(parse_qsl(url.query))
+            page, per_page = int(query['page']), int(query['per_page'])
+            if page == self.fail_page:
+                self.fail_page = None
+                raise ConnectionError("connection reset")
+            self.pages.append(page)
+            ids = range((page - 1) * per_page + 1, min(page * per_page, 45) + 1)
+            return {'status_code': 200,
+                    'headers': {'X-WP-TotalPages': str((45 + per_page - 1) // per_page)},
+                    'content': json.dumps([{'id': id_, 'name': u'caf\xe9 %d' % id_} for id_ in ids])}
+        self.woo_test_mock = woo_test_mock
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def export(self, path=None, **kwargs):
+        with HTTMock(self.woo_test_mock):
+            return self.api.export('products', path or self.path, per_page=10, **kwargs)
+
+    def read_ids(self, path=None, opener=open):
+        with opener(path or self.path, 'rb') as export_file:
+            return [json.loads(line.decode('utf-8'))['id'] for line in export_file]
+
+    def test_export(self):
+        reports = []
+        report = self.export(progress=lambda report: reports.append((report.pages, report.items)))
+        self.assertEqual(self.read_ids(), list(range(1, 46)))
+        self.assertEqual((report.pages, report.items, report.total_pages), (5, 45, 5))
+        self.assertTrue(report.complete)
+        self.assertEqual(report.bytes, os.path.getsize(self.path))
+        self.assertEqual(reports, [(1, 10), (2, 20), (3, 30), (4, 40), (5, 45)])
+        self.assertGreater(report.items_per_second, 0)
+        # a finished export isn't done again
+        self.pages = []
+        report = self.export()
+        self.assertEqual((self.pages, report.skipped_pages, report.complete), ([], 5, True))
+
+    def test_resume_after_crash(self):
+        self.fail_page = 4
+        with self.assertRaises(ConnectionError):
+            self.export(checkpoint_pages=2)
+        # a page written after the last checkpoint, and half a line, are cut off
+        with open(self.path, 'ab') as export_file:
+            export_file.write(b'{"id": 31, "na')
+        self.pages = []
+        report = self.export(checkpoint_pages=2)
+        self.assertEqual(self.pages, [3, 4, 5])
+        self.assertEqual((report.skipped_pages, report.pages, report.items), (2, 3, 25))
+        self.assertEqual(self.read_ids(), list(range(1, 46)))
+        self.assertEqual(Exporter(self.api, 'products', self.path).checkpoint['items'], 45)
+
+    def test_gzip(self):
+        import gzip
+        path = self.path + '.gz'
+        self.fail_page = 3
+        with self.assertRaises(ConnectionError):
+            self.export(path, checkpoint_pages=1)
+        report = self.export(path, checkpoint_pages=1)
+        # each checkpointed stretch is a gzip member of its own
+        self.assertEqual(self.read_ids(path, gzip.open), list(range(1, 46)))
+        with gzip.open(path, 'rb') as export_file:
+            lines = export_file.readlines()
+        self.assertEqual(report.bytes, sum(len(line) for line in lines[20:]))
+        self.assertLess(report.written, report.bytes)
+        with self.assertRaises(UserWarning):
+            Compression('bz2')
+
+    def test_concurrency(self):
+        report = self.export(concurrency=3)
+        self.assertEqual(self.read_ids(), list(range(1, 46)))
+        self.assertEqual(sorted(self.pages), [1, 2, 3, 4, 5])
+        self.assertEqual(report.items, 45)
+
+    def test_reset(self):
+        self.export()
+        Exporter(self.api, 'products', self.path).reset()
+        self.pages = []
+        self.export(params={'orderby': 'id', 'order': 'asc'})
+        self.assertEqual(self.pages, [1, 2, 3, 4, 5])
+        self.assertEqual(self.read_ids(), list(range(1, 46)))
+
+class ResponseCacheTestCases(unittest.TestCase):
+    def setUp(self):
+        self.consumer_key = "ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        self.consumer_secret = "cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        self.requests = []
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requests.append(request)
+            if request.headers.get('If-None-Match') == '"v1"':
+                return {'status_code': 304,
+                        'headers': {'ETag': '"v1"'},
+                        'content': ''}
+            return {'status_code': 200,
+                    'headers': {'ETag': '"v1"', 'Content-Type': 'application/json'},
+                    'content': json.dumps([{'id': 1, 'name': u'caf\u00e9'}])}
+        self.woo_test_mock = woo_test_mock
+
+    def api(self, cache):
+        return API(
+            url="http://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            cache=cache
+        )
+
+    def test_revalidation(self):
+        api = self.api(True)
+        with HTTMock(self.woo_test_mock):
+            first = api.get("products?per_page=5&page=2")
+            second = api.get("products?page=2&per_page=5")
+        self.assertNotIn('If-None-Match', self.requests[0].headers)
+        self.assertEqual(self.requests[1].headers['If-None-Match'], '"v1"')
+        # each request was signed with its own nonce
+        self.assertNotEqual(self.requests[0].url, self.requests[1].url)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.json(), first.json())
+        self.assertTrue(second.from_cache)
+        self.assertEqual(api.cache.stats, {'hits': 1, 'misses': 1, 'revalidations': 1})
+
+    def test_caller_headers_unchanged(self):
+        api = self.api(True)
+        headers = {'X-Test': '1'}
+        with HTTMock(self.woo_test_mock):
+            api.get("products", headers=headers)
+            api.get("products", headers=headers)
+            api.get("categories", headers=headers)
+        self.assertEqual(headers, {'X-Test': '1'})
+        self.assertEqual(self.requests[1].headers['If-None-Match'], '"v1"')
+        self.assertNotIn('If-None-Match', self.requests[2].headers)
+        self.assertEqual(self.requests[2].headers['X-Test'], '1')
+
+    def test_ttl(self):
+        api = self.api(ResponseCache(ttls={'wp/v2/products/categories': 60, 'settings': 0}))
+        with HTTMock(self.woo_test_mock):
+            api.get("products/categories")
+            cached = api.get("/products/categories")
+            api.get("products/categories/5")
+            api.get("products/categories/5")
+            api.get("settings")
+            api.get("settings")
+        self.assertTrue(cached.from_cache)
+        self.assertEqual(cached.json()[0]['id'], 1)
+        # settings have a ttl of 0 so they are revalidated every time
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual(api.cache.stats, {'hits': 3, 'misses': 3, 'revalidations': 1})
+
+    def test_ttl_without_validators(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requests.append(request)
+            return {'status_code': 200,
+                    'content': json.dumps({'namespaces': ['wp/v2']})}
+
+        api = self.api(ResponseCache(ttls={'taxonomies': 3600}))
+        with HTTMock(woo_test_mock):
+            api.get("taxonomies")
+            api.get("taxonomies")
+            api.get("posts")
+            api.get("posts")
+        self.assertEqual(len(self.requests), 3)
+
+    def test_invalidation(self):
+        api = self.api(ResponseCache(ttls={'products': 60}))
+        with HTTMock(self.woo_test_mock):
+            for endpoint in ["products", "products?page=2", "products/5", "products/5/variations", "products/6", "products/categories"]:
+                api.get(endpoint)
+            self.assertEqual(len(self.requests), 6)
+
+            self.assertEqual(api.cache.invalidate('products/categories'), 1)
+            api.put("products/5", {"name": "renamed"})
+            cached = [key.split(' ')[1].split('/wp/v2/')[1] for key in api.cache.backend.keys()]
+            self.assertEqual(sorted(cached), ["products/6"])
+
+            api.post("products/batch", {"update": []})
+            self.assertEqual(api.cache.backend.keys(), [])
+
+    def test_lru_size_cap(self):
+        api = self.api(ResponseCache(MemoryCache(max_entries=2), ttls={'': 60}))
+        with HTTMock(self.woo_test_mock):
+            for endpoint in ["posts/1", "posts/2", "posts/1", "posts/3", "posts/1", "posts/2"]:
+                api.get(endpoint)
+        self.assertEqual(len(self.requests), 4)
+
+    def test_file_cache(self):
+        import tempfile
+        import shutil
+        directory = tempfile.mkdtemp()
+        try:
+            with HTTMock(self.woo_test_mock):
+                self.api(FileCache(directory)).get("products")
+                api = self.api(FileCache(directory))
+                response = api.get("products")
+            self.assertEqual(response.json()[0]['name'], u'caf\u00e9')
+            self.assertEqual(api.cache.stats['hits'], 1)
+            self.assertEqual(len(api.cache.backend.keys()), 1)
+            key = api.cache.backend.keys()[0]
+            with open(api.cache.backend.path(key), 'rb') as cache_file:
+                self.assertEqual(json.loads(cache_file.read().decode('utf-8'))['key'], key)
+            # anything but a JSON entry, like a pickle, is a miss rather than loaded
+            import pickle
+            with open(api.cache.backend.path(key), 'wb') as cache_file:
+                pickle.dump({'key': key, 'content': b''}, cache_file, 2)
+            self.assertIsNone(api.cache.backend.get(key))
+            self.assertEqual(api.cache.backend.keys(), [])
+        finally:
+            shutil.rmtree(directory)
+
+    def test_shared_between_credentials(self):
+        backend = MemoryCache()
+
+        def client(consumer_key):
+            return API(
+                url="http://woo.test",
+                consumer_key=consumer_key,
+                consumer_secret=self.consumer_secret,
+                cache=ResponseCache(backend, ttls={'products': 60})
+            )
+        with HTTMock(self.woo_test_mock):
+            client("ck_admin").get("products")
+            client("ck_admin").get("products")
+            self.assertEqual(len(self.requests), 1)
+            # another consumer's fresh copy isn't served, it asks the server itself
+            response = client("ck_customer").get("products")
+        self.assertEqual(len(self.requests), 2)
+        self.assertFalse(getattr(response, 'from_cache', False))
+        self.assertIn('oauth_consumer_key=ck_customer', self.requests[1].url)
+        self.assertEqual(len(backend), 2)
+
+    def test_key(self):
+        self.assertEqual(
+            ResponseCache.key("GET", "http://woo.test/wp-json/wp/v2/posts?page=2&oauth_nonce=1&oauth_timestamp=2&oauth_signature=3&include%5B%5D=5&include%5B%5D=4"),
+            "GET http://woo.test/wp-json/wp/v2/posts?include%5B%5D=5&include%5B%5D=4&page=2"
+        )
+
+    def test_memory_cache_eviction(self):
+        cache = MemoryCache(max_bytes=250)
+        for key in ['a', 'b', 'c']:
+            cache.set(key, {'content': 'x' * 100, 'headers': {}})
+        self.assertEqual(cache.keys(), ['b', 'c'])
+        cache.get('b')
+        cache.set('d', {'content': 'x' * 100, 'headers': {}})
+        self.assertEqual(cache.keys(), ['b', 'd'])
+        self.assertEqual(cache.size, 200)
+        cache.set('e', {'content': 'x' * 300, 'headers': {}})
+        self.assertEqual(cache.keys(), ['b', 'd'])
+
+class RouteTestCases(unittest.TestCase):
+    def setUp(self):
+        self.api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            version="wc/v2"
+        )
+
+    def test_url(self):
+        route = self.api.route('/products/{id}/variations/{vid}')
+        self.assertEqual(route.fields, ['id', 'vid'])
+        self.assertEqual(route.endpoint(id=12, vid=34), 'products/12/variations/34')
+        self.assertEqual(route.url(id=12, vid=34), self.api.requester.endpoint_url('products/12/variations/34'))
+        self.assertEqual(
+            self.api.route('products/{slug}?sku={sku}').endpoint(slug=u'caf\xe9/x', sku='50%'),
+            'products/caf%C3%A9%2Fx?sku=50%25'
+        )
+        self.assertEqual(self.api.route('products').url(), 'http://woo.test/wp-json/wc/v2/products')
+        self.assertEqual(
+            self.api.route('posts/{id}', api_version='wp/v2').url(id=1),
+            'http://woo.test/wp-json/wp/v2/posts/1'
+        )
+        self.assertRaises(UserWarning, route.url, id=12)
+        # query values aren't fields, so they are refused rather than dropped
+        self.assertRaises(UserWarning, route.url, id=12, vid=34, per_page=10)
+
+    def test_request(self):
+        requests = []
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            requests.append((request.method, url.path, request.body, url.query))
+            return {'status_code': 200,
+                    'content': '{}'}
+
+        variation = self.api.route('products/{id}/variations/{vid}')
+        with HTTMock(woo_test_mock):
+            variation.get(id=1, vid=2)
+            variation.put({'regular_price': '9.99'}, id=1, vid=2)
+            self.api.route('posts/{id}', api_version='wp/v2').delete(id=3, params={'force': True})
+            self.api.route('products/{id}/variations').get(id=1, params={'per_page': 10, 'include': [4, 5]})
+            self.assertRaises(UserWarning, variation.get, id=1, vid=2, per_page=10)
+        self.assertEqual(len(requests), 4)
+        self.assertEqual(requests[0][:2], ('GET', '/wp-json/wc/v2/products/1/variations/2'))
+        self.assertEqual(requests[1][0], 'PUT')
+        self.assertEqual(json.loads(requests[1][2]), {'regular_price': '9.99'})
+        self.assertEqual(requests[2][:2], ('DELETE', '/wp-json/wp/v2/posts/3'))
+        self.assertEqual(dict(parse_qsl(requests[2][3]))['force'], '1')
+        query = parse_qsl(requests[3][3])
+        self.assertEqual(dict(query)['per_page'], '10')
+        self.assertEqual([value for key, value in query if key.startswith('include[')], ['4', '5'])
+
+class DiscoveryTestCases(unittest.TestCase):
+    index = {
+        "name": "Wordpress",
+        "namespaces": ["wp/v2", "wc/v3"],
+        "authentication": {
+            "oauth1": {
+                "request": "http://woo.test/oauth1/request",
+                "authorize": "http://woo.test/oauth1/authorize",
+                "access": "http://woo.test/oauth1/access",
+                "version": "0.1"
+            }
+        },
+        "routes": {
+            "/": {"namespace": "", "methods": ["GET"], "endpoints": [{"methods": ["GET"], "args": {}}]},
+            "/wc/v3/products": {
+                "namespace": "wc/v3",
+                "methods": ["GET", "POST"],
+                "endpoints": [
+                    {"methods": ["GET"], "args": {"per_page": {"type": "integer", "default": 10}}},
+                    {"methods": ["POST"], "args": {"name": {"type": "string"}}}
+                ]
+            },
+            "/wc/v3/products/(?P<id>[\\d]+)": {
+                "namespace": "wc/v3",
+                "methods": ["GET", "PUT", "PATCH", "DELETE"],
+                "endpoints": [{"methods": ["GET"], "args": {"id": {"type": "integer"}}}]
+            },
+            "/wp/v2/posts": {"namespace": "wp/v2", "methods": ["GET", "POST"], "endpoints": []}
+        }
+    }
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'index.json')
+        self.requests = []
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.directory)
+
+    def api(self, **kwargs):
+        return API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            version="wc/v3",
+            discovery_cache=self.path,
+            **kwargs
+        )
+
+    def mock(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requests.append(url.path)
+            if url.path == '/wp-json':
+                return {'status_code': 200,
+                        'content': json.dumps(self.index)}
+            return {'status_code': 200,
+                    'content': '[]'}
+        return woo_test_mock
+
+    def test_cached_index(self):
+        with HTTMock(self.mock()):
+            self.assertEqual(self.api().discovery.index['name'], 'Wordpress')
+            # a new client, as in a new process, reads the index from disk
+            discovery = self.api().discovery
+            self.assertEqual(discovery.authentication, self.index['authentication'])
+            self.assertEqual(self.requests, ['/wp-json'])
+            self.assertNotIn('routes', discovery.index)
+
+            expired = self.api(discovery_ttl=0).discovery
+            self.assertEqual(expired.index['name'], 'Wordpress')
+            self.assertEqual(self.requests, ['/wp-json', '/wp-json'])
+
+    def test_route_table(self):
+        with HTTMock(self.mock()):
+            table = self.api().discovery.route_table
+        self.assertEqual(table.namespaces, ['wp/v2', 'wc/v3'])
+        # namespaces are only decoded when looked up
+        self.assertEqual(table._routes, {})
+        path = RouteTable.path('products/12?context=edit', 'wc/v3')
+        self.assertEqual(path, '/wc/v3/products/12')
+        self.assertEqual(table.methods(path), ['GET', 'PUT', 'PATCH', 'DELETE'])
+        self.assertEqual(list(table._routes.keys()), ['wc/v3'])
+        self.assertEqual(table.args('/wc/v3/products', 'get'), {'per_page': {'type': 'integer', 'default': 10}})
+        self.assertEqual(table.args('/wc/v3/products', 'POST'), {'name': {'type': 'string'}})
+        self.assertIsNone(table.methods('/wc/v3/products/abc'))
+        self.assertEqual(table.methods('/'), ['GET'])
+        table.validate('POST', '/wp/v2/posts')
+        self.assertRaises(UserWarning, table.validate, 'DELETE', '/wc/v3/products')
+        self.assertRaises(UserWarning, table.validate, 'GET', '/wc/v3/orders')
+
+    def test_validate_routes(self):
+        api = self.api(validate_routes=True)
+        with HTTMock(self.mock()):
+            api.get('products/12')
+            self.assertRaises(UserWarning, api.get, 'orders')
+            self.assertRaises(UserWarning, api.post, 'products/12', {})
+        self.assertEqual(self.requests, ['/wp-json', '/wp-json/wc/v3/products/12'])
+
+    def test_oauth_3leg_discovery(self):
+        with HTTMock(self.mock()):
+            self.api().discovery.index
+            api = self.api(
+                oauth1a_3leg=True,
+                callback='http://127.0.0.1/oauth1_callback',
+                wp_user='test_user',
+                wp_pass='test_pass'
+            )
+            self.assertEqual(api.oauth.authentication, self.index['authentication'])
+        self.assertEqual(self.requests, ['/wp-json'])
+
+class OAuth2TokenTestCases(unittest.TestCase):
+    def setUp(self):
+        self.grants = []
+        self.refreshes = []
+        self.now = 1000.0
+        self.oauth2 = OAuth2("client_id", "client_secret", "http://woo.test", "")
+
+    def grant(self):
+        self.grants.append(True)
+        return {'access_token': 'granted_%d' % len(self.grants), 'refresh_token': 'refresh_1', 'expires_in': 100}
+
+    def manager(self, **kwargs):
+        kwargs.setdefault('background', False)
+        manager = OAuth2TokenManager(self.oauth2, self.grant, **kwargs)
+        manager.clock = lambda: self.now
+        return manager
+
+    def token_mock(self):
+        @urlmatch(path=r'/oauth/token')
+        def woo_token_mock(url, request):
+            """ URL Mock """
+            params = dict(parse_qsl(request.body))
+            self.refreshes.append(params)
+            if params['refresh_token'] != 'refresh_1':
+                return {'status_code': 400,
+                        'content': '{"error": "invalid_grant"}'}
+            return {'status_code': 200,
+                    'content': json.dumps({
+                        'access_token': 'refreshed_%d' % len(self.refreshes), 'expires_in': 100
+                    })}
+        return woo_token_mock
+
+    def test_expiry_and_refresh(self):
+        manager = self.manager()
+        with HTTMock(self.token_mock()):
+            self.assertEqual(manager.token, 'granted_1')
+            self.now += 99
+            self.assertEqual(manager.token, 'granted_1')
+            self.now += 1
+            self.assertEqual(manager.token, 'refreshed_1')
+            self.assertEqual(self.refreshes[0]['grant_type'], 'refresh_token')
+            # the refresh token is kept when the response has no new one
+            self.assertEqual(manager.refresh_token, 'refresh_1')
+
+            manager.invalidate('refreshed_1')
+            self.assertEqual(manager.token, 'refreshed_2')
+            manager.refresh_token = 'revoked'
+            manager.invalidate('refreshed_2')
+            # back to the grant when the refresh token is refused
+            self.assertEqual(manager.token, 'granted_2')
+        self.assertEqual((manager.grants, manager.refreshes), (2, 2))
+
+    def test_coalesced(self):
+        manager = self.manager()
+
+        def slow_grant():
+            time.sleep(0.1)
+            return self.grant()
+        manager.grant = slow_grant
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(manager.token)) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ['granted_1'] * 10)
+        self.assertEqual(len(self.grants), 1)
+
+    def test_background_refresh(self):
+        manager = self.manager(background=True)
+        with HTTMock(self.token_mock()):
+            self.assertEqual(manager.token, 'granted_1')
+            self.now += 99.9
+            manager.schedule()
+            for _ in range(100):
+                if manager.access_token != 'granted_1':
+                    break
+                time.sleep(0.01)
+            manager.close()
+        self.assertEqual(manager.access_token, 'refreshed_1')
+
+    def test_background_refresh_refused(self):
+        manager = self.manager(background=True)
+        with HTTMock(self.token_mock()):
+            self.assertEqual(manager.token, 'granted_1')
+            manager.refresh_token = 'revoked'
+            self.now += 99.9
+            manager.schedule()
+            for _ in range(100):
+                if self.refreshes:
+                    break
+                time.sleep(0.01)
+            time.sleep(0.05)
+            # the timer thread never falls back to the grant
+            self.assertEqual(manager.access_token, 'granted_1')
+            self.assertEqual(len(self.grants), 1)
+            self.assertIsInstance(manager.last_error, UserWarning)
+            # the next request, once the token expired, does
+            self.now += 0.1
+            self.assertEqual(manager.token, 'granted_2')
+            manager.close()
+
+    def test_refresh_delay(self):
+        manager = self.manager()
+        manager.set_token({'access_token': 'a', 'refresh_token': 'refresh_1', 'expires_in': 3600})
+        self.assertEqual(manager.refresh_delay(), 3600 - 60)
+        # tokens lasting no longer than the margin are refreshed halfway, not straight away
+        manager.set_token({'access_token': 'b', 'expires_in': 60})
+        self.assertEqual(manager.refresh_delay(), 30)
+        manager.set_token({'access_token': 'c', 'expires_in': 10})
+        self.assertEqual(manager.refresh_delay(), 5)
+
+    def test_close(self):
+        manager = self.manager(background=True)
+        self.assertEqual(manager.token, 'granted_1')
+        self.assertIsNotNone(manager._timer)
+        manager.close()
+        manager.set_token({'access_token': 'later', 'refresh_token': 'refresh_1'})
+        self.assertIsNone(manager._timer)
+
+    def test_persisted(self):
+        token_store = MemoryTokenStore()
+        self.assertEqual(self.manager(token_store=token_store).token, 'granted_1')
+        manager = self.manager(token_store=token_store)
+        self.assertEqual(manager.token, 'granted_1')
+        self.assertEqual(len(self.grants), 1)
+        self.assertEqual(token_store.get(manager.token_store_key)['expires_at'], 1100)
+
+        other_client = OAuth2("other_client", "client_secret", "http://woo.test", "")
+        token_store.set("oauth2 http://woo.test other_client", token_store.get(manager.token_store_key))
+        manager = OAuth2TokenManager(other_client, self.grant, token_store=token_store, background=False)
+        manager.load()
+        self.assertIsNone(manager.access_token)
+
+    def test_grants(self):
+        requests = []
+
+        @urlmatch(path=r'/oauth/token')
+        def woo_token_mock(url, request):
+            """ URL Mock """
+            params = dict(parse_qsl(request.body))
+            requests.append(params)
+            if params.get('password') == 'wrong':
+                return {'status_code': 401,
+                        'content': '{"error": "invalid_grant"}'}
+            return {'status_code': 200,
+                    'content': '{"access_token": "token", "expires_in": 3600}'}
+
+        environ = {'WP_OAUTH2_USERNAME': 'worker', 'WP_OAUTH2_PASSWORD': 'secret'}
+        with HTTMock(woo_token_mock):
+            self.assertEqual(OAuth2Grant.from_value(self.oauth2, environ=environ)()['access_token'], 'token')
+            self.assertEqual(requests[-1]['grant_type'], 'password')
+            self.assertEqual(requests[-1]['username'], 'worker')
+
+            OAuth2Grant.from_value(self.oauth2, 'client_credentials', environ={'WP_OAUTH2_SCOPE': 'read'})()
+            self.assertEqual(requests[-1]['grant_type'], 'client_credentials')
+            self.assertEqual(requests[-1]['scope'], 'read')
+
+            grant = OAuth2Grant.from_value(self.oauth2, {
+                'grant_type': 'password', 'username': 'worker', 'password': lambda: 'wrong'
+            })
+            self.assertRaises(UserWarning, grant)
+
+        self.assertEqual(OAuth2Grant.from_value(self.oauth2, environ={}).grant_type, 'interactive')
+        self.assertEqual(OAuth2Grant.from_value(self.oauth2, self.grant), self.grant)
+        self.assertRaises(UserWarning, OAuth2Grant.from_value, self.oauth2, 'password', {})
+
+    def test_headless_import(self):
+        # the login window needs Tk, which servers may not have
+        output = subprocess.check_output([sys.executable, '-c', (
+            "import sys; import wordpress; from wordpress.api import API; "
+            "API(url='http://woo.test', consumer_key='ck', consumer_secret='cs', oauth_version=2, token='t'); "
+            "print(sorted(name for name in ['Tkinter', 'tkMessageBox', 'wpoauth2.login_frame'] if name in sys.modules))"
+        )], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), b"[]")
+
+    def test_api(self):
+        api = API(
+            url="http://woo.test",
+            consumer_key="client_id",
+            consumer_secret="client_secret",
+            oauth_version=2,
+            oauth2_grant=self.grant
+        )
+        self.assertEqual(len(self.grants), 1)
+        authorizations = []
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            if url.path == '/oauth/token':
+                return {'status_code': 400,
+                        'content': '{"error": "invalid_grant"}'}
+            authorizations.append(request.headers['Authorization'])
+            if len(authorizations) == 1:
+                return {'status_code': 401,
+                        'content': '{"code": "invalid_token"}'}
+            return {'status_code': 200,
+                    'content': '[]'}
+
+        with HTTMock(woo_test_mock):
+            response = api.get('posts')
+        api.close()
+        self.assertEqual(response.status_code, 200)
+        # the refresh token is refused here, so the grant is used again
+        self.assertEqual(authorizations, ['Bearer granted_1', 'Bearer granted_2'])
+
+class RetryTestCases(unittest.TestCase):
+    def setUp(self):
+        self.requests = []
+        self.sleeps = []
+
+    def api(self, **policy_kwargs):
+        policy = RetryPolicy(**policy_kwargs)
+        policy.sleep = self.sleeps.append
+        return API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            retries=policy
+        )
+
+    def failing_mock(self, failures):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requests.append(dict(parse_qsl(url.query)))
+            if failures:
+                failure = failures.pop(0)
+                if isinstance(failure, Exception):
+                    raise failure
+                return failure
+            return {'status_code': 200,
+                    'content': 'OK'}
+        return woo_test_mock
+
+    def test_retry_resigns(self):
+        api = self.api(backoff_factor=1)
+        with HTTMock(self.failing_mock([{'status_code': 503}, {'status_code': 502}])):
+            response = api.get("products")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.requests), 3)
+        nonces = set(request['oauth_nonce'] for request in self.requests)
+        self.assertEqual(len(nonces), 3)
+        self.assertEqual([attempt['status_code'] for attempt in response.retry_attempts], [503, 502, 200])
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertTrue(0 <= self.sleeps[0] <= 1 and 0 <= self.sleeps[1] <= 2)
+        metrics = api.retry_metrics
+        self.assertEqual(metrics['attempts'], 3)
+        self.assertEqual(metrics['retries_by_reason'], {'503': 1, '502': 1})
+
+    def test_retry_after(self):
+        api = self.api()
+        with HTTMock(self.failing_mock([{'status_code': 429, 'headers': {'Retry-After': '7'}}])):
+            api.get("products")
+        self.assertEqual(self.sleeps, [7])
+
+        self.requests, self.sleeps = [], []
+        too_long = {'status_code': 429, 'headers': {'Retry-After': '3600'}}
+        with HTTMock(self.failing_mock([too_long])):
+            self.assertRaises(AssertionError, api.get, "products")
+        self.assertEqual(len(self.requests), 1)
+        self.assertEqual(api.retry_metrics['giveups'], 1)
+
+    def test_connection_errors(self):
+        api = self.api()
+        with HTTMock(self.failing_mock([ConnectionError("reset"), ConnectionError("reset")])):
+            response = api.get("products")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('reset', response.retry_attempts[0]['error'])
+
+        with HTTMock(self.failing_mock([ConnectionError("reset")] * 4)):
+            self.assertRaises(ConnectionError, api.get, "products")
+
+    def test_post_opt_in(self):
+        with HTTMock(self.failing_mock([{'status_code': 503}])):
+            self.assertRaises(AssertionError, self.api().post, "products", {})
+        with HTTMock(self.failing_mock([{'status_code': 503}])):
+            response = self.api(retry_post=True).post("products", {})
+        self.assertEqual(response.status_code, 200)
+
+    def test_budget(self):
+        api = self.api(budget_min=2, budget_ratio=0)
+        with HTTMock(self.failing_mock([{'status_code': 503}] * 10)):
+            self.assertRaises(AssertionError, api.get, "products")
+            self.assertRaises(AssertionError, api.get, "products")
+        self.assertEqual(len(self.requests), 4)
+        self.assertEqual(api.retry_metrics['retries'], 2)
+
+class RateLimitTestCases(unittest.TestCase):
+    def fake_clock(self, bucket):
+        clock = {'now': 1000.0, 'sleeps': []}
+        def sleep(seconds):
+            clock['sleeps'].append(seconds)
+            clock['now'] += seconds
+        bucket.clock = lambda: clock['now']
+        bucket.sleep = sleep
+        return clock
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(5, burst=2)
+        clock = self.fake_clock(bucket)
+        for _ in range(4):
+            bucket.acquire()
+        # the burst goes straight through, then one every 1/rate seconds
+        self.assertEqual(len(clock['sleeps']), 2)
+        for seconds in clock['sleeps']:
+            self.assertAlmostEqual(seconds, 0.2)
+        clock['now'] += 10
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.metrics['acquired'], 5)
+        self.assertEqual(bucket.metrics['waits'], 2)
+
+    def test_shared_between_threads(self):
+        bucket = TokenBucket(100, burst=1)
+        started = time.time()
+        threads = [threading.Thread(target=bucket.acquire) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # reservations space the 19 requests after the burst out by 10ms each
+        self.assertGreaterEqual(time.time() - started, 0.18)
+        self.assertGreaterEqual(bucket.metrics['waits'], 15)
+
+    def test_file_bucket(self):
+        import tempfile
+        import shutil
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'bucket')
+            # two buckets on one file, as in two processes
+            first = FileTokenBucket(path, 5, burst=2)
+            second = FileTokenBucket(path, 5, burst=2)
+            clock = self.fake_clock(first)
+            second.clock = first.clock
+            second.sleep = first.sleep
+            first.acquire()
+            second.acquire()
+            self.assertEqual(clock['sleeps'], [])
+            waited = first.acquire()
+            self.assertAlmostEqual(waited, 0.2)
+            self.assertAlmostEqual(second.acquire(), 0.2)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_api_option(self):
+        api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            rate_limit=TokenBucket(10, burst=1)
+        )
+        clock = self.fake_clock(api.requester.rate_limiter)
+
+        @all_requests
+        def woo_test_mock(*args, **kwargs):
+            """ URL Mock """
+            return {'status_code': 200,
+                    'content': 'OK'}
+
+        with HTTMock(woo_test_mock):
+            for _ in range(3):
+                api.get("products")
+        self.assertEqual(len(clock['sleeps']), 2)
+        self.assertEqual(api.rate_limit_metrics['acquired'], 3)
+        self.assertIsNone(API(
+            url="http://woo.test", consumer_key="ck", consumer_secret="cs"
+        ).rate_limit_metrics)
+
+class APIErrorTestCases(unittest.TestCase):
+    def setUp(self):
+        self.api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
+        )
+
+    def error_for(self, status_code, content, headers=None):
+        @all_requests
+        def woo_test_mock(*args, **kwargs):
+            """ URL Mock """
+            return {'status_code': status_code,
+                    'content': content,
+                    'headers': headers or {}}
+
+        with HTTMock(woo_test_mock):
+            try:
+                self.api.get("products")
+            except APIError as exc:
+                return exc
+        self.fail("no APIError raised for %s" % status_code)
+
+    def test_classes(self):
+        limited = self.error_for(429, '{"code": "too_many"}', {'Retry-After': '30'})
+        self.assertIsInstance(limited, RateLimited)
+        self.assertEqual(limited.retry_after, 30)
+        self.assertIsInstance(self.error_for(401, '{}'), AuthError)
+        self.assertIsInstance(self.error_for(403, '{}'), AuthError)
+        self.assertIsInstance(self.error_for(503, '{}'), ServerError)
+        error = self.error_for(400, '{"code": "rest_invalid_param"}', {'X-Test': '1'})
+        self.assertEqual(type(error), APIError)
+        # still caught by code written for the assertion raised before
+        self.assertIsInstance(error, AssertionError)
+        self.assertEqual(error.status_code, 400)
+        self.assertEqual(error.headers['X-Test'], '1')
+        self.assertIn('rest_invalid_param', str(error))
+        self.assertIn('/wp-json/wp/v2/products', error.url)
+
+    def test_truncated_body(self):
+        body = '<html><body>' + '<p>Fatal error</p>' * 10000 + '</body></html>'
+        error = self.error_for(500, body)
+        self.assertTrue(error.truncated)
+        self.assertEqual(len(error.body), APIError.body_limit)
+        self.assertLess(len(str(error)), APIError.body_limit + 500)
+        self.assertIn('[truncated]', str(error))
+        self.assertIn('Fatal error', error.pretty())
+
+    def test_non_ascii_body(self):
+        error = self.error_for(500, u'<p>Erreur: caf\xe9</p>'.encode('utf-8'),
+                               {'Content-Type': 'text/html; charset=UTF-8'})
+        self.assertIn(u'caf\xe9', error.text)
+        self.assertIn('Erreur: caf', str(error))
+        self.assertIn('Erreur: caf', error.args[0])
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            return {'status_code': 502, 'content': u'<p>Erreur: caf\xe9</p>'.encode('utf-8')}
+
+        with HTTMock(woo_test_mock):
+            report = self.api.batch('posts', update=[{'id': 1, 'title': 'a'}])
+        # reported against the item rather than stopping the batch
+        self.assertEqual(len(report.errors), 1)
+        self.assertIn('Erreur: caf', report.errors[0]['error'])
+
+class SerializerTestCases(unittest.TestCase):
+    def setUp(self):
+        self.api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            cache=True
+        )
+        self.requested = []
+
+    def parse(self, content, chunk_size):
+        chunks = [content[i:i + chunk_size] for i in range(0, len(content), chunk_size)]
+        return list(JSONArrayParser.iter_items(chunks, json.loads))
+
+    def test_parser(self):
+        items = [
+            {'id': 1, 'title': 'a [bracket], {brace} and "quote"', 'tags': [1, [2, {}]]},
+            {'id': 2, 'path': 'C:\\temp\\', 'name': u'caf\u00e9 \u2615'},
+            3, -4.5e2, True, None, "string, with comma", [], {}
+        ]
+        content = json.dumps(items, indent=1).encode('utf-8')
+        for chunk_size in [1, 2, 3, 7, 64, len(content)]:
+            self.assertEqual(self.parse(content, chunk_size), items)
+        self.assertEqual(self.parse(b' [ ] ', 1), [])
+        wrapped = json.dumps({'products': items[:2]}).encode('utf-8')
+        self.assertEqual(self.parse(wrapped, 5), items[:2])
+
+    def test_parser_errors(self):
+        for content in [b'{"id": 1}', b'"text"', b'[1, 2', b'[1, 2] 3']:
+            with self.assertRaises(UserWarning):
+                self.parse(content, 3)
+        # malformed items are left to the backend to reject
+        with self.assertRaises(ValueError):
+            self.parse(b'[1 2]', 3)
+
+    def test_backend(self):
+        self.assertEqual(JSONBackend.from_value('json').loads('[1]'), [1])
+        # the standard library unless another is asked for, so bodies don't change with what is installed
+        self.assertEqual(self.api.json_backend.name, 'json')
+        with self.assertRaises(UserWarning):
+            JSONBackend('no_such_json')
+
+    def test_encode(self):
+        data = {'name': u'caf\u00e9', 'meta_data': [{'key': 'a/b', 'value': 1.5}]}
+        for name in JSONBackend.names:
+            try:
+                backend = JSONBackend(name)
+            except UserWarning:
+                continue
+            encoded = backend.dumps(data)
+            self.assertIsInstance(encoded, bytes)
+            self.assertIn(u'caf\u00e9'.encode('utf-8'), encoded)
+            self.assertNotIn(b', ', encoded)
+            self.assertEqual(json.loads(encoded.decode('utf-8')), data)
+
+    def test_custom_backend(self):
+        class Backend(object):
+            loads = staticmethod(json.loads)
+
+            @staticmethod
+            def dumps(data):
+                return b'custom'
+
+        api = API(
+            url="http://woo.test",
+            consumer_key="ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            consumer_secret="cs_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX",
+            json_backend=Backend()
+        )
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requested.append(request.body)
+            return {'status_code': 201, 'content': '{}'}
+
+        with HTTMock(woo_test_mock):
+            api.post('products', {'name': 'test'})
+        self.assertEqual(self.requested, [b'custom'])
+
+    def test_iter_items(self):
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            self.requested.append(url)
+            return {'status_code': 200,
+                    'content': json.dumps([{'id': i} for i in range(500)])}
+
+        with HTTMock(woo_test_mock):
+            items = list(self.api.iter_items('products?per_page=500', chunk_size=100))
+            self.assertEqual([item['id'] for item in items], list(range(500)))
+            # streamed responses are not cached
+            list(self.api.iter_items('products?per_page=500'))
+            self.assertEqual(len(self.requested), 2)
+            # nor do they drop what is cached, as writes do
+            self.api.cache.set_ttl('products', 60)
+            self.api.get('products')
+            list(self.api.iter_items('products'))
+            self.api.get('products')
+        self.assertEqual(len(self.requested), 4)
+
+class ImportTestCases(unittest.TestCase):
+    def test_core_imports(self):
+        # the signed request path should only need requests and the stdlib
+        output = subprocess.check_output([sys.executable, '-c', (
+            "import sys; before = set(sys.modules); "
+            "import wordpress; from wordpress.api import API; "
+            "api = API(url='http://woo.test', consumer_key='ck', consumer_secret='cs'); "
+            "api.oauth.get_oauth_url(api.requester.endpoint_url('products'), 'GET'); "
+            "print(sorted(set(name.split('.')[0] for name, module in sys.modules.items() "
+            "if module is not None and name not in before "
+            "and 'packages' in (getattr(module, '__file__', None) or '')) - set(['requests'])))"
+        )], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), b"[]")
+
 class HelperTestcase(unittest.TestCase):
     def setUp(self):
         self.test_url = "http://ich.local:8888/woocommerce/wc-api/v3/products?filter%5Blimit%5D=2&oauth_consumer_key=ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX&oauth_nonce=c4f2920b0213c43f2e8d3d3333168ec4a22222d1&oauth_signature=3ibOjMuhj6JGnI43BQZGniigHh8%3D&oauth_signature_method=HMAC-SHA1&oauth_timestamp=1481601370&page=2"
 
 
+    def test_flatten_query(self):
+        self.assertEqual(UrlUtils.flatten_query(OrderedDict([
+            ('include', [3, 1, 2]),
+            ('filter', OrderedDict([('meta', True), ('limit', 2)])),
+            ('orderby', 'include'),
+            ('search', u'caf\u00e9'),
+            ('status', None),
+            ('attributes', [{'id': 4, 'options': ['S', 'M']}]),
+        ])), [
+            ('include[]', '3'), ('include[]', '1'), ('include[]', '2'),
+            ('filter[meta]', '1'), ('filter[limit]', '2'),
+            ('orderby', 'include'),
+            ('search', u'caf\u00e9'.encode('utf-8')),
+            ('attributes[0][id]', '4'), ('attributes[0][options][]', 'S'),
+            ('attributes[0][options][]', 'M'),
+        ])
+        self.assertEqual(
+            UrlUtils.extend_query('http://woo.test/products?page=2', [('include[]', '1')]),
+            'http://woo.test/products?page=2&include%5B%5D=1'
+        )
+
+    def test_pool_imap_bounded(self):
+        self.assertEqual(
+            list(PoolUtils.imap_bounded(lambda x: x * 2, range(20), 3)),
+            [x * 2 for x in range(20)]
+        )
+        self.assertEqual(
+            sorted(PoolUtils.imap_bounded(lambda x: x * 2, range(20), 3, ordered=False)),
+            [x * 2 for x in range(20)]
+        )
+
+        def fail(x):
+            raise UserWarning("failed on %s" % x)
+
+        with self.assertRaises(UserWarning):
+            list(PoolUtils.imap_bounded(fail, range(5), 2))
+        with self.assertRaises(UserWarning):
+            list(PoolUtils.imap_bounded(fail, range(5), 2, ordered=False))
+
     def test_url_is_ssl(self):
         self.assertTrue(UrlUtils.is_ssl("https://woo.test:8888"))
         self.assertFalse(UrlUtils.is_ssl("http://woo.test:8888"))
@@ -337,6 +2203,27 @@ class TransportTestcases(unittest.TestCase):
             self.requester.endpoint_url('posts')
         )
 
+    def test_endpoint_url_cached_base(self):
+        for url in ['https://woo.test:8888/', 'http://woo.test/shop', 'http://woo.test/shop/']:
+            for api in ['wp-json', 'wc-api', '']:
+                requester = API_Requests_Wrapper(url=url, api=api)
+                for version in ['wp/v2', 'v3', '']:
+                    for endpoint in ['posts', '/posts', '//posts', 'posts/1?context=edit', '', '/']:
+                        self.assertEqual(
+                            requester.endpoint_url(endpoint, version),
+                            UrlUtils.join_components([
+                                url, api, version or requester.api_version,
+                                StrUtils.decapitate(endpoint, '/')
+                            ])
+                        )
+
+        self.requester.set_api_version('wc/v2')
+        self.assertEqual(self.requester.endpoint_url('products'), 'https://woo.test:8888/wp-json/wc/v2/products')
+        self.assertTrue(self.requester.is_ssl)
+        self.requester.url = 'http://other.test'
+        self.assertFalse(self.requester.is_ssl)
+        self.assertEqual(self.requester.endpoint_url('products'), 'http://other.test/wp-json/wc/v2/products')
+
     def test_request(self):
 
         @all_requests
@@ -351,6 +2238,43 @@ class TransportTestcases(unittest.TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.request.url, 'https://woo.test:8888/wp-json/wp/v2/posts')
 
+    def test_pool_options(self):
+        requester = API_Requests_Wrapper(
+            url='https://woo.test:8888/',
+            pool_connections=4,
+            pool_maxsize=32,
+            pool_block=True,
+            keep_alive=False
+        )
+        for prefix in ['http://', 'https://']:
+            adapter = requester.session.get_adapter(prefix + 'woo.test')
+            self.assertIs(adapter, requester.adapter)
+        self.assertEqual(requester.adapter.poolmanager.connection_pool_kw['maxsize'], 32)
+        self.assertEqual(requester.adapter.poolmanager.connection_pool_kw['block'], True)
+        self.assertEqual(requester.session.headers['Connection'], 'close')
+
+    def test_pool_stats(self):
+        with LocalServer() as server:
+            requester = API_Requests_Wrapper(url=server.url)
+            for _ in range(5):
+                requester.request("GET", server.url + "/wp-json")
+            stats = requester.pool_stats
+
+            closing_requester = API_Requests_Wrapper(url=server.url, keep_alive=False)
+            for _ in range(5):
+                closing_requester.request("GET", server.url + "/wp-json")
+            closing_stats = closing_requester.pool_stats
+
+        self.assertEqual(stats['requests'], 5)
+        self.assertEqual(stats['connections_created'], 1)
+        self.assertEqual(stats['connections_reused'], 4)
+        self.assertEqual(closing_stats['connections_created'], 5)
+
+    def test_tcp_keepalive(self):
+        requester = API_Requests_Wrapper(url='https://woo.test:8888/', tcp_keepalive=True)
+        socket_options = requester.adapter.poolmanager.connection_pool_kw['socket_options']
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), socket_options)
+
 class OAuthTestcases(unittest.TestCase):
 
     def setUp(self):
@@ -611,6 +2535,105 @@ class OAuthTestcases(unittest.TestCase):
         # self.assertEqual('page', signed_url_params[-1][0])
         self.assertIn('page', dict(signed_url_params))
 
+    def test_add_params_sign_matches_reference(self):
+        def reference_sign(oauth, method, url, params, sign_key=None):
+            # signing as built from the separate sort and normalize steps
+            params = list(params) + parse_qsl(urlparse(url).query)
+            params = [(key, value) for key, value in OAuth.sorted_params(params) if key != "oauth_signature"]
+            query_string = "&".join("%s=%s" % pair for pair in OAuth.normalize_params(params))
+            signature = oauth.sign("&".join([
+                method, quote(UrlUtils.substitute_query(url), ""), quote(query_string, '~')
+            ]), sign_key)
+            params = OAuth.normalize_params(params + [("oauth_signature", signature)])
+            params.sort(key=lambda pair: pair[0].split('%5B')[0])
+            return UrlUtils.substitute_query(url, "&".join("%s=%s" % pair for pair in params))
+
+        rand = random.Random(5849)
+        # list keys like include[] are numbered rather than kept only once, see test_sign_list_params
+        keys = ['a', 'b', 'z', 'a[x]', 'a[y]', 'filter[meta]', 'oauth_signature', 'c d', 'c~']
+        values = ['1', '', 'x y', 'caf%C3%A9', '/?&=', 10, 1.5, 2.0, True, False]
+        for api in [self.wcapi, self.twitter_api, self.rfc1_api]:
+            for _ in range(50):
+                query = "&".join(
+                    "%s=%s" % (rand.choice(keys), rand.choice(['1', 'x', '%20'])) for _ in range(rand.randint(0, 5))
+                )
+                url = api.requester.endpoint_url('products' + ('?' + query if query else ''))
+                params = [(rand.choice(keys), rand.choice(values)) for _ in range(rand.randint(1, 8))]
+                for sign_key in [None, 'secret&token']:
+                    self.assertEqual(
+                        api.oauth.add_params_sign("GET", url, list(params), sign_key),
+                        reference_sign(api.oauth, "GET", url, list(params), sign_key)
+                    )
+
+    def test_sign_list_params(self):
+        url = self.wcapi.requester.endpoint_url('products?include[]=7&orderby=id')
+        signed_url = self.wcapi.oauth.get_oauth_url(
+            url, "GET", [('include[]', str(i)) for i in range(12)] + [('filter[meta]', 'true')]
+        )
+        signed_params = parse_qsl(urlparse(signed_url).query)
+        include = [(key, value) for key, value in signed_params if key.startswith('include')]
+        # numbered as PHP numbers them, and sent in order, so the server signs the same keys
+        self.assertEqual(include, [
+            ('include[%d]' % i, str(i)) for i in range(12)
+        ] + [('include[12]', '7')])
+        self.assertIn(('filter[meta]', 'true'), signed_params)
+        self.assertIn(('orderby', 'id'), signed_params)
+
+    def test_sign_list_params_base_string(self):
+        query = [('include[]', str(i)) for i in range(12)] \
+            + [('filter[meta]', 'true'), ('filter[key]', 'color'), ('orderby', 'id')]
+        url = self.wcapi.requester.endpoint_url('products')
+        oauth_params = self.wcapi.oauth.get_params()
+        params = self.wcapi.oauth.normalize_sorted_params(oauth_params + query)
+        base_string = "&".join([
+            "GET", quote(url, ""), quote("&".join("%s=%s" % pair for pair in params), '~')
+        ])
+        self.assertEqual(base_string, php_signature_base_string("GET", url, oauth_params + query))
+        self.assertIn(quote('include%5B2%5D=2&include%5B3%5D=3', ''), base_string)
+        self.assertIn(quote('include%5B9%5D=9&include%5B10%5D=10', ''), base_string)
+        # and the server, signing the query as sent, gets the same signature
+        signed_url = self.wcapi.oauth.get_oauth_url(url, "GET", query)
+        self.assertTrue(verify_php_signature(self.wcapi.oauth, "GET", signed_url))
+
+def php_signature_base_string(method, url, params):
+    """ The OAuth1 signature base string as the WooCommerce and WP OAuth1 servers
+    build it: the params parsed into arrays as PHP parses a query, the top level
+    keys sorted with strcmp, and each nested array expanded in the order its
+    keys arrived """
+    parsed = OrderedDict()
+    for key, value in params:
+        if '[' in key:
+            name, inner = key[:-1].split('[', 1)
+            nested = parsed.setdefault(name, OrderedDict())
+            nested.setdefault(inner or str(len(nested)), value)
+        else:
+            parsed.setdefault(key, value)
+    pairs = []
+    for name in sorted(parsed):
+        if isinstance(parsed[name], dict):
+            pairs.extend(('%s[%s]' % (name, inner), value) for inner, value in parsed[name].items())
+        else:
+            pairs.append((name, parsed[name]))
+    query_string = "&".join(
+        "%s=%s" % (quote(key, ''), quote(str(value), '')) for key, value in pairs
+    )
+    return "&".join([method, quote(url, ''), quote(query_string, '~')])
+
+def verify_php_signature(oauth, method, signed_url):
+    """ Whether the oauth_signature of signed_url is the one the server computes
+    from the query as it arrives """
+    parsed = urlparse(signed_url)
+    params = parse_qsl(parsed.query, keep_blank_values=True)
+    signature = dict(params).get('oauth_signature')
+    base_string = php_signature_base_string(
+        method, urlunparse(parsed._replace(query='')),
+        [(key, value) for key, value in params if key != 'oauth_signature']
+    )
+    expected = oauth.sign(base_string)
+    if not isinstance(expected, str):
+        expected = expected.decode('ascii')
+    return signature == expected
+
 class OAuth3LegTestcases(unittest.TestCase):
     def setUp(self):
         self.consumer_key = "ck_XXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXXX"
@@ -700,6 +2723,104 @@ class OAuth3LegTestcases(unittest.TestCase):
             self.assertEquals(access_token, 'XXXXXXXXXXXX')
             self.assertEquals(access_token_secret, 'YYYYYYYYYYYY')
 
+    def stored_api(self, token_store):
+        return API(
+            url="http://woo.test",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            oauth1a_3leg=True,
+            wp_user='test_user',
+            wp_pass='test_pass',
+            callback='http://127.0.0.1/oauth1_callback',
+            token_store=token_store
+        )
+
+    def test_token_store(self):
+        token_store = MemoryTokenStore()
+        key = self.api.oauth.token_store_key
+        token_store.set(key, {
+            'site': 'http://woo.test/wp-json',
+            'consumer_key': self.consumer_key,
+            'oauth_token': 'stored_token',
+            'oauth_token_secret': 'stored_secret',
+        })
+        api = self.stored_api(token_store)
+        requests = []
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            requests.append(dict(parse_qsl(url.query)))
+            return {'status_code': 200,
+                    'content': '[]'}
+
+        # no discovery or handshake, straight to the resource
+        with HTTMock(woo_test_mock):
+            api.get('posts')
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(requests[0]['oauth_token'], 'stored_token')
+
+        # entries for another consumer are dropped rather than used
+        token_store.set(key, dict(token_store.get(key), consumer_key='ck_other'))
+        api = self.stored_api(token_store)
+        self.assertFalse(api.oauth.load_access_token())
+        self.assertIsNone(token_store.get(key))
+
+    def test_reauthenticate_on_401(self):
+        token_store = MemoryTokenStore()
+        api = self.stored_api(token_store)
+        handshakes = []
+
+        def get_access_token():
+            handshakes.append(True)
+            api.oauth.access_token_secret = 'secret_%d' % len(handshakes)
+            api.oauth._access_token = 'token_%d' % len(handshakes)
+        api.oauth.get_access_token = get_access_token
+
+        @all_requests
+        def woo_test_mock(url, request):
+            """ URL Mock """
+            if dict(parse_qsl(url.query))['oauth_token'] == 'token_1':
+                return {'status_code': 401,
+                        'content': '{"code": "json_oauth1_invalid_token"}'}
+            return {'status_code': 200,
+                    'content': '[]'}
+
+        with HTTMock(woo_test_mock):
+            response = api.get('posts')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(handshakes), 2)
+        self.assertEqual(token_store.get(api.oauth.token_store_key)['oauth_token'], 'token_2')
+
+        # a new client picks up the stored token without a handshake
+        api = self.stored_api(token_store)
+        api.oauth.get_access_token = get_access_token
+        self.assertEqual(api.oauth.access_token, 'token_2')
+        self.assertEqual(len(handshakes), 2)
+
+    def test_file_token_store(self):
+        import tempfile
+        import shutil
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'tokens', 'oauth1.json')
+            entry = {'oauth_token': 'token', 'oauth_token_secret': 'secret'}
+            FileTokenStore(path).set('site key', entry)
+            FileTokenStore(path).set('other key', entry)
+            token_store = FileTokenStore(path)
+            self.assertEqual(token_store.get('site key'), entry)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+            token_store.delete('site key')
+            self.assertIsNone(token_store.get('site key'))
+            self.assertEqual(token_store.get('other key'), entry)
+            with open(path, 'w') as token_file:
+                token_file.write('{not json')
+            self.assertIsNone(token_store.get('other key'))
+            token_store.set('site key', entry)
+            self.assertEqual(token_store.get('site key'), entry)
+        finally:
+            shutil.rmtree(directory)
+
 # @unittest.skipIf(platform.uname()[1] != "Ich.lan", "should only work on my machine")
 @unittest.skip("Should only work on my machine")
 class WCApiTestCases(unittest.TestCase):
@@ -17,4 +17,4 @@ __license__ = "MIT"
 __default_api_version__ = "wp/v2"
 __default_api__ = "wp-json"
 
-from wordpress.api import API
+from wordpress.api import API, AsyncAPI
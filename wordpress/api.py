@@ -6,11 +6,27 @@ Wordpress API Class
 
 __title__ = "wordpress-api"
 
-from json import dumps as jsonencode
+from hashlib import sha1
+from multiprocessing.pool import ThreadPool
 from wordpress.oauth import OAuth, OAuth_3Leg
-from wordpress.transport import API_Requests_Wrapper
-from wordpress.helpers import UrlUtils
-from wpoauth2 import oauth2
+from wordpress.transport import API_Requests_Wrapper, Async_Requests_Wrapper
+from wordpress.helpers import UrlUtils, PoolUtils, SeqUtils
+from wordpress.batch import WC_Batch, WP_Batch
+from wordpress.bulk import IdFetch
+from wordpress.records import FieldSelection
+from wordpress.sync import DeltaSync
+from wordpress.export import Exporter
+from wordpress.cache import ResponseCache
+from wordpress.routes import Route
+from wordpress.discovery import Discovery, RouteTable
+from wordpress.tokens import OAuth2TokenManager, OAuth2Grant
+from wordpress.exceptions import APIError
+from wordpress.serializers import JSONBackend, JSONArrayParser
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
 
 
 class API(object):
@@ -18,10 +34,23 @@ class API(object):
 
     token = ''
     oauth_version = 1
+    requester_class = API_Requests_Wrapper
 
 
     def __init__(self, url, consumer_key, consumer_secret, oauth_version=1, token='', **kwargs):
-        self.requester = API_Requests_Wrapper(url=url, **kwargs)
+        self.requester = self.requester_class(url=url, **kwargs)
+        self.discovery = Discovery(
+            self.requester, kwargs.get('discovery_cache'), kwargs.get('discovery_ttl')
+        )
+        self.validate_routes = kwargs.get('validate_routes', False)
+        self.json_backend = JSONBackend.from_value(kwargs.get('json_backend'))
+        self.cache = kwargs.get('cache')
+        if self.cache is True:
+            self.cache = ResponseCache()
+        elif self.cache is False:
+            self.cache = None
+        elif self.cache is not None and not isinstance(self.cache, ResponseCache):
+            self.cache = ResponseCache(self.cache)
         oauth_kwargs = dict(
             requester=self.requester,
             consumer_key=consumer_key,
@@ -31,18 +60,29 @@ class API(object):
         )
 
         self.oauth2 = None
+        self.oauth2_tokens = None
         self.oauth_version = oauth_version
         if oauth_version is 2 and token:
             self.token = token
         elif oauth_version is 2 and not token:
-            self.oauth2 = oauth2.OAuth2(consumer_key, consumer_secret, url, "")
-            token, refresh_token = self.oauth2.request_auth_token()
-            self.token = token
+            # only imported by clients using it
+            from wpoauth2.oauth2 import OAuth2
+            self.oauth2 = OAuth2(consumer_key, consumer_secret, url, "")
+            self.oauth2_tokens = OAuth2TokenManager(
+                self.oauth2,
+                grant=OAuth2Grant.from_value(self.oauth2, kwargs.get('oauth2_grant')),
+                token_store=kwargs.get('token_store'),
+                refresh_margin=kwargs.get('oauth2_refresh_margin')
+            )
+            # fetched up front, so the first request doesn't wait for it
+            self.oauth2_tokens.token
         elif kwargs.get('oauth1a_3leg'):
             self.oauth1a_3leg = kwargs['oauth1a_3leg']
             oauth_kwargs['callback'] = kwargs['callback']
             oauth_kwargs['wp_user'] = kwargs['wp_user']
             oauth_kwargs['wp_pass'] = kwargs['wp_pass']
+            oauth_kwargs['token_store'] = kwargs.get('token_store')
+            oauth_kwargs['discovery'] = self.discovery
             self.oauth = OAuth_3Leg( **oauth_kwargs )
         else:
             self.oauth = OAuth( **oauth_kwargs )
@@ -75,6 +115,18 @@ class API(object):
     def is_ssl(self):
         return self.requester.is_ssl
 
+    @property
+    def pool_stats(self):
+        return self.requester.pool_stats
+
+    @property
+    def retry_metrics(self):
+        return self.requester.retry_metrics
+
+    @property
+    def rate_limit_metrics(self):
+        return self.requester.rate_limit_metrics
+
     @property
     def consumer_key(self):
         return self.oauth.consumer_key
@@ -87,70 +139,151 @@ class API(object):
     def callback(self):
         return self.oauth.callback
 
+    def cache_identity(self):
+        """ A hash of the credentials requests are made with, part of the cache
+        key so a shared cache never serves one client's responses to another """
+        if self.oauth2_tokens is not None:
+            credentials = "bearer %s" % self.oauth2_tokens.token
+        elif self.token:
+            credentials = "bearer %s" % self.token
+        elif isinstance(self.oauth, OAuth_3Leg):
+            credentials = "oauth1 %s %s" % (self.oauth.consumer_key, self.oauth.access_token)
+        else:
+            credentials = "key %s" % self.oauth.consumer_key
+        return sha1(credentials.encode('utf-8')).hexdigest()[:16]
+
     def __request(self, method, endpoint, data, **kwargs):
         """ Do requests """
-        endpoint_url = self.requester.endpoint_url(endpoint)
+        if self.validate_routes:
+            self.discovery.route_table.validate(method, RouteTable.path(
+                endpoint, kwargs.get("api_version") or self.requester.api_version
+            ))
+
+        endpoint_url = self.requester.endpoint_url(endpoint, kwargs.get("api_version"))
+        unsigned_url = endpoint_url
+        stream = kwargs.get("stream", False)
+        query = None
+        if kwargs.get("params"):
+            query = UrlUtils.flatten_query(kwargs["params"])
+        if kwargs.get("fields") or kwargs.get("embed"):
+            query = (query or []) + FieldSelection(kwargs.get("fields"), kwargs.get("embed")).query()
+
+        cache_key = cache_entry = cache_ttl = None
+        if self.cache is not None:
+            # the endpoint as given and with its namespace, so either can be used for ttls
+            resource = ResponseCache.resource_path(endpoint)
+            api_version = kwargs.get("api_version") or self.requester.api_version
+            cache_resources = [resource, "/".join(SeqUtils.filter_true([api_version, resource]))]
+            # a streamed body would have to be read whole to be stored
+            if method == "GET" and not stream:
+                cache_key = self.cache.key(
+                    method, UrlUtils.extend_query(unsigned_url, query), self.cache_identity()
+                )
+                cache_entry = self.cache.get(cache_key)
+                cache_ttl = self.cache.ttl_for(cache_resources)
+                if cache_entry and self.cache.is_fresh(cache_entry, cache_ttl):
+                    self.cache.count('hits')
+                    return self.cache.cached_response(cache_entry)
+
         # endpoint_params = UrlUtils.get_query_dict_singular(endpoint_url)
-        endpoint_params = {}
+        endpoint_params = list(query or [])
         auth = None
         auth_header = {}
+        sign = None
 
-        if self.token:
+        if self.oauth2_tokens is not None:
+            auth_header = {"Authorization": "Bearer " + self.oauth2_tokens.token}
+        elif self.token:
             auth_header = {"Authorization": "Bearer " + self.token}
         elif self.oauth2 and not self.token:
             print "we're going to need to get a token, dave."
         elif self.requester.is_ssl is True and self.requester.query_string_auth is False:
             auth = (self.oauth.consumer_key, self.oauth.consumer_secret)
         elif self.requester.is_ssl is True and self.requester.query_string_auth is True:
-            endpoint_params = {
-                "consumer_key": self.oauth.consumer_key,
-                "consumer_secret": self.oauth.consumer_secret
-            }
+            endpoint_params += [
+                ("consumer_key", self.oauth.consumer_key),
+                ("consumer_secret", self.oauth.consumer_secret)
+            ]
         else:
-            endpoint_url = self.oauth.get_oauth_url(endpoint_url, method)
+            # signed for each attempt, since the server rejects a reused nonce,
+            # with the query signed and added along with the oauth params
+            sign = lambda url: self.oauth.get_oauth_url(url, method, query)
+            endpoint_params = []
 
         files = kwargs.get("files", False)
 
-        cond = (data is not None)
-        isTrue = True
-        trueStr = "True"
-        counter = 0
-        for counter, condChar in enumerate(str(bool(cond))):
-            if counter >= len(trueStr) or condChar != trueStr[counter]:
-                isTrue = False
-            counter += 1
-        if str(bool(isTrue)) == trueStr and files is False:
-            data = jsonencode(data, ensure_ascii=False).encode('utf-8')
-
-        headers = kwargs.get("headers", {})
-        headers.update(auth_header)
-
-        response = self.requester.request(
-            method=method,
-            url=endpoint_url,
-            verify=self.verify_ssl,
-            auth=auth,
-            params=endpoint_params,
-            data=data,
-            files=files,
-            timeout=self.timeout,
-            headers=headers
+        if data is not None and files is False:
+            data = self.json_backend.dumps(data)
 
-        )
+        # a copy, so the auth and conditional headers don't stay in the caller's dict
+        headers = dict(kwargs.get("headers") or {})
+        headers.update(auth_header)
 
-        assert \
-            response.status_code in [200, 201, 404], "API call to %s returned \nCODE: %s\n%s \nHEADERS: %s" % (
-                response.request.url,
-                str(response.status_code),
-                UrlUtils.beautify_response(response),
-                str(response.headers)
+        if cache_entry:
+            headers.update(self.cache.conditional_headers(cache_entry))
+            self.cache.count('revalidations')
+
+        def send():
+            return self.requester.request(
+                method=method,
+                url=endpoint_url,
+                verify=self.verify_ssl,
+                auth=auth,
+                params=endpoint_params,
+                data=data,
+                files=files,
+                timeout=self.timeout,
+                headers=headers,
+                sign=sign,
+                stream=stream
             )
 
+        if self.oauth2_tokens is not None:
+            access_token = auth_header["Authorization"][len("Bearer "):]
+            response = send()
+            if response.status_code == 401 and not files:
+                # the token was revoked before it expired, get a new one once
+                self.oauth2_tokens.invalidate(access_token)
+                headers["Authorization"] = "Bearer " + self.oauth2_tokens.token
+                response = send()
+        elif sign is not None and isinstance(self.oauth, OAuth_3Leg):
+            access_token = self.oauth.access_token
+            response = send()
+            if response.status_code == 401 and not files:
+                # the access token was revoked or expired, authenticate again once
+                self.oauth.invalidate_access_token(access_token)
+                response = send()
+        else:
+            response = send()
+
+        if cache_key:
+            if cache_entry and response.status_code == 304:
+                response = self.cache.cached_response(cache_entry, response)
+                self.cache.refresh(cache_key, cache_entry)
+                self.cache.count('hits')
+            else:
+                self.cache.store(cache_key, response, cache_resources, cache_ttl)
+                self.cache.count('misses')
+        elif self.cache is not None and method in ["POST", "PUT", "PATCH", "DELETE"] \
+        and response.status_code < 400:
+            self.cache.invalidate_write(cache_resources)
+
+        if response.status_code not in [200, 201, 207, 404]:
+            raise APIError.for_response(response)
+
         return response
 
-    def get(self, endpoint):
-        """ Get requests """
-        return self.__request("GET", endpoint, None)
+    def request(self, method, endpoint, data=None, **kwargs):
+        """ Requests with any method. The other request methods and the
+        helpers built on them all go through this """
+        return self.__request(method, endpoint, data, **kwargs)
+
+    def get(self, endpoint, params=None, **kwargs):
+        """ Get requests. params is a dict or list of pairs for the query string,
+        where lists become a repeated key[] like include[], and dicts become
+        key[field] like filter[...]. fields and embed are sent as _fields and
+        _embed, see FieldSelection """
+        return self.__request("GET", endpoint, None, params=params, **kwargs)
 
     def post(self, endpoint, data, **kwargs):
         """ POST requests """
@@ -160,14 +293,225 @@ class API(object):
         """ PUT requests """
         return self.__request("PUT", endpoint, data, **kwargs)
 
-    def delete(self, endpoint):
-        """ DELETE requests """
-        return self.__request("DELETE", endpoint, None)
+    def delete(self, endpoint, params=None, **kwargs):
+        """ DELETE requests, with params for the query string as for get """
+        return self.__request("DELETE", endpoint, None, params=params, **kwargs)
 
     def options(self, endpoint):
         """ OPTIONS requests """
         return self.__request("OPTIONS", endpoint, None)
 
+    def iter_collection(self, endpoint, per_page=100, concurrency=1, ordered=True,
+                        fields=None, embed=None):
+        """ Generator yielding every decoded item of a paginated collection endpoint.
+        Follows the Link / X-WP-TotalPages headers, fetching the next page in the
+        background while the caller works through the current one, so at most two
+        pages are held in memory at a time.
+        With concurrency > 1, once the first page reveals the total page count the
+        remaining pages are fetched over a pool of that many threads sharing the
+        session, each signed with its own nonce, yielding pages in order or, if not
+        ordered, as they complete.
+        With fields, only those fields are fetched and items are yielded as
+        Records, see FieldSelection """
+        selection = FieldSelection(fields, embed)
+        query = selection.query()
+        response = None
+        if concurrency > 1:
+            response = self._get_page(endpoint, 1, per_page, query)
+            total_pages = self._total_pages(response)
+            if total_pages is not None:
+                prefetched = {1: response}
+                del response
+
+                def get_page(page):
+                    if page in prefetched:
+                        return prefetched.pop(page)
+                    return self._get_page(endpoint, page, per_page, query)
+
+                pages = PoolUtils.imap_bounded(
+                    get_page, range(1, total_pages + 1), concurrency, ordered
+                )
+                for response in pages:
+                    for item in self._page_items(response):
+                        yield selection.record(item)
+                return
+
+        pool = ThreadPool(1)
+        try:
+            page = 1
+            pending = None
+            if response is None:
+                pending = pool.apply_async(self._get_page, (endpoint, page, per_page, query))
+            while response is not None or pending is not None:
+                if response is None:
+                    response = pending.get()
+                items = self._page_items(response)
+                if self._has_next_page(response, page, per_page, len(items)):
+                    page += 1
+                    pending = pool.apply_async(self._get_page, (endpoint, page, per_page, query))
+                else:
+                    pending = None
+                response = None
+                for item in items:
+                    yield selection.record(item)
+                del items
+        finally:
+            pool.terminate()
+
+    def iter_items(self, endpoint, chunk_size=65536, fields=None, embed=None, **kwargs):
+        """ Generator yielding the decoded items of the JSON array endpoint
+        responds with as its body arrives, rather than reading and decoding the
+        whole body first, so only about one item is held in memory at a time.
+        Items are decoded with the json_backend, and with fields, yielded as
+        Records """
+        selection = FieldSelection(fields, embed)
+        response = self.request(
+            "GET", endpoint, stream=True, fields=fields, embed=embed, **kwargs
+        )
+        try:
+            if response.status_code == 404:
+                return
+            chunks = response.iter_content(chunk_size)
+            for item in JSONArrayParser.iter_items(chunks, self.json_backend.loads):
+                yield selection.record(item)
+        finally:
+            response.close()
+
+    def _get_page(self, endpoint, page, per_page, query=None):
+        """ GET a single page of a collection endpoint """
+        page_endpoint = UrlUtils.update_query(endpoint, OrderedDict([
+            ('page', page),
+            ('per_page', per_page)
+        ]))
+        return self.request("GET", page_endpoint, params=query)
+
+    @classmethod
+    def _page_items(cls, response):
+        """ Decodes the list of items in a collection response. Legacy wc-api
+        responses wrap the list in an object like {"products": [...]} """
+        if response.status_code == 404:
+            return []
+        response_json = response.json()
+        if isinstance(response_json, dict) and len(response_json) == 1:
+            response_json = list(response_json.values())[0]
+        if not isinstance(response_json, list):
+            raise UserWarning(
+                "expected a list of items from %s, got %s" \
+                % (response.request.url, type(response_json).__name__)
+            )
+        return response_json
+
+    @classmethod
+    def _has_next_page(cls, response, page, per_page, item_count):
+        """ Determines if there is a page after the given page from the Link
+        header, the total pages header, or failing those, whether the page was full """
+        if 'link' in response.headers:
+            return 'next' in response.links
+        total_pages = cls._total_pages(response)
+        if total_pages is not None:
+            return page < total_pages
+        return bool(item_count) and item_count >= per_page
+
+    @classmethod
+    def _total_pages(cls, response):
+        """ The total number of pages in the collection if the response reports it """
+        for header in ['X-WP-TotalPages', 'X-WC-TotalPages']:
+            if header in response.headers:
+                return int(response.headers[header])
+
+    def batch(self, endpoint, create=None, update=None, delete=None, chunk_size=None, concurrency=1):
+        """ Creates, updates and deletes any number of objects through the batch
+        endpoint of the API: <endpoint>/batch for WooCommerce (wc/v1 and up), or
+        /batch/v1 for Wordpress 5.6+. The operations are split into chunks the
+        server accepts, optionally sent concurrently, and their results merged
+        into a BatchReport """
+        if self.version and self.version.startswith('wc/'):
+            batch_class = WC_Batch
+        elif self.namespace == 'wc-api':
+            raise UserWarning("batch requests need wc/v1 or later, not %s" % self.version)
+        else:
+            batch_class = WP_Batch
+        batch = batch_class(self, endpoint, chunk_size)
+        return batch.run(batch.operations(create, update, delete), concurrency)
+
+    def get_many(self, endpoint, ids, fields=None, params=None, chunk_size=None, concurrency=4,
+                 embed=None):
+        """ Fetches the objects with the given IDs from a collection endpoint
+        like products or posts, in as few requests as its include[] filter
+        allows, sent concurrently. Returns a FetchResult, a dict of the objects
+        keyed by ID, with the IDs not found in .missing and those whose
+        request failed in .errors.
+        With fields, only those fields (and id) are fetched and the objects are
+        Records, see FieldSelection. params are added to every request, like
+        {'status': 'any'} """
+        if fields:
+            fields = list(fields)
+            if 'id' not in fields:
+                fields.append('id')
+        fetch = IdFetch(self, endpoint, params, chunk_size, FieldSelection(fields, embed))
+        return fetch.run(ids, concurrency)
+
+    def delta_sync(self, endpoint, upsert, store=None, **kwargs):
+        """ Passes the items of endpoint modified since the last sync to upsert,
+        keeping the watermark of where it got to in store, a MemoryCheckpointStore
+        or FileCheckpointStore. Returns a SyncReport. See DeltaSync """
+        return DeltaSync(self, endpoint, upsert, store, **kwargs).run()
+
+    def export(self, endpoint, path, store=None, **kwargs):
+        """ Writes every item of endpoint to the file at path as JSON lines,
+        resuming from the checkpoint in store, by default a FileCheckpointStore
+        next to the file, if a previous run stopped part way. Returns an
+        ExportReport. See Exporter """
+        return Exporter(self, endpoint, path, store, **kwargs).run()
+
+    def route(self, template, api_version=None):
+        """ A Route for an endpoint template like 'products/{id}/variations/{vid}',
+        to build urls and make requests by filling in its fields """
+        return Route(self, template, api_version)
+
     def set_api_version(self, api):
         self.requester.set_api_version(api)
 
+    def close(self):
+        """ Stops refreshing OAuth2 tokens in the background """
+        if self.oauth2_tokens is not None:
+            self.oauth2_tokens.close()
+
+
+
+class AsyncAPI(API):
+    """ API Class whose requests run in the background on a bounded pool of
+    workers. Takes the same arguments as API plus max_in_flight, and each request
+    method returns an AsyncResult whose .get() gives the response or raises """
+
+    requester_class = Async_Requests_Wrapper
+
+    def get(self, endpoint, params=None, **kwargs):
+        """ Get requests """
+        return self.requester.submit(super(AsyncAPI, self).get, endpoint, params, **kwargs)
+
+    def post(self, endpoint, data, **kwargs):
+        """ POST requests """
+        return self.requester.submit(super(AsyncAPI, self).post, endpoint, data, **kwargs)
+
+    def put(self, endpoint, data, **kwargs):
+        """ PUT requests """
+        return self.requester.submit(super(AsyncAPI, self).put, endpoint, data, **kwargs)
+
+    def delete(self, endpoint, params=None, **kwargs):
+        """ DELETE requests """
+        return self.requester.submit(super(AsyncAPI, self).delete, endpoint, params, **kwargs)
+
+    def options(self, endpoint):
+        """ OPTIONS requests """
+        return self.requester.submit(super(AsyncAPI, self).options, endpoint)
+
+    @classmethod
+    def gather(cls, results, timeout=None):
+        """ Waits for each of the results, returning the responses in order """
+        return [result.get(timeout) for result in results]
+
+    def close(self):
+        """ Waits for queued requests to finish and stops the workers """
+        self.requester.close()
+        super(AsyncAPI, self).close()
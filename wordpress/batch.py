@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Batch Classes
+"""
+
+__title__ = "wordpress-batch"
+
+from itertools import chain
+from wordpress.helpers import PoolUtils
+
+try:
+    from requests.exceptions import RequestException
+except ImportError:
+    RequestException = IOError
+
+
+class BatchReport(object):
+    """ Merged results of every chunk sent for a batch. Successful item results
+    are collected per action, failures in errors as dicts of action, item and error """
+
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.deleted = []
+        self.errors = []
+        self.requests = 0
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def add_result(self, action, item, result):
+        getattr(self, {
+            'create': 'created',
+            'update': 'updated',
+            'delete': 'deleted'
+        }[action]).append(result)
+
+    def add_error(self, action, item, error):
+        self.errors.append({'action': action, 'item': item, 'error': error})
+
+    def __repr__(self):
+        return "<BatchReport created=%d updated=%d deleted=%d errors=%d>" % (
+            len(self.created), len(self.updated), len(self.deleted), len(self.errors)
+        )
+
+
+class Batch(object):
+    """ Splits create, update and delete operations into chunks small enough for
+    a batch endpoint, and merges the per-item results of each chunk into a report.
+    Subclasses format the chunks for a particular batch API """
+
+    chunk_size = 100
+
+    def __init__(self, api, endpoint, chunk_size=None):
+        self.api = api
+        self.endpoint = endpoint
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+
+    @classmethod
+    def operations(cls, create=None, update=None, delete=None):
+        """ A flat list of (action, item) pairs in create, update, delete order """
+        return list(chain(
+            (('create', item) for item in create or []),
+            (('update', item) for item in update or []),
+            (('delete', item) for item in delete or []),
+        ))
+
+    def chunks(self, operations):
+        for start in range(0, len(operations), self.chunk_size):
+            yield operations[start:start + self.chunk_size]
+
+    def send(self, chunk):
+        """ Sends one chunk of operations, returning the chunk and the decoded
+        response, or the error that stopped the whole chunk """
+        try:
+            return chunk, self.request(chunk), None
+        except (AssertionError, RequestException, ValueError) as exc:
+            return chunk, None, exc
+
+    def invalid(self, action, item):
+        """ Why item can't be sent for action, or None if it can """
+        return None
+
+    def request(self, chunk):
+        raise NotImplementedError()
+
+    def merge(self, report, chunk, response_json):
+        raise NotImplementedError()
+
+    def run(self, operations, concurrency=1):
+        report = BatchReport()
+        # items that can't be sent are reported rather than stopping their chunk
+        valid = []
+        for action, item in operations:
+            error = self.invalid(action, item)
+            if error is None:
+                valid.append((action, item))
+            else:
+                report.add_error(action, item, error)
+        operations = valid
+        if concurrency > 1:
+            results = PoolUtils.imap_bounded(self.send, self.chunks(operations), concurrency)
+        else:
+            results = (self.send(chunk) for chunk in self.chunks(operations))
+        for chunk, response_json, exc in results:
+            report.requests += 1
+            if exc is not None:
+                for action, item in chunk:
+                    report.add_error(action, item, str(exc))
+            else:
+                self.merge(report, chunk, response_json)
+        return report
+
+
+class WC_Batch(Batch):
+    """ WooCommerce batch endpoints like products/batch, which take up to 100
+    objects per request as {"create": [...], "update": [...], "delete": [ids]} """
+
+    chunk_size = 100
+
+    def request(self, chunk):
+        data = {}
+        for action, item in chunk:
+            data.setdefault(action, []).append(item)
+        return self.api.request("POST", self.endpoint.rstrip('/') + '/batch', data).json()
+
+    def merge(self, report, chunk, response_json):
+        results = dict(
+            (action, iter(response_json.get(action) or [])) for action in ['create', 'update', 'delete']
+        )
+        for action, item in chunk:
+            result = next(results[action], None)
+            if result is None:
+                report.add_error(action, item, "no result returned for item")
+            elif isinstance(result, dict) and result.get('error'):
+                report.add_error(action, item, result['error'])
+            else:
+                report.add_result(action, item, result)
+
+
+class WP_Batch(Batch):
+    """ The WP 5.6+ batch framework at /batch/v1, which takes up to 25 requests
+    as {"requests": [{"method": ..., "path": ..., "body": ...}]}. Update items
+    need an id, delete items are ids or dicts with an id and extra arguments """
+
+    chunk_size = 25
+
+    def invalid(self, action, item):
+        if action == 'update' or (action == 'delete' and isinstance(item, dict)):
+            if not isinstance(item, dict) or item.get('id') is None:
+                return "%s item has no id" % action
+        return None
+
+    def request_for(self, action, item):
+        path = "/%s/%s" % (self.api.version, self.endpoint.strip('/'))
+        if action == 'create':
+            return {'method': 'POST', 'path': path, 'body': item}
+        if action == 'update':
+            body = dict(item)
+            return {'method': 'PUT', 'path': "%s/%s" % (path, body.pop('id')), 'body': body}
+        if isinstance(item, dict):
+            body = dict(item)
+            return {'method': 'DELETE', 'path': "%s/%s" % (path, body.pop('id')), 'body': body}
+        return {'method': 'DELETE', 'path': "%s/%s" % (path, item)}
+
+    def request(self, chunk):
+        data = {
+            'requests': [self.request_for(action, item) for action, item in chunk]
+        }
+        return self.api.request("POST", '', data, api_version='batch/v1').json()
+
+    def merge(self, report, chunk, response_json):
+        responses = response_json.get('responses') or []
+        for index, (action, item) in enumerate(chunk):
+            result = responses[index] if index < len(responses) else None
+            if result is None:
+                report.add_error(action, item, "no result returned for item")
+            elif result.get('status', 200) >= 400:
+                report.add_error(action, item, result.get('body'))
+            else:
+                report.add_result(action, item, result.get('body'))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Bulk Fetch Classes
+"""
+
+__title__ = "wordpress-bulk"
+
+from wordpress.helpers import PoolUtils, UrlUtils
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+try:
+    from requests.exceptions import RequestException
+except ImportError:
+    RequestException = IOError
+
+
+class FetchResult(dict):
+    """ The objects fetched by get_many, keyed by ID as the IDs were given.
+    missing lists the IDs the server returned nothing for, errors maps each ID
+    whose chunk failed to the error, and requests counts the requests made """
+
+    def __init__(self):
+        super(FetchResult, self).__init__()
+        self.missing = []
+        self.errors = {}
+        self.requests = 0
+
+    @property
+    def ok(self):
+        return not self.missing and not self.errors
+
+    def __repr__(self):
+        return "<FetchResult found=%d missing=%d errors=%d>" % (
+            len(self), len(self.missing), len(self.errors)
+        )
+
+
+class IdFetch(object):
+    """ Fetches objects by ID from a collection endpoint like products or posts,
+    with chunks of IDs in its include[] filter. Chunks are cut to stay within
+    the server's per_page cap and a request url length many servers and
+    proxies accept, with room left for the OAuth1 params """
+
+    per_page_max = 100
+    url_max = 4000
+    # oauth_consumer_key, _nonce, _signature, _signature_method and _timestamp
+    oauth_reserve = 300
+
+    def __init__(self, api, endpoint, params=None, chunk_size=None, selection=None):
+        self.api = api
+        self.endpoint = endpoint
+        self.selection = selection
+        self.params = UrlUtils.flatten_query(params or [])
+        if selection is not None:
+            self.params += selection.query()
+        self.chunk_size = min(chunk_size or self.per_page_max, self.per_page_max)
+
+    def chunks(self, ids):
+        """ Splits ids into lists, each as long as fits in one request. Lengths
+        are estimated as signed, where the keys are numbered include[0]... """
+        base_length = len(self.api.requester.endpoint_url(self.endpoint)) + self.oauth_reserve \
+            + sum(len(quote(key, '')) + len(quote(value, '')) + 2 for key, value in self.params)
+        chunk, length = [], base_length
+        for id_ in ids:
+            id_length = self.id_length(len(chunk), id_)
+            if chunk and (len(chunk) >= self.chunk_size or length + id_length > self.url_max):
+                yield chunk
+                chunk, length = [], base_length
+                id_length = self.id_length(0, id_)
+            chunk.append(id_)
+            length += id_length
+        if chunk:
+            yield chunk
+
+    @classmethod
+    def id_length(cls, index, id_):
+        """ The length of &include%5B<index>%5D=<id> """
+        return len('&include%5B%5D=') + len(str(index)) + len(quote(str(id_), ''))
+
+    def query(self, chunk):
+        return UrlUtils.flatten_query([
+            ('include', chunk), ('per_page', len(chunk))
+        ]) + self.params
+
+    def fetch(self, chunk):
+        """ GETs one chunk of IDs, returning the chunk and the decoded items, or
+        the error that stopped the whole chunk """
+        try:
+            response = self.api.request("GET", self.endpoint, params=self.query(chunk))
+            return chunk, self.api._page_items(response), None
+        except (AssertionError, RequestException, ValueError, UserWarning) as exc:
+            return chunk, None, exc
+
+    def run(self, ids, concurrency=1):
+        result = FetchResult()
+        # unique, in the order given
+        seen = set()
+        ids = [id_ for id_ in ids if not (str(id_) in seen or seen.add(str(id_)))]
+        if concurrency > 1:
+            fetched = PoolUtils.imap_bounded(self.fetch, self.chunks(ids), concurrency, ordered=False)
+        else:
+            fetched = (self.fetch(chunk) for chunk in self.chunks(ids))
+        for chunk, items, exc in fetched:
+            result.requests += 1
+            if exc is not None:
+                for id_ in chunk:
+                    result.errors[id_] = exc
+                continue
+            requested = dict((str(id_), id_) for id_ in chunk)
+            for item in items:
+                id_ = requested.get(str(item.get('id'))) if isinstance(item, dict) else None
+                if id_ is not None:
+                    result[id_] = self.selection.record(item) if self.selection else item
+            result.missing.extend(id_ for id_ in chunk if id_ not in result)
+        return result
@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Response Cache Classes
+"""
+
+__title__ = "wordpress-cache"
+
+import base64
+import json
+import os
+import tempfile
+from hashlib import sha1
+from threading import Lock
+from time import time
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+from wordpress.helpers import UrlUtils
+
+
+class MemoryCache(object):
+    """ In-memory cache backend that evicts the least recently used entries
+    once the stored bodies and headers add up to more than max_bytes, or there
+    are more than max_entries of them """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=None):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    @classmethod
+    def entry_size(cls, entry):
+        return len(entry['content']) + sum(
+            len(key) + len(value) for key, value in entry['headers'].items()
+        )
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        entry_size = self.entry_size(entry)
+        with self._lock:
+            self._delete(key)
+            if entry_size > self.max_bytes:
+                return
+            self._entries[key] = entry
+            self.size += entry_size
+            while self.size > self.max_bytes \
+            or (self.max_entries is not None and len(self._entries) > self.max_entries):
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= self.entry_size(evicted)
+
+    def _delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= self.entry_size(entry)
+
+    def delete(self, key):
+        with self._lock:
+            self._delete(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def items(self):
+        """ (key, entry) pairs, without counting as a use of the entries """
+        with self._lock:
+            return list(self._entries.items())
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCache(object):
+    """ On-disk cache backend storing one file per entry in directory, so cached
+    responses survive restarts and can be shared by processes on the same host.
+    Entries are stored as JSON with the body base64 encoded, so reading a file
+    someone else wrote there can't run code """
+
+    suffix = '.wpcache'
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def path(self, key):
+        if not isinstance(key, bytes):
+            key = key.encode('utf-8')
+        return os.path.join(self.directory, sha1(key).hexdigest() + self.suffix)
+
+    @classmethod
+    def read(cls, path):
+        """ The entry in the file at path, or None if it can't be read """
+        try:
+            with open(path, 'rb') as cache_file:
+                entry = json.loads(cache_file.read().decode('utf-8'))
+            entry['content'] = base64.b64decode(entry['content'])
+        except (IOError, OSError, ValueError, TypeError, KeyError):
+            return None
+        return entry
+
+    def get(self, key):
+        entry = self.read(self.path(key))
+        if entry is None or entry.get('key') != key:
+            return None
+        return entry
+
+    def set(self, key, entry):
+        entry = dict(entry, key=key, content=base64.b64encode(entry['content']).decode('ascii'))
+        # write to a temporary file then rename, so readers never see half an entry
+        handle, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(handle, 'wb') as cache_file:
+                cache_file.write(json.dumps(entry).encode('utf-8'))
+            os.rename(temp_path, self.path(key))
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def delete(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+    def keys(self):
+        return [key for key, entry in self.items()]
+
+    def items(self):
+        items = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith(self.suffix):
+                continue
+            entry = self.read(os.path.join(self.directory, filename))
+            if entry is not None and 'key' in entry:
+                items.append((entry['key'], entry))
+        return items
+
+    def __len__(self):
+        return len(self.keys())
+
+
+class ResponseCache(object):
+    """ HTTP conditional request cache for GET requests. Stores the body of responses
+    with an ETag or Last-Modified validator, sends If-None-Match / If-Modified-Since
+    when requesting them again, and serves a 304 Not Modified from the stored body.
+
+    ttls maps endpoints like 'products/categories' or 'wc/v2/products/attributes'
+    to a number of seconds for which their responses are served straight from the
+    cache without asking the server. The longest matching endpoint applies, and
+    an endpoint also covers the resources under it """
+
+    # added by OAuth.get_oauth_url on every request, so they can't be part of the key
+    volatile_params = ('oauth_nonce', 'oauth_timestamp', 'oauth_signature')
+
+    def __init__(self, backend=None, ttls=None):
+        if backend is None:
+            backend = MemoryCache()
+        self.backend = backend
+        self.ttls = {}
+        for endpoint, ttl in (ttls or {}).items():
+            self.set_ttl(endpoint, ttl)
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self._stats_lock = Lock()
+
+    @property
+    def stats(self):
+        """ hits were served from a stored body, misses had nothing usable stored
+        and revalidations are the conditional requests sent to the server """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'revalidations': self.revalidations,
+        }
+
+    @classmethod
+    def resource_path(cls, endpoint):
+        """ endpoint without its query or surrounding slashes """
+        return UrlUtils.substitute_query(endpoint).strip('/')
+
+    @classmethod
+    def covers(cls, endpoint, resource, descendants=True):
+        return resource == endpoint \
+            or not endpoint \
+            or (descendants and resource.startswith(endpoint + '/'))
+
+    def set_ttl(self, endpoint, ttl):
+        """ Serves responses for endpoint from the cache for ttl seconds, or
+        stops doing so if ttl is None """
+        endpoint = self.resource_path(endpoint)
+        if ttl is None:
+            self.ttls.pop(endpoint, None)
+        else:
+            self.ttls[endpoint] = ttl
+
+    def ttl_for(self, resources):
+        """ The ttl of the longest endpoint covering any of the resource paths """
+        best = None
+        for endpoint, ttl in self.ttls.items():
+            if any(self.covers(endpoint, resource) for resource in resources):
+                if best is None or len(endpoint) > len(best[0]):
+                    best = (endpoint, ttl)
+        return best[1] if best else None
+
+    @classmethod
+    def is_fresh(cls, entry, ttl):
+        return ttl is not None and time() - entry['stored_at'] < ttl
+
+    def invalidate(self, endpoint, descendants=True):
+        """ Drops cached responses for endpoint, and unless descendants is False,
+        for the resources under it. Returns how many were dropped """
+        endpoint = self.resource_path(endpoint)
+        dropped = 0
+        for key, entry in self.backend.items():
+            if any(
+                self.covers(endpoint, resource, descendants)
+                for resource in entry.get('resources', [])
+            ):
+                self.backend.delete(key)
+                dropped += 1
+        return dropped
+
+    def invalidate_write(self, resources):
+        """ Drops what a write to resources might have changed: the resources,
+        what is under them, and the collections they belong to. A write to a
+        batch endpoint can change anything in its collection """
+        for resource in resources:
+            self.invalidate(resource)
+            if '/' in resource:
+                collection, last = resource.rsplit('/', 1)
+                self.invalidate(collection, descendants=(last == 'batch'))
+
+    def clear(self):
+        for key in self.backend.keys():
+            self.backend.delete(key)
+
+    def count(self, stat):
+        with self._stats_lock:
+            setattr(self, stat, getattr(self, stat) + 1)
+
+    @classmethod
+    def key(cls, method, url, identity=None):
+        """ Cache key for a request, ignoring the volatile OAuth1 params and the
+        order of the query. identity stands for the credentials of the request,
+        since responses depend on who asks """
+        query = [
+            (key, value) for key, value in UrlUtils.get_query_list(url)
+            if key not in cls.volatile_params
+        ]
+        # sort by key only, keeping the order of repeated keys like include[]
+        query.sort(key=lambda pair: pair[0])
+        url = UrlUtils.substitute_query(url)
+        if query:
+            url = "%s?%s" % (url, urlencode(query))
+        if identity:
+            return "%s %s %s" % (method, url, identity)
+        return "%s %s" % (method, url)
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    @classmethod
+    def conditional_headers(cls, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def store(self, key, response, resources=(), ttl=None):
+        """ Stores a response if it has a validator to revalidate it with later,
+        or a ttl to serve it for. resources are the paths it can be invalidated by """
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if response.status_code != 200 or not (etag or last_modified or ttl):
+            return
+        headers = self.entity_headers(response.headers)
+        self.backend.set(key, {
+            'url': response.url,
+            'status_code': response.status_code,
+            'reason': response.reason,
+            'headers': headers,
+            'content': response.content,
+            'encoding': response.encoding,
+            'etag': etag,
+            'last_modified': last_modified,
+            'resources': list(resources),
+            'stored_at': time(),
+        })
+
+    def refresh(self, key, entry):
+        """ Restarts the ttl of an entry the server confirmed is unchanged """
+        self.backend.set(key, dict(entry, stored_at=time()))
+
+    @classmethod
+    def entity_headers(cls, headers):
+        """ headers that still apply to a stored body, which is already decoded """
+        return dict(
+            (header, value) for header, value in headers.items()
+            if header.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')
+        )
+
+    def cached_response(self, entry, response=None):
+        """ Builds a Response from a stored entry. response is the 304 that
+        confirmed the entry, whose headers are merged over the stored ones """
+        cached = Response()
+        cached.status_code = entry['status_code']
+        cached.reason = entry.get('reason')
+        cached.headers = CaseInsensitiveDict(entry['headers'])
+        cached.url = entry['url']
+        cached.encoding = entry['encoding']
+        cached._content = entry['content']
+        cached._content_consumed = True
+        cached.from_cache = True
+        if response is not None:
+            cached.headers.update(self.entity_headers(response.headers))
+            cached.request = response.request
+            cached.elapsed = response.elapsed
+            cached.connection = getattr(response, 'connection', None)
+        return cached
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Discovery Classes
+"""
+
+__title__ = "wordpress-discovery"
+
+import json
+import os
+import re
+import tempfile
+from threading import Lock
+from time import time
+
+from wordpress.helpers import UrlUtils
+
+
+class RouteTable(object):
+    """ The routes of an API index by namespace, with their methods and argument
+    schemas, for checking endpoints and methods without asking the server.
+
+    Each namespace's routes are kept as the JSON they were stored as, and only
+    decoded, with their path patterns compiled, the first time a route in that
+    namespace is looked up. Sites with many plugins have several MB of routes,
+    of which a client usually needs one or two namespaces """
+
+    def __init__(self, namespaces, encoded_routes):
+        self.namespaces = list(namespaces)
+        self._encoded = dict(encoded_routes)
+        self._routes = {}
+        self._patterns = {}
+        self._lock = Lock()
+
+    @classmethod
+    def from_index(cls, index):
+        grouped = {}
+        for path, route in (index.get('routes') or {}).items():
+            grouped.setdefault(route.get('namespace') or '', {})[path] = route
+        return cls(
+            index.get('namespaces') or [],
+            dict((namespace, json.dumps(routes)) for namespace, routes in grouped.items())
+        )
+
+    def encoded(self):
+        """ The routes of each namespace as JSON, for storing the table """
+        return dict(self._encoded)
+
+    @classmethod
+    def path(cls, endpoint, api_version=None):
+        """ The route path requested for endpoint, like /wc/v3/products/12 """
+        endpoint = UrlUtils.substitute_query(endpoint).strip('/')
+        return '/' + '/'.join(part for part in [api_version, endpoint] if part)
+
+    def namespace_of(self, path):
+        """ The longest namespace path is in, or '' for the routes outside any """
+        best = ''
+        for namespace in self._encoded:
+            if len(namespace) > len(best) \
+            and (path == '/' + namespace or path.startswith('/' + namespace + '/')):
+                best = namespace
+        return best
+
+    def routes(self, namespace):
+        """ The routes of a namespace, by path pattern """
+        routes = self._routes.get(namespace)
+        if routes is None:
+            with self._lock:
+                routes = self._routes.get(namespace)
+                if routes is None:
+                    routes = json.loads(self._encoded.get(namespace, '{}'))
+                    patterns = []
+                    for pattern in routes:
+                        try:
+                            patterns.append((re.compile('^%s$' % pattern), pattern))
+                        except re.error:
+                            continue
+                    self._patterns[namespace] = patterns
+                    self._routes[namespace] = routes
+        return routes
+
+    def match(self, path):
+        """ The (pattern, route) that path is served by, or (None, None) """
+        namespace = self.namespace_of(path)
+        routes = self.routes(namespace)
+        if path in routes:
+            return path, routes[path]
+        for compiled, pattern in self._patterns[namespace]:
+            if compiled.match(path):
+                return pattern, routes[pattern]
+        return None, None
+
+    def methods(self, path):
+        """ The methods path allows, or None if no route serves it """
+        pattern, route = self.match(path)
+        if route is None:
+            return None
+        return [method.upper() for method in route.get('methods') or []]
+
+    def args(self, path, method):
+        """ The argument schemas path takes for method, by argument name """
+        pattern, route = self.match(path)
+        args = {}
+        if route is not None:
+            for endpoint in route.get('endpoints') or []:
+                if method.upper() in [m.upper() for m in endpoint.get('methods') or []]:
+                    args.update(endpoint.get('args') or {})
+        return args
+
+    def validate(self, method, path):
+        """ Raises UserWarning unless a route serves path with method """
+        methods = self.methods(path)
+        if methods is None:
+            raise UserWarning("no route matches %s" % path)
+        if method.upper() not in methods and method.upper() not in ['HEAD', 'OPTIONS']:
+            raise UserWarning("%s does not allow %s, only %s" % (path, method, ", ".join(methods)))
+
+
+class Discovery(object):
+    """ The API index served at the root of the REST API, like /wp-json, fetched
+    once and shared by everything that needs it: the authentication links for
+    3-legged OAuth, and the route table.
+
+    With a path, the index is also kept on disk for ttl seconds so new processes
+    don't fetch it again. Its routes are stored as JSON text per namespace, so
+    loading it only decodes them when the route table is used """
+
+    ttl = 24 * 60 * 60
+
+    def __init__(self, requester, path=None, ttl=None):
+        self.requester = requester
+        self.path = os.path.expanduser(path) if path else None
+        if ttl is not None:
+            self.ttl = ttl
+        self._stored = None
+        self._route_table = None
+        self._lock = Lock()
+
+    def load(self):
+        """ The stored index for this site, if there is one younger than ttl """
+        if self.path is None:
+            return None
+        try:
+            with open(self.path, 'r') as index_file:
+                stored = json.load(index_file)
+        except (IOError, OSError, ValueError):
+            return None
+        if not isinstance(stored, dict) \
+        or stored.get('site') != self.requester.api_url \
+        or not time() - stored.get('fetched_at', 0) < self.ttl:
+            return None
+        return stored
+
+    def fetch(self):
+        """ Fetches the index from the API, storing it if there is a path """
+        response = self.requester.request('GET', self.requester.api_url)
+        assert \
+            response.status_code == 200, \
+            "API index at %s returned %s" % (self.requester.api_url, response.status_code)
+        index = response.json()
+        stored = {
+            'site': self.requester.api_url,
+            'fetched_at': time(),
+            'index': dict((key, value) for key, value in index.items() if key != 'routes'),
+            'routes': RouteTable.from_index(index).encoded(),
+        }
+        if self.path is not None:
+            self.write(stored)
+        return stored
+
+    def write(self, stored):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # write to a temporary file then rename, so readers never see half an index
+        handle, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(handle, 'w') as index_file:
+                json.dump(stored, index_file)
+            os.rename(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    @property
+    def stored(self):
+        if self._stored is None:
+            with self._lock:
+                if self._stored is None:
+                    self._stored = self.load() or self.fetch()
+        return self._stored
+
+    def refresh(self):
+        """ Fetches the index again, on the next use """
+        with self._lock:
+            self._stored = None
+            self._route_table = None
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    @property
+    def index(self):
+        """ The API index without its routes: name, namespaces, authentication... """
+        return self.stored['index']
+
+    @property
+    def authentication(self):
+        return self.index.get('authentication')
+
+    @property
+    def route_table(self):
+        if self._route_table is None:
+            stored = self.stored
+            with self._lock:
+                if self._route_table is None:
+                    self._route_table = RouteTable(
+                        stored['index'].get('namespaces') or [], stored['routes']
+                    )
+        return self._route_table
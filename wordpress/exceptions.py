@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Exception Classes
+"""
+
+__title__ = "wordpress-exceptions"
+
+from wordpress.helpers import UrlUtils
+from wordpress.retry import RetryPolicy
+
+
+class APIError(AssertionError):
+    """ Raised for a response with an unexpected status. Carries the status, the
+    headers and up to body_limit bytes of the raw body, which is all that is
+    formatted into the message; pretty() beautifies the whole body on demand.
+
+    A subclass of AssertionError, which the client raised for these before """
+
+    body_limit = 2048
+
+    def __init__(self, response):
+        self.response = response
+        self.status_code = response.status_code
+        request = getattr(response, 'request', None)
+        self.url = request.url if request is not None else response.url
+        self.headers = dict(response.headers)
+        content = response.content or b''
+        self.truncated = len(content) > self.body_limit
+        self.body = content[:self.body_limit]
+        super(APIError, self).__init__(self.message())
+
+    @classmethod
+    def for_response(cls, response):
+        """ The error for response, as the most specific class for its status """
+        if response.status_code == 429:
+            return RateLimited(response)
+        if response.status_code in [401, 403]:
+            return AuthError(response)
+        if response.status_code >= 500:
+            return ServerError(response)
+        return APIError(response)
+
+    @property
+    def text(self):
+        """ The truncated body, decoded """
+        return self.body.decode(self.response.encoding or 'utf-8', 'replace')
+
+    def message(self):
+        message = "API call to %s returned \nCODE: %s\n%s%s \nHEADERS: %s" % (
+            self.url,
+            self.status_code,
+            self.text,
+            " [truncated]" if self.truncated else "",
+            self.headers
+        )
+        if not isinstance(message, str):
+            # a str of UTF-8 bytes on Python 2, so str(error) works for any body
+            message = message.encode('utf-8')
+        return message
+
+    def pretty(self):
+        """ The whole body, beautified. Parses all of it, so can be slow """
+        return UrlUtils.beautify_response(self.response)
+
+
+class RateLimited(APIError):
+    """ 429 Too Many Requests. retry_after is the wait asked for, if any """
+
+    def __init__(self, response):
+        super(RateLimited, self).__init__(response)
+        self.retry_after = RetryPolicy.retry_after(response)
+
+
+class AuthError(APIError):
+    """ 401 Unauthorized or 403 Forbidden """
+
+
+class ServerError(APIError):
+    """ A 5xx status """
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Export Classes
+"""
+
+__title__ = "wordpress-export"
+
+import os
+import time
+import zlib
+from importlib import import_module
+
+from wordpress.helpers import PoolUtils, UrlUtils
+from wordpress.records import FieldSelection
+from wordpress.sync import FileCheckpointStore
+
+
+class Compression(object):
+    """ How an export file is compressed: None, 'gzip' or 'zstd' (which needs
+    the zstandard package). Each checkpointed stretch of output is compressed
+    as a gzip member or zstd frame of its own. Concatenated members and frames
+    read back as one stream, so a file can be cut back to its last checkpoint
+    and appended to """
+
+    extensions = {'.gz': 'gzip', '.gzip': 'gzip', '.zst': 'zstd', '.zstd': 'zstd'}
+
+    def __init__(self, name=None, level=None):
+        self.name = name
+        self.level = level
+        self.module = None
+        if name == 'zstd':
+            try:
+                self.module = import_module('zstandard')
+            except ImportError:
+                raise UserWarning("zstd compression needs the zstandard package")
+        elif name not in [None, 'gzip']:
+            raise UserWarning("unknown compression %s, expected gzip or zstd" % name)
+
+    @classmethod
+    def for_path(cls, path, name=None, level=None):
+        """ The compression named, or failing that the one path's extension implies """
+        if name is None:
+            name = cls.extensions.get(os.path.splitext(path)[1].lower())
+        return cls(name, level)
+
+    def compressobj(self):
+        """ A compressor for one member or frame, with compress() and a flush()
+        that ends it, or None for no compression """
+        if self.name == 'gzip':
+            # wbits of 16 + 15 writes the gzip header and trailer
+            level = self.level if self.level is not None else 6
+            return zlib.compressobj(level, zlib.DEFLATED, 31)
+        if self.name == 'zstd':
+            level = self.level if self.level is not None else 3
+            return self.module.ZstdCompressor(level=level).compressobj()
+        return None
+
+
+class ExportWriter(object):
+    """ Appends to an export file from offset, cutting off anything after it
+    left by a run that stopped before its next checkpoint """
+
+    def __init__(self, path, compression, offset=0):
+        if offset:
+            self.file = open(path, 'r+b')
+            self.file.seek(0, os.SEEK_END)
+            if self.file.tell() < offset:
+                self.file.close()
+                raise UserWarning(
+                    "%s is shorter than its checkpoint records, reset the export to start over" % path
+                )
+            self.file.truncate(offset)
+            self.file.seek(offset)
+        else:
+            self.file = open(path, 'wb')
+        self.compression = compression
+        self.compressor = None
+        self.written = 0
+
+    def write(self, data):
+        if self.compressor is None:
+            self.compressor = self.compression.compressobj()
+        if self.compressor is not None:
+            data = self.compressor.compress(data)
+        self.file.write(data)
+        self.written += len(data)
+
+    def mark(self):
+        """ Ends the current member or frame and syncs the file to disk,
+        returning the offset a later run can resume from """
+        if self.compressor is not None:
+            data = self.compressor.flush()
+            self.file.write(data)
+            self.written += len(data)
+            self.compressor = None
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+
+class ExportPage(object):
+    """ A page fetched for export, with its items encoded as JSON lines """
+
+    __slots__ = ['page', 'data', 'items', 'has_next', 'total_pages']
+
+    def __init__(self, page, data, items, has_next, total_pages):
+        self.page = page
+        self.data = data
+        self.items = items
+        self.has_next = has_next
+        self.total_pages = total_pages
+
+
+class ExportReport(object):
+    """ The progress of an export run: the pages and items written by this
+    run, the uncompressed bytes of their JSON lines and the bytes written to
+    disk. skipped_pages counts the pages a previous run had finished """
+
+    def __init__(self, skipped_pages=0, total_pages=None):
+        self.pages = 0
+        self.items = 0
+        self.bytes = 0
+        self.written = 0
+        self.skipped_pages = skipped_pages
+        self.total_pages = total_pages
+        self.complete = False
+        self.started = time.time()
+        self.elapsed = 0.0
+
+    @property
+    def items_per_second(self):
+        return self.items / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def mb_per_second(self):
+        """ Megabytes per second of JSON lines, before compression """
+        return self.bytes / self.elapsed / 1e6 if self.elapsed else 0.0
+
+    def __repr__(self):
+        return "<ExportReport pages=%d/%s items=%d %.1f items/s %.2f MB/s>" % (
+            self.skipped_pages + self.pages, self.total_pages or '?', self.items,
+            self.items_per_second, self.mb_per_second
+        )
+
+
+class Exporter(object):
+    """ Writes every item of a collection endpoint like products or orders to
+    a file as newline delimited JSON, one item per line in page order.
+
+    A checkpoint of the pages finished and the length of the file they take
+    up is stored every checkpoint_pages pages, once the file is synced to disk,
+    in store (by default a FileCheckpointStore next to the file). A run stopped
+    by a crash is resumed by running again: the file is cut back to the
+    checkpoint and the export goes on from the next page. Once an export is
+    complete, running it again does nothing until reset().
+
+    Resuming relies on the pages holding the same items as before, so
+    params should order the collection by something that doesn't change as it
+    is exported, like {'orderby': 'id', 'order': 'asc'}.
+
+    With concurrency > 1, once the first page reveals the total page count
+    the remaining pages are fetched over a pool of that many threads, and
+    written in order. progress, if given, is called with the ExportReport
+    after each page """
+
+    per_page = 100
+    checkpoint_pages = 10
+
+    def __init__(self, api, endpoint, path, store=None, key=None, compression=None, level=None,
+                 per_page=None, concurrency=1, fields=None, embed=None, params=None,
+                 checkpoint_pages=None, progress=None):
+        self.api = api
+        self.endpoint = endpoint
+        self.path = os.path.expanduser(path)
+        self.compression = Compression.for_path(self.path, compression, level)
+        self.store = store if store is not None else FileCheckpointStore(self.path + '.checkpoint')
+        self.key = key or "export %s" % api.requester.endpoint_url(endpoint)
+        if per_page is not None:
+            self.per_page = per_page
+        if checkpoint_pages is not None:
+            self.checkpoint_pages = max(checkpoint_pages, 1)
+        self.concurrency = concurrency
+        self.query = UrlUtils.flatten_query(params or []) + FieldSelection(fields, embed).query()
+        self.progress = progress
+
+    @property
+    def checkpoint(self):
+        return self.store.get(self.key)
+
+    def reset(self):
+        """ Forgets the checkpoint, so the next run exports from the first page """
+        self.store.delete(self.key)
+
+    def fetch(self, page):
+        response = self.api._get_page(self.endpoint, page, self.per_page, self.query)
+        items = self.api._page_items(response)
+        dumps = self.api.json_backend.dumps
+        data = b''.join([dumps(item) + b'\n' for item in items])
+        return ExportPage(
+            page, data, len(items),
+            self.api._has_next_page(response, page, self.per_page, len(items)),
+            self.api._total_pages(response)
+        )
+
+    def pages(self, first):
+        """ Yields the pages from first on, in order """
+        export_page = self.fetch(first)
+        yield export_page
+        if not export_page.has_next:
+            return
+        if self.concurrency > 1 and export_page.total_pages is not None:
+            for export_page in PoolUtils.imap_bounded(
+                self.fetch, range(first + 1, export_page.total_pages + 1), self.concurrency
+            ):
+                yield export_page
+            return
+        page = first
+        while export_page.has_next:
+            page += 1
+            export_page = self.fetch(page)
+            yield export_page
+
+    def run(self):
+        checkpoint = self.checkpoint
+        if checkpoint is not None and checkpoint['compression'] != self.compression.name:
+            raise UserWarning("%s was started with compression %s, not %s" % (
+                self.path, checkpoint['compression'], self.compression.name
+            ))
+        if checkpoint is not None and not os.path.exists(self.path):
+            raise UserWarning(
+                "%s is missing but has a checkpoint, reset the export to start over" % self.path
+            )
+        checkpoint = checkpoint or {
+            'compression': self.compression.name, 'pages': 0, 'items': 0, 'offset': 0,
+            'total_pages': None, 'complete': False,
+        }
+        report = ExportReport(checkpoint['pages'], checkpoint['total_pages'])
+        if checkpoint['complete']:
+            report.complete = True
+            return report
+        writer = ExportWriter(self.path, self.compression, checkpoint['offset'])
+        items = checkpoint['items']
+        try:
+            unmarked = 0
+            for export_page in self.pages(checkpoint['pages'] + 1):
+                writer.write(export_page.data)
+                report.pages += 1
+                report.items += export_page.items
+                report.bytes += len(export_page.data)
+                if export_page.total_pages is not None:
+                    report.total_pages = export_page.total_pages
+                unmarked += 1
+                complete = not export_page.has_next
+                if complete or unmarked >= self.checkpoint_pages:
+                    checkpoint = dict(
+                        checkpoint,
+                        pages=export_page.page,
+                        items=items + report.items,
+                        offset=writer.mark(),
+                        total_pages=report.total_pages,
+                        complete=complete,
+                    )
+                    unmarked = 0
+                    self.store.set(self.key, checkpoint)
+                report.written = writer.written
+                report.elapsed = time.time() - report.started
+                report.complete = complete
+                if self.progress is not None:
+                    self.progress(report)
+        finally:
+            writer.close()
+        return report
@@ -7,6 +7,10 @@ Wordpress Hellpers Class
 __title__ = "wordpress-requests"
 
 import posixpath
+from collections import deque
+from numbers import Integral
+from itertools import islice
+from multiprocessing.pool import ThreadPool
 
 try:
     from urllib.parse import urlencode, quote, unquote, parse_qsl, urlparse, urlunparse
@@ -16,9 +20,12 @@ except ImportError:
     from urlparse import parse_qs, parse_qsl, urlparse, urlunparse
     from urlparse import ParseResult as URLParseResult
 
-from collections import OrderedDict
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
-from bs4 import BeautifulSoup
+from collections import OrderedDict
 
 
 class StrUtils(object):
@@ -44,6 +51,49 @@ class SeqUtils(object):
     def filter_true(cls, seq):
         return [item for item in seq if item]
 
+class PoolUtils(object):
+    @classmethod
+    def imap_bounded(cls, func, iterable, concurrency, ordered=True):
+        """ Maps func over iterable on a pool of `concurrency` threads, yielding results
+        in input order or as they complete. No more than `concurrency` items are in
+        flight or waiting to be consumed at any time, so memory stays bounded """
+        pool = ThreadPool(concurrency)
+        try:
+            iterator = iter(iterable)
+            if ordered:
+                pending = deque(
+                    pool.apply_async(func, (item,)) for item in islice(iterator, concurrency)
+                )
+                while pending:
+                    result = pending.popleft().get()
+                    for item in islice(iterator, 1):
+                        pending.append(pool.apply_async(func, (item,)))
+                    yield result
+            else:
+                done = Queue()
+
+                def call(item):
+                    try:
+                        return True, func(item)
+                    except Exception as exc:
+                        return False, exc
+
+                in_flight = 0
+                for item in islice(iterator, concurrency):
+                    pool.apply_async(call, (item,), callback=done.put)
+                    in_flight += 1
+                while in_flight:
+                    success, result = done.get()
+                    in_flight -= 1
+                    if not success:
+                        raise result
+                    for item in islice(iterator, 1):
+                        pool.apply_async(call, (item,), callback=done.put)
+                        in_flight += 1
+                    yield result
+        finally:
+            pool.terminate()
+
 class UrlUtils(object):
 
     @classmethod
@@ -73,6 +123,16 @@ class UrlUtils(object):
         # print "new query string", query_string
         return cls.substitute_query(url, query_string)
 
+    @classmethod
+    def update_query(cls, url, updates):
+        """ Sets or overrides several queries in a url, keeping any repeated
+        keys (like include[]) that are not being overridden """
+        query_list = [
+            (key, value) for key, value in cls.get_query_list(url) if key not in updates
+        ]
+        query_list += list(updates.items())
+        return cls.substitute_query(url, urlencode(query_list))
+
     @classmethod
     def get_query_singular(cls, url, key, default=None):
         """ Gets the value of a single query in a url """
@@ -112,16 +172,53 @@ class UrlUtils(object):
         if not query_string:
             query_string = ''
 
-        urlparse_result = urlparse(url)
+        return urlunparse(urlparse(url)._replace(query=query_string))
+
+    @classmethod
+    def flatten_query(cls, params, prefix=None):
+        """ (key, value) pairs for params, a dict or list of pairs, encoded the
+        way Wordpress (PHP) reads them: lists as a repeated key[] like include[],
+        and dicts as key[field] like filter[...]. Values are converted to
+        strings as PHP would, and None values are left out """
+        if isinstance(params, dict):
+            params = params.items()
+        pairs = []
+        for key, value in params:
+            if prefix is not None:
+                key = '%s[%s]' % (prefix, key)
+            if value is None:
+                continue
+            if isinstance(value, dict):
+                pairs.extend(cls.flatten_query(value, key))
+            elif isinstance(value, (list, tuple, set, frozenset)):
+                for index, item in enumerate(value):
+                    if isinstance(item, (dict, list, tuple, set, frozenset)):
+                        pairs.extend(cls.flatten_query([(index, item)], key))
+                    elif item is not None:
+                        pairs.append((key + '[]', cls.query_value(item)))
+            else:
+                pairs.append((key, cls.query_value(value)))
+        return pairs
+
+    @classmethod
+    def query_value(cls, value):
+        if type(value) is int:
+            return str(value)
+        value = cls.get_value_like_as_php(value)
+        if not isinstance(value, (str, bytes)):
+            # unicode on python 2, which urlencode and quote need as utf-8
+            value = value.encode('utf-8')
+        return value
 
-        return urlunparse(URLParseResult(
-            scheme=urlparse_result.scheme,
-            netloc=urlparse_result.netloc,
-            path=urlparse_result.path,
-            params=urlparse_result.params,
-            query=query_string,
-            fragment=urlparse_result.fragment
-        ))
+    @classmethod
+    def extend_query(cls, url, pairs):
+        """ Appends (key, value) pairs to the query string of url """
+        if not pairs:
+            return url
+        return cls.substitute_query(url, "&".join(SeqUtils.filter_true([
+            urlparse(url).query,
+            urlencode(pairs)
+        ])))
 
     @classmethod
     def add_query(cls, url, new_key, new_value):
@@ -154,7 +251,7 @@ class UrlUtils(object):
             return val
         elif isinstance(val, bool):
             return "1" if val else ""
-        elif isinstance(val, int):
+        elif isinstance(val, Integral):
             return str(val)
         elif isinstance(val, float):
             return str(int(val)) if val % 1 == 0 else str(val)
@@ -164,4 +261,6 @@ class UrlUtils(object):
     @staticmethod
     def beautify_response(response):
         """ Returns a beautified response in the default locale """
+        # only needed for error messages, so bs4 and lxml aren't loaded up front
+        from bs4 import BeautifulSoup
         return BeautifulSoup(response.text, 'lxml').prettify().encode(errors='backslashreplace')
@@ -12,9 +12,8 @@ from hmac import new as HMAC
 from hashlib import sha1, sha256
 from base64 import b64encode
 import binascii
-import webbrowser
 import requests
-from bs4 import BeautifulSoup
+from threading import RLock
 
 try:
     from urllib.parse import urlencode, quote, unquote, parse_qs, parse_qsl, urlparse, urlunparse
@@ -46,6 +45,9 @@ class OAuth(object):
         self.signature_method = kwargs.get('signature_method', 'HMAC-SHA1')
         self.force_timestamp = kwargs.get('force_timestamp')
         self.force_nonce = kwargs.get('force_nonce')
+        # sign keys and keyed HMAC objects, so they aren't rebuilt for every request
+        self._sign_keys = {}
+        self._signers = {}
 
     @property
     def api_version(self):
@@ -59,41 +61,51 @@ class OAuth(object):
         "gets consumer_secret and turns it into a string suitable for signing"
         if not consumer_secret:
             raise UserWarning("no consumer_secret provided")
-        token_secret = str(token_secret) if token_secret else ''
-        if self.api_namespace == 'wc-api' \
-        and self.api_version in ["v1", "v2"]:
-            # special conditions for wc-api v1-2
-            key = consumer_secret
-        else:
-            key = "%s&%s" % (consumer_secret, token_secret)
+        cache_key = (consumer_secret, token_secret, self.api_namespace, self.api_version)
+        key = self._sign_keys.get(cache_key)
+        if key is None:
+            token_secret = str(token_secret) if token_secret else ''
+            if self.api_namespace == 'wc-api' \
+            and self.api_version in ["v1", "v2"]:
+                # special conditions for wc-api v1-2
+                key = consumer_secret
+            else:
+                key = "%s&%s" % (consumer_secret, token_secret)
+            if len(self._sign_keys) >= 32:
+                self._sign_keys.clear()
+            self._sign_keys[cache_key] = key
         return key
 
     def add_params_sign(self, method, url, params, sign_key=None):
         """ Adds the params to a given url, signs the url with sign_key if provided,
-        otherwise generates sign_key automatically and returns a signed url """
+        otherwise generates sign_key automatically and returns a signed url.
+        The params are normalized once, and the same sorted pairs give both the
+        signature base string and the signed query """
         if isinstance(params, dict):
             params = params.items()
 
         urlparse_result = urlparse(url)
 
         if urlparse_result.query:
-            params += parse_qsl(urlparse_result.query)
-            # for key, value in parse_qsl(urlparse_result.query):
-            #     params += [(key, value)]
+            params = list(params) + parse_qsl(urlparse_result.query)
 
-        params = self.sorted_params(params)
-
-        params_without_signature = []
-        for key, value in params:
-            if key != "oauth_signature":
-                params_without_signature.append((key, value))
+        params = self.normalize_sorted_params(
+            (key, value) for key, value in params if key != "oauth_signature"
+        )
+        query_string = "&".join(["%s=%s" % (key, value) for key, value in params])
 
-        signature = self.generate_oauth_signature(method, params_without_signature, url, sign_key)
-        params = params_without_signature + [("oauth_signature", signature)]
+        base_request_uri = urlunparse(urlparse_result._replace(query=''))
+        string_to_sign = "&".join([
+            method, quote(base_request_uri, ""), quote(query_string, '~')
+        ])
+        signature = self.sign(string_to_sign, sign_key)
 
-        query_string = self.flatten_params(params)
+        params.append(("oauth_signature", self.normalize_str(signature)))
+        # the server signs the values of an array in the order they are sent
+        params.sort(key=self.normalized_base)
+        query_string = "&".join(["%s=%s" % (key, value) for key, value in params])
 
-        return UrlUtils.substitute_query(url, query_string)
+        return urlunparse(urlparse_result._replace(query=query_string))
 
     def get_params(self):
         return [
@@ -103,9 +115,12 @@ class OAuth(object):
             ("oauth_timestamp", self.generate_timestamp()),
         ]
 
-    def get_oauth_url(self, endpoint_url, method):
-        """ Returns the URL with OAuth params """
+    def get_oauth_url(self, endpoint_url, method, query=None):
+        """ Returns the URL with OAuth params. query is a list of (key, value)
+        pairs to sign and add along with any already in endpoint_url """
         params = self.get_params()
+        if query:
+            params += query
 
         return self.add_params_sign(method, endpoint_url, params)
 
@@ -120,41 +135,53 @@ class OAuth(object):
 
         string_to_sign = self.get_signature_base_string(method, params, url)
 
+        # print "\nstring_to_sign: %s" % repr(string_to_sign)
+        return self.sign(string_to_sign, key)
+
+    def signer(self, key):
+        """ A fresh HMAC object for key, copied from one keyed once per client """
+        prototype = self._signers.get((key, self.signature_method))
+        if prototype is None:
+            if self.signature_method == 'HMAC-SHA1':
+                hmac_mod = sha1
+            elif self.signature_method == 'HMAC-SHA256':
+                hmac_mod = sha256
+            else:
+                raise UserWarning("Unknown signature_method")
+            prototype = HMAC(key, digestmod=hmac_mod)
+            if len(self._signers) >= 32:
+                self._signers.clear()
+            self._signers[(key, self.signature_method)] = prototype
+        return prototype.copy()
+
+    def sign(self, string_to_sign, key=None):
+        """ The base64 HMAC signature of string_to_sign """
         if key is None:
             key = self.get_sign_key(self.consumer_secret)
 
-        if self.signature_method == 'HMAC-SHA1':
-            hmac_mod = sha1
-        elif self.signature_method == 'HMAC-SHA256':
-            hmac_mod = sha256
-        else:
-            raise UserWarning("Unknown signature_method")
-
-        # print "\nstring_to_sign: %s" % repr(string_to_sign)
-        # print "\nkey: %s" % repr(key)
-        sig = HMAC(key, string_to_sign, hmac_mod)
-        sig_b64 = binascii.b2a_base64(sig.digest())[:-1]
-        # print "\nsig_b64: %s" % sig_b64
-        return sig_b64
+        sig = self.signer(key)
+        sig.update(string_to_sign)
+        return binascii.b2a_base64(sig.digest())[:-1]
 
     @classmethod
     def sorted_params(cls, params):
-        """ Sort parameters. works with RFC 5849 logic. params is a list of key, value pairs """
+        """ Sort parameters. works with RFC 5849 logic. params is a list of key, value pairs.
+        Keys are grouped by their name before any '[', in order of that name, and
+        only the first value of a key is kept """
 
         if isinstance(params, dict):
             params = params.items()
 
-        # return sorted(params)
-        ordered = []
-        base_keys = sorted(set(k.split('[')[0] for k, v in params))
-        keys_seen = []
-        for base in base_keys:
-            for key, value in params:
-                if key == base or key.startswith(base + '['):
-                    if key not in keys_seen:
-                        ordered.append((key, value))
-                        keys_seen.append(key)
+        groups = {}
+        keys_seen = set()
+        for key, value in params:
+            if key not in keys_seen:
+                keys_seen.add(key)
+                groups.setdefault(key.split('[')[0], []).append((key, value))
 
+        ordered = []
+        for base in sorted(groups):
+            ordered.extend(groups[base])
         return ordered
 
     @classmethod
@@ -176,6 +203,39 @@ class OAuth(object):
         # print "RESPONSE: %s\n" % str(resposne.split('&'))
         return response
 
+    @classmethod
+    def normalize_sorted_params(cls, params):
+        """ Normalizes the first value of each key and orders them as the server
+        does: grouped by their name before any '[', in order of that name, and
+        in the order given within a group, as PHP keeps the order of an array.
+
+        Every value of a list key like include[] is kept, numbered include[0],
+        include[1]..., which is how PHP parses them and so how the server
+        signs them """
+        keys_seen = set()
+        list_counts = {}
+        groups = {}
+        for key, value in params:
+            if key.endswith('[]'):
+                index = list_counts.get(key, 0)
+                list_counts[key] = index + 1
+                key = '%s%d]' % (key[:-1], index)
+            if key not in keys_seen:
+                keys_seen.add(key)
+                groups.setdefault(key.split('[')[0], []).append((
+                    cls.normalize_str(key),
+                    cls.normalize_str(UrlUtils.get_value_like_as_php(value))
+                ))
+        normalized = []
+        for base in sorted(groups):
+            normalized.extend(groups[base])
+        return normalized
+
+    @classmethod
+    def normalized_base(cls, pair):
+        """ The name before any '[' of a normalized key, which escapes the '[' """
+        return pair[0].split('%5B')[0]
+
     @classmethod
     def flatten_params(cls, params):
         if isinstance(params, dict):
@@ -204,7 +264,9 @@ class OAuth(object):
         ).hexdigest()
 
 class OAuth_3Leg(OAuth):
-    """ Provides 3 legged OAuth1a, mostly based off this: http://www.lexev.org/en/2015/oauth-step-step/"""
+    """ Provides 3 legged OAuth1a, mostly based off this: http://www.lexev.org/en/2015/oauth-step-step/
+    Safe to share between threads: the lazily generated discovery, tokens and
+    verifier are each fetched once, however many threads ask for them at once """
 
     # oauth_version = '1.0A'
 
@@ -219,13 +281,19 @@ class OAuth_3Leg(OAuth):
         self._oauth_verifier = None
         self._access_token = None
         self.access_token_secret = None
+        self.token_store = kwargs.get('token_store')
+        self.discovery = kwargs.get('discovery')
+        # reentrant, since generating the access token generates the rest
+        self._auth_lock = RLock()
 
     @property
     def authentication(self):
         """ This is an object holding the authentication links discovered from the API
         automatically generated if accessed before generated """
         if not self._authentication:
-            self._authentication = self.discover_auth()
+            with self._auth_lock:
+                if not self._authentication:
+                    self._authentication = self.discover_auth()
         return self._authentication
 
     @property
@@ -233,7 +301,9 @@ class OAuth_3Leg(OAuth):
         """ This is the verifier string used in authentication
         automatically generated if accessed before generated """
         if not self._oauth_verifier:
-            self._oauth_verifier = self.get_verifier()
+            with self._auth_lock:
+                if not self._oauth_verifier:
+                    self._oauth_verifier = self.get_verifier()
         return self._oauth_verifier
 
     @property
@@ -241,7 +311,9 @@ class OAuth_3Leg(OAuth):
         """ This is the oauth_token used in requesting an access_token
         automatically generated if accessed before generated """
         if not self._request_token:
-            self.get_request_token()
+            with self._auth_lock:
+                if not self._request_token:
+                    self.get_request_token()
         return self._request_token
 
     @property
@@ -249,9 +321,66 @@ class OAuth_3Leg(OAuth):
         """ This is the oauth_token used to sign requests to protected resources
         automatically generated if accessed before generated """
         if not self._access_token:
-            self.get_access_token()
+            with self._auth_lock:
+                if not self._access_token and not self.load_access_token():
+                    self.get_access_token()
+                    self.save_access_token()
         return self._access_token
 
+    @property
+    def token_store_key(self):
+        return "%s %s" % (self.requester.api_url, self.consumer_key)
+
+    def valid_token_entry(self, entry):
+        """ Whether a token store entry holds an access token for this site and consumer """
+        return isinstance(entry, dict) \
+            and entry.get('site') == self.requester.api_url \
+            and entry.get('consumer_key') == self.consumer_key \
+            and bool(entry.get('oauth_token')) \
+            and bool(entry.get('oauth_token_secret'))
+
+    def load_access_token(self):
+        """ Takes the access token from the token store, if it has a valid one,
+        instead of going through the whole handshake. Invalid entries are dropped """
+        if self.token_store is None:
+            return False
+        entry = self.token_store.get(self.token_store_key)
+        if not self.valid_token_entry(entry):
+            if entry is not None:
+                self.token_store.delete(self.token_store_key)
+            return False
+        self.access_token_secret = entry['oauth_token_secret']
+        self._access_token = entry['oauth_token']
+        return True
+
+    def save_access_token(self):
+        if self.token_store is None or not self._access_token:
+            return
+        self.token_store.set(self.token_store_key, {
+            'site': self.requester.api_url,
+            'consumer_key': self.consumer_key,
+            'oauth_token': self._access_token,
+            'oauth_token_secret': self.access_token_secret,
+            'stored_at': int(time()),
+        })
+
+    def invalidate_access_token(self, access_token):
+        """ Forgets access_token after the server rejected it, so the next request
+        authenticates again. Does nothing if another thread already replaced it """
+        with self._auth_lock:
+            if self._access_token != access_token:
+                return
+            self._access_token = None
+            self.access_token_secret = None
+            self._request_token = None
+            self.request_token_secret = None
+            self._oauth_verifier = None
+            if self.token_store is not None:
+                entry = self.token_store.get(self.token_store_key)
+                # another process may have stored a fresh token already
+                if isinstance(entry, dict) and entry.get('oauth_token') == access_token:
+                    self.token_store.delete(self.token_store_key)
+
     # def get_sign_key(self, consumer_secret, oauth_token_secret=None):
     #     "gets consumer_secret and oauth_token_secret and turns it into a string suitable for signing"
     #     if not oauth_token_secret:
@@ -266,7 +395,7 @@ class OAuth_3Leg(OAuth):
     #             key = "&".join([consumer_secret, oauth_token_secret])
     #     return key
 
-    def get_oauth_url(self, endpoint_url, method):
+    def get_oauth_url(self, endpoint_url, method, query=None):
         """ Returns the URL with OAuth params """
         assert self.access_token, "need a valid access token for this step"
 
@@ -275,6 +404,8 @@ class OAuth_3Leg(OAuth):
             ('oauth_callback', self.callback),
             ('oauth_token', self.access_token)
         ]
+        if query:
+            params += query
 
         sign_key = self.get_sign_key(self.consumer_secret, self.access_token_secret)
 
@@ -301,6 +432,14 @@ class OAuth_3Leg(OAuth):
 
     def discover_auth(self):
         """ Discovers the location of authentication resourcers from the API"""
+        if self.discovery is not None:
+            # shared with the route table, and possibly cached on disk
+            assert \
+                self.discovery.authentication, \
+                "API index should include location of authentication resources"
+            self._authentication = self.discovery.authentication
+            return self._authentication
+
         discovery_url = self.requester.api_url
 
         response = self.requester.request('GET', discovery_url)
@@ -338,8 +477,9 @@ class OAuth_3Leg(OAuth):
         resp_content = parse_qs(response.text)
 
         try:
-            self._request_token = resp_content['oauth_token'][0]
+            # secret first, so other threads never see a token without its secret
             self.request_token_secret = resp_content['oauth_token_secret'][0]
+            self._request_token = resp_content['oauth_token'][0]
         except:
             raise UserWarning("Could not parse request_token or request_token_secret in response from %s : %s" \
                 % (repr(response.request.url), UrlUtils.beautify_response(response)))
@@ -350,6 +490,8 @@ class OAuth_3Leg(OAuth):
         """ parses a form specified by a given form_id in the response,
         extracts form data and form action """
 
+        from bs4 import BeautifulSoup
+
         assert response.status_code is 200
         response_soup = BeautifulSoup(response.text, "lxml")
         form_soup = response_soup.select_one('form#%s' % form_id)
@@ -386,6 +528,9 @@ class OAuth_3Leg(OAuth):
         """ pretends to be a browser, uses the authorize auth link, submits user creds to WP login form to get
         verifier string from access token """
 
+        # only 3-legged OAuth scrapes forms, so bs4 and lxml aren't loaded up front
+        from bs4 import BeautifulSoup
+
         if request_token is None:
             request_token = self.request_token
         assert request_token, "need a valid request_token for this step"
@@ -532,8 +677,8 @@ class OAuth_3Leg(OAuth):
         access_response_queries = parse_qs(access_response.text)
 
         try:
-            self._access_token = access_response_queries['oauth_token'][0]
             self.access_token_secret = access_response_queries['oauth_token_secret'][0]
+            self._access_token = access_response_queries['oauth_token'][0]
         except:
             raise UserWarning("Could not parse access_token or access_token_secret in response from %s : %s" \
                 % (repr(access_response.request.url), UrlUtils.beautify_response(access_response)))
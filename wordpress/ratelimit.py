@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Rate Limit Classes
+"""
+
+__title__ = "wordpress-ratelimit"
+
+import json
+import os
+import time
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class TokenBucket(object):
+    """ Limits requests to rate per second on average, allowing bursts of up to
+    burst requests after a quiet spell. Shared by all threads using the client.
+
+    acquire() takes a token straight away, letting the bucket go into debt, and
+    sleeps until that debt is paid off. Waiting callers have already reserved
+    their turn, so they are spaced out evenly instead of waking up together """
+
+    def __init__(self, rate, burst=None):
+        if rate <= 0:
+            raise UserWarning("rate limit must be positive, not %s" % rate)
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.clock = time.time
+        self.sleep = time.sleep
+        self._lock = Lock()
+        self._tokens = self.burst
+        self._updated = None
+        self.acquired = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+
+    @classmethod
+    def from_value(cls, value):
+        """ A bucket from the rate_limit option: a bucket, requests per second or None """
+        if value is None or value is False:
+            return None
+        if hasattr(value, 'acquire'):
+            return value
+        return cls(value)
+
+    def take(self, tokens, available, updated, now):
+        """ Refills (available, updated) up to now and takes tokens from it. Returns
+        the new state and how long to wait before the tokens are really there """
+        if updated is not None:
+            available = min(self.burst, available + (now - updated) * self.rate)
+        available -= tokens
+        wait = -available / self.rate if available < 0 else 0.0
+        return available, now, wait
+
+    def reserve(self, tokens=1):
+        with self._lock:
+            self._tokens, self._updated, wait = self.take(
+                tokens, self._tokens, self._updated, self.clock()
+            )
+            return wait
+
+    def acquire(self, tokens=1):
+        """ Blocks until tokens may be spent, returning the seconds waited """
+        wait = self.reserve(tokens)
+        with self._lock:
+            self.acquired += tokens
+            if wait > 0:
+                self.waits += 1
+                self.wait_seconds += wait
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    @property
+    def metrics(self):
+        with self._lock:
+            return {
+                'rate': self.rate,
+                'burst': self.burst,
+                'acquired': self.acquired,
+                'waits': self.waits,
+                'wait_seconds': self.wait_seconds,
+            }
+
+
+class FileTokenBucket(TokenBucket):
+    """ TokenBucket whose state is kept in a file locked with flock, so that
+    processes on the same host (e.g. gunicorn workers) share one limit.
+    Needs fcntl, so is not available on Windows """
+
+    def __init__(self, path, rate, burst=None):
+        if fcntl is None:
+            raise UserWarning("FileTokenBucket needs fcntl, which is not available here")
+        super(FileTokenBucket, self).__init__(rate, burst)
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def reserve(self, tokens=1):
+        # the thread lock keeps threads of this process from sharing the file lock
+        with self._lock:
+            handle = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX)
+                state = os.read(handle, 1024)
+                try:
+                    available, updated = json.loads(state.decode('utf-8'))
+                except ValueError:
+                    available, updated = self.burst, None
+                available, updated, wait = self.take(tokens, available, updated, self.clock())
+                state = json.dumps([available, updated]).encode('utf-8')
+                os.lseek(handle, 0, os.SEEK_SET)
+                os.ftruncate(handle, 0)
+                os.write(handle, state)
+            finally:
+                os.close(handle)
+            return wait
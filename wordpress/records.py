@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Record Classes
+"""
+
+__title__ = "wordpress-records"
+
+import re
+from keyword import iskeyword
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    from ordereddict import OrderedDict
+
+
+class Record(object):
+    """ A lightweight, read only object with a slot per selected field, used
+    instead of a dict for items fetched with a field list. Fields are read as
+    attributes, or with [] and get() like the dict they replace """
+
+    __slots__ = ()
+    _types = {}
+    attribute_name = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+    @classmethod
+    def type_for(cls, fields):
+        """ The Record subclass with a slot for each of fields, made once, or
+        None if a field can't be a slot: one that isn't a valid attribute name,
+        like 'acf-field', or is already a Record attribute, like 'get' """
+        fields = tuple(fields)
+        if fields not in cls._types:
+            usable = all(
+                cls.attribute_name.match(field) and not iskeyword(field) and not hasattr(cls, field)
+                for field in fields
+            )
+            cls._types[fields] = type('Record', (cls,), {'__slots__': fields}) if usable else None
+        return cls._types[fields]
+
+    @classmethod
+    def from_item(cls, item):
+        record = cls.__new__(cls)
+        for field in cls.__slots__:
+            object.__setattr__(record, field, item.get(field))
+        return record
+
+    def __setattr__(self, name, value):
+        raise AttributeError("records are read only")
+
+    def __getitem__(self, field):
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        if field not in self.__slots__:
+            return default
+        return getattr(self, field)
+
+    def _asdict(self):
+        return OrderedDict((field, getattr(self, field)) for field in self.__slots__)
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other._asdict()
+        return dict(self._asdict()) == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Record(%s)" % ", ".join(
+            "%s=%r" % (field, getattr(self, field)) for field in self.__slots__
+        )
+
+
+class FieldSelection(object):
+    """ The _fields and _embed query for a field list and embed option, and the
+    Record type for the items they give. fields may name nested fields like
+    'meta.color', which select just that part of the top level field. embed is
+    True for all embeddable links, or a list of link relations like
+    ['author', 'wp:term']. Items stay dicts when a field can't be a Record
+    slot """
+
+    def __init__(self, fields=None, embed=None):
+        self.fields = list(fields or [])
+        self.embed = embed
+        if self.fields and embed:
+            # Wordpress only embeds when the links are among the fields
+            self.fields += [field for field in ['_links', '_embedded'] if field not in self.fields]
+        self._record_type = False
+
+    @property
+    def record_type(self):
+        """ The Record type for the top level fields, made when first needed,
+        or None to keep items as dicts """
+        if self._record_type is False:
+            self._record_type = None
+            if self.fields:
+                names = []
+                for field in self.fields:
+                    name = field.split('.')[0]
+                    if name not in names:
+                        names.append(name)
+                self._record_type = Record.type_for(names)
+        return self._record_type
+
+    def query(self):
+        query = []
+        if self.fields:
+            query.append(('_fields', ','.join(self.fields)))
+        if self.embed is True:
+            query.append(('_embed', '1'))
+        elif self.embed:
+            query.append(('_embed', ','.join(self.embed)))
+        return query
+
+    def record(self, item):
+        """ item as a Record if there is a field list, otherwise as it is """
+        record_type = self.record_type
+        if record_type is None or not isinstance(item, dict):
+            return item
+        return record_type.from_item(item)
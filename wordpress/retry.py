@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Retry Classes
+"""
+
+__title__ = "wordpress-retry"
+
+import random
+import time
+from email.utils import parsedate_tz, mktime_tz
+from threading import Lock
+
+from requests.exceptions import ConnectionError, Timeout
+
+
+class RetryPolicy(object):
+    """ Decides whether and when a failed request is sent again.
+
+    Requests that fail with one of the retry statuses (by default 429, 502, 503
+    and 504) or a connection error / timeout are retried up to total times,
+    waiting backoff_factor * 2 ** retry seconds (at most backoff_max), with full
+    jitter. A Retry-After header from the server is waited out instead, unless it
+    is longer than retry_after_max, in which case the request is given up.
+
+    Only idempotent methods are retried unless retry_post is set. Across the
+    client, retries are limited to budget_min plus budget_ratio of all requests,
+    so a struggling server isn't hammered with retries. Counters of attempts,
+    retries by reason, give-ups and time spent backing off are kept in metrics """
+
+    statuses = (429, 502, 503, 504)
+    methods = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+    exceptions = (ConnectionError, Timeout)
+
+    def __init__(self, total=3, backoff_factor=0.5, backoff_max=30, retry_after_max=120,
+                 retry_post=False, statuses=None, methods=None, budget_ratio=0.2, budget_min=10):
+        self.total = total
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.retry_after_max = retry_after_max
+        if statuses is not None:
+            self.statuses = tuple(statuses)
+        if methods is not None:
+            self.methods = tuple(method.upper() for method in methods)
+        if retry_post:
+            self.methods += ('POST',)
+        self.budget_ratio = budget_ratio
+        self.budget_min = budget_min
+        self.sleep = time.sleep
+        self._lock = Lock()
+        self.requests = 0
+        self.attempts = 0
+        self.retries = 0
+        self.giveups = 0
+        self.backoff_seconds = 0.0
+        self.retries_by_reason = {}
+
+    @classmethod
+    def from_value(cls, value):
+        """ A policy from the retries option: a RetryPolicy, a number of retries or None """
+        if value is None or value is False:
+            return None
+        if isinstance(value, RetryPolicy):
+            return value
+        return cls(total=value)
+
+    @property
+    def metrics(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'attempts': self.attempts,
+                'retries': self.retries,
+                'giveups': self.giveups,
+                'backoff_seconds': self.backoff_seconds,
+                'retries_by_reason': dict(self.retries_by_reason),
+            }
+
+    def start(self):
+        with self._lock:
+            self.requests += 1
+
+    def count_attempt(self):
+        with self._lock:
+            self.attempts += 1
+
+    def budget_allows(self):
+        return self.retries < self.budget_min + self.budget_ratio * self.requests
+
+    def should_retry(self, method, retry, reason, delay):
+        """ Whether to make another attempt, after delay seconds, when retry
+        retries have already been made and the last attempt failed for reason """
+        if method.upper() not in self.methods:
+            return False
+        with self._lock:
+            if retry >= self.total or delay is None or not self.budget_allows():
+                self.giveups += 1
+                return False
+            self.retries += 1
+            self.retries_by_reason[reason] = self.retries_by_reason.get(reason, 0) + 1
+            return True
+
+    def is_retry_status(self, status_code):
+        return status_code in self.statuses
+
+    @classmethod
+    def retry_after(cls, response):
+        """ Seconds the server asked to wait in its Retry-After header, if any """
+        if response is None:
+            return None
+        value = response.headers.get('retry-after')
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        parsed = parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(mktime_tz(parsed) - time.time(), 0)
+
+    def backoff(self, retry):
+        """ Exponential backoff with full jitter """
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** retry)))
+
+    def delay(self, retry, response=None):
+        """ Seconds to wait before the next attempt, or None if the server asked
+        to wait longer than retry_after_max """
+        retry_after = self.retry_after(response)
+        if retry_after is None:
+            return self.backoff(retry)
+        if retry_after > self.retry_after_max:
+            return None
+        return retry_after
+
+    def wait(self, seconds):
+        with self._lock:
+            self.backoff_seconds += seconds
+        if seconds > 0:
+            self.sleep(seconds)
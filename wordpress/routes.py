@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Route Classes
+"""
+
+__title__ = "wordpress-routes"
+
+from string import Formatter
+
+try:
+    long
+except NameError:
+    long = int
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+from wordpress.helpers import StrUtils
+
+
+class Route(object):
+    """ An endpoint template like 'products/{id}/variations/{vid}', parsed once
+    so each url is built by filling in the fields after a precomputed base url,
+    without joining or parsing urls per request.
+
+    Field values are quoted, so slugs and the like can't break out of their
+    path segment. Each request method takes the field values as keyword
+    arguments, plus data where the method sends a body, and params for the
+    query string as API.get takes them. A keyword argument that isn't a field
+    is an error rather than dropped """
+
+    def __init__(self, api, template, api_version=None):
+        self.api = api
+        self.template = StrUtils.decapitate(template, '/')
+        self.api_version = api_version
+        self.fields = []
+        # compiled to a %-format with a positional slot per field, the quickest to fill
+        parts = []
+        for literal, field, _, _ in Formatter().parse(self.template):
+            parts.append(literal.replace('%', '%%'))
+            if field is not None:
+                self.fields.append(field)
+                parts.append('%s')
+        self._format = ''.join(parts)
+
+    @classmethod
+    def quote_value(cls, value):
+        if type(value) in (int, long):
+            return str(value)
+        if not isinstance(value, (str, bytes)):
+            try:
+                value = unicode(value).encode('utf-8')
+            except NameError:
+                value = str(value)
+        return quote(value, '')
+
+    def endpoint(self, **values):
+        """ The endpoint with the fields filled in, relative to the api version """
+        if len(values) > len(self.fields):
+            unknown = sorted(set(values) - set(self.fields))
+            raise UserWarning("route %s has no field %s, pass query values as params" % (
+                self.template, ", ".join(unknown)
+            ))
+        try:
+            return self._format % tuple([
+                self.quote_value(values[field]) for field in self.fields
+            ])
+        except KeyError as exc:
+            raise UserWarning("route %s needs a value for %s" % (self.template, exc))
+
+    def url(self, **values):
+        base_url = self.api.requester.base_url(self.api_version)
+        endpoint = self.endpoint(**values)
+        if not endpoint:
+            return base_url
+        return base_url.rstrip('/') + '/' + endpoint
+
+    def request(self, method, data=None, params=None, **values):
+        kwargs = {}
+        if self.api_version:
+            kwargs['api_version'] = self.api_version
+        if params:
+            kwargs['params'] = params
+        return self.api.request(method, self.endpoint(**values), data, **kwargs)
+
+    def get(self, params=None, **values):
+        return self.request("GET", params=params, **values)
+
+    def post(self, data, params=None, **values):
+        return self.request("POST", data, params, **values)
+
+    def put(self, data, params=None, **values):
+        return self.request("PUT", data, params, **values)
+
+    def delete(self, params=None, **values):
+        return self.request("DELETE", params=params, **values)
+
+    def options(self, params=None, **values):
+        return self.request("OPTIONS", params=params, **values)
+
+    def __repr__(self):
+        return "<Route %s>" % self.template
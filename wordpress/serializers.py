@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Serializer Classes
+"""
+
+__title__ = "wordpress-serializers"
+
+import re
+from importlib import import_module
+
+
+class JSONBackend(object):
+    """ The JSON library used to encode request bodies and decode responses.
+    The standard library by default, so bodies are encoded the same whatever
+    else is installed. One of the faster libraries in names can be chosen
+    instead, and is only imported then. Any object with the same loads and
+    dumps can be used too """
+
+    names = ['json', 'orjson', 'ujson', 'simplejson']
+    default = 'json'
+
+    def __init__(self, name):
+        try:
+            self.module = import_module(name)
+        except ImportError:
+            raise UserWarning("JSON backend %s is not installed" % name)
+        self.name = name
+        self.loads = self.module.loads
+        if name == 'orjson':
+            self.dumps_kwargs = {'option': self.module.OPT_NON_STR_KEYS}
+        elif name == 'ujson':
+            self.dumps_kwargs = {'ensure_ascii': False, 'escape_forward_slashes': False}
+        else:
+            self.dumps_kwargs = {'ensure_ascii': False, 'separators': (',', ':')}
+
+    @classmethod
+    def from_value(cls, value=None):
+        """ A backend from the json_backend option: a backend, a module name or
+        None for the standard library """
+        if hasattr(value, 'dumps'):
+            return value
+        return cls(value or cls.default)
+
+    def dumps(self, data):
+        """ data as compact UTF-8 encoded JSON """
+        encoded = self.module.dumps(data, **self.dumps_kwargs)
+        if not isinstance(encoded, bytes):
+            encoded = encoded.encode('utf-8')
+        return encoded
+
+    def __repr__(self):
+        return "<JSONBackend %s>" % self.name
+
+
+class JSONArrayParser(object):
+    """ Decodes the items of a JSON array as its bytes arrive, so only about one
+    item is held in memory at a time rather than the whole body and object tree.
+    Also takes the array wrapped in an object, as legacy wc-api responses
+    like {"products": [...]} are.
+
+    feed() takes the next chunk of bytes and returns the items it completed.
+    Items are found by skipping over strings and scalars to the brackets and
+    braces that nest them, and the commas between them, then each one is
+    decoded by itself with loads """
+
+    string = br'"[^"\\]*(?:\\.[^"\\]*)*"'
+    skip_nested = re.compile(br'(?:[^\[\]{}"]+|' + string + br')*')
+    skip_top = re.compile(br'(?:[^\[\]{}",]+|' + string + br')*')
+    string_end = re.compile(br'["\\]')
+    wrapper = re.compile(br'\s*"(?:[^"\\]|\\.)*"\s*:\s*\[')
+    whitespace = b' \t\r\n'
+    # how far into a wrapping object to look for its array before giving up
+    wrapper_limit = 4096
+
+    def __init__(self, loads):
+        self.loads = loads
+        self.buffer = b''
+        self.pos = 0
+        self.state = 'start'
+        self.wrapped = False
+        self.item_start = None
+        self.scan = None
+        self.depth = 0
+        self.in_string = False
+
+    @classmethod
+    def iter_items(cls, chunks, loads):
+        """ Yields the items of the JSON array in chunks, an iterable of bytes """
+        parser = cls(loads)
+        for chunk in chunks:
+            for item in parser.feed(chunk):
+                yield item
+        parser.close()
+
+    def skip_whitespace(self):
+        buffer, pos = self.buffer, self.pos
+        while pos < len(buffer) and buffer[pos:pos + 1] in self.whitespace:
+            pos += 1
+        self.pos = pos
+        return pos < len(buffer)
+
+    def next_char(self):
+        return self.buffer[self.pos:self.pos + 1]
+
+    def feed(self, chunk):
+        # drop what has been consumed, keeping any partial item
+        keep = self.item_start if self.item_start is not None else self.pos
+        if keep:
+            self.buffer = self.buffer[keep:]
+            self.pos -= keep
+            if self.item_start is not None:
+                self.item_start -= keep
+                self.scan -= keep
+        self.buffer += chunk
+        items = []
+        while self.step(items):
+            pass
+        return items
+
+    def step(self, items):
+        """ Advances through the buffer, returning False when more bytes are needed """
+        if self.state == 'item':
+            return self.scan_item(items)
+        if not self.skip_whitespace():
+            return False
+        char = self.next_char()
+        if self.state == 'start':
+            if char == b'[':
+                self.state = 'items'
+            elif char == b'{':
+                self.state = 'wrapper'
+                self.wrapped = True
+            else:
+                raise UserWarning("expected a JSON array, got %r" % self.buffer[self.pos:self.pos + 20])
+            self.pos += 1
+        elif self.state == 'wrapper':
+            match = self.wrapper.match(self.buffer, self.pos)
+            if match is None:
+                if len(self.buffer) - self.pos > self.wrapper_limit:
+                    raise UserWarning("expected an object wrapping an array")
+                return False
+            self.pos = match.end()
+            self.state = 'items'
+        elif self.state == 'items':
+            if char == b']':
+                self.pos += 1
+                self.state = 'end'
+            else:
+                self.state = 'item'
+                self.item_start = self.scan = self.pos
+                self.depth = 0
+                self.in_string = False
+        elif self.state == 'after_item':
+            if char == b',':
+                self.state = 'items'
+            elif char == b']':
+                self.state = 'end'
+            else:
+                raise UserWarning("expected , or ] after an item, got %r" % char)
+            self.pos += 1
+        elif self.state == 'end':
+            if self.wrapped and char == b'}':
+                self.wrapped = False
+                self.pos += 1
+            else:
+                raise UserWarning("unexpected %r after the JSON array" % char)
+        return True
+
+    def scan_item(self, items):
+        buffer = self.buffer
+        while True:
+            if self.in_string:
+                match = self.string_end.search(buffer, self.scan)
+                if match is None:
+                    self.scan = len(buffer)
+                    return False
+                index = match.start()
+                if match.group() == b'\\':
+                    if index + 1 >= len(buffer):
+                        self.scan = index
+                        return False
+                    self.scan = index + 2
+                else:
+                    self.in_string = False
+                    self.scan = index + 1
+                continue
+            # skips whole strings and everything else that cannot end the item
+            skip = self.skip_nested if self.depth else self.skip_top
+            index = skip.match(buffer, self.scan).end()
+            char = buffer[index:index + 1]
+            self.scan = index + 1
+            if not char:
+                self.scan = index
+                return False
+            elif char == b'"':
+                # a string the buffer ends in the middle of
+                self.in_string = True
+            elif char in b'[{':
+                self.depth += 1
+            elif self.depth > 0:
+                self.depth -= 1
+            elif char in b',]':
+                items.append(self.loads(buffer[self.item_start:index]))
+                self.item_start = self.scan = None
+                self.pos = index
+                self.state = 'after_item'
+                return True
+            else:
+                raise UserWarning("unexpected %r in an item" % char)
+
+    def close(self):
+        """ Checks the array was complete """
+        self.skip_whitespace()
+        if self.state != 'end' or self.wrapped or self.pos < len(self.buffer):
+            raise UserWarning("JSON array ended early or has trailing data")
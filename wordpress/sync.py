@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Delta Sync Classes
+"""
+
+__title__ = "wordpress-sync"
+
+from calendar import timegm
+from datetime import datetime, timedelta
+from email.utils import mktime_tz, parsedate_tz
+from time import strptime
+
+from wordpress.records import FieldSelection
+from wordpress.tokens import MemoryTokenStore, FileTokenStore
+
+
+class MemoryCheckpointStore(MemoryTokenStore):
+    """ Keeps sync watermarks in memory, for as long as the process runs """
+
+
+class FileCheckpointStore(FileTokenStore):
+    """ Keeps sync watermarks in a JSON file, written to a temporary file then
+    renamed under a lock, so a crash never leaves a half written watermark """
+
+
+class SyncReport(object):
+    """ What a sync run did: the items passed to upsert, the requests made and
+    the watermark stored at the end """
+
+    def __init__(self, watermark=None):
+        self.upserts = 0
+        self.requests = 0
+        self.watermark = watermark
+
+    def __repr__(self):
+        return "<SyncReport upserts=%d requests=%d watermark=%s>" % (
+            self.upserts, self.requests, self.watermark
+        )
+
+
+class DeltaSync(object):
+    """ Passes the items of a collection endpoint like products, orders or posts
+    that changed since the last run to upsert, oldest change first.
+
+    The watermark of a run is the modification date (GMT) and ID of the last
+    item synced, kept in store under key. The next run asks for what was
+    modified from that second on, ordered by modification date, and skips
+    the items up to the watermark, since modified_after only has whole
+    seconds. Pages are asked for again from the newest second seen rather
+    than by number, so items modified meanwhile, which move to the end, don't
+    shift others past a page boundary.
+
+    The watermark only advances past a second once a later one has been seen,
+    or the server clock has passed it, so no item of that second can still
+    be to come. It is stored after each page, once upsert has returned for
+    the page's items. A run stopped by a crash resumes from the last stored
+    watermark, passing some items to upsert again, so upsert must be
+    idempotent.
+
+    after_param and orderby can be set to 'after' and 'date' for endpoints
+    whose items never change after they are created. fields, if given, are
+    fetched with _fields and passed as Records, always with the id and
+    modification date """
+
+    per_page = 100
+    # the field holding the modification date, the first of these an item has
+    modified_fields = ['date_modified_gmt', 'modified_gmt']
+    date_format = '%Y-%m-%dT%H:%M:%S'
+
+    def __init__(self, api, endpoint, upsert, store=None, key=None, per_page=None,
+                 fields=None, after_param='modified_after', orderby='modified', params=None):
+        self.api = api
+        self.endpoint = endpoint
+        self.upsert = upsert
+        self.store = store if store is not None else MemoryCheckpointStore()
+        self.key = key or "sync %s %s" % (
+            api.requester.endpoint_url(endpoint), after_param
+        )
+        if per_page is not None:
+            self.per_page = per_page
+        self.after_param = after_param
+        self.orderby = orderby
+        self.params = list(params.items() if isinstance(params, dict) else params or [])
+        if fields:
+            fields = list(fields) + [
+                field for field in ['id'] + self.modified_fields if field not in fields
+            ]
+        self.selection = FieldSelection(fields)
+
+    @property
+    def watermark(self):
+        return self.store.get(self.key)
+
+    def reset(self):
+        """ Forgets the watermark, so the next run syncs every item """
+        self.store.delete(self.key)
+
+    def item_key(self, item):
+        for field in self.modified_fields:
+            if item.get(field):
+                return item[field][:19], item['id']
+        raise UserWarning("item %s from %s has no modification date" % (item.get('id'), self.endpoint))
+
+    def after_value(self, since):
+        """ The second before since, so items modified at since are included """
+        after = datetime(*strptime(since, self.date_format)[:6]) - timedelta(seconds=1)
+        after = after.strftime(self.date_format)
+        if self.api.version and self.api.version.startswith('wc/'):
+            # read as GMT with dates_are_gmt
+            return after
+        # Wordpress reads dates without an offset as the site's local time
+        return after + 'Z'
+
+    def query(self, since, page):
+        query = [
+            ('orderby', self.orderby),
+            ('order', 'asc'),
+            ('per_page', self.per_page),
+            ('page', page),
+        ]
+        if since:
+            query.append((self.after_param, self.after_value(since)))
+            if self.api.version and self.api.version.startswith('wc/'):
+                query.append(('dates_are_gmt', 'true'))
+        return query + self.params
+
+    @classmethod
+    def settled(cls, modified, response):
+        """ Whether the server clock has passed the second modified, so no
+        more items can be modified in it """
+        date = parsedate_tz(response.headers.get('date') or '')
+        if date is None:
+            return False
+        return timegm(strptime(modified, cls.date_format)) < mktime_tz(date)
+
+    def run(self):
+        watermark = self.watermark
+        report = SyncReport(watermark)
+        skip_to = (watermark['modified_gmt'], watermark['id']) if watermark else None
+        # the newest second synced in this run, and the IDs synced in it
+        newest = watermark['modified_gmt'] if watermark else None
+        newest_ids = set()
+        page = 1
+        while True:
+            response = self.api.request(
+                "GET", self.endpoint, params=self.query(newest, page), fields=self.selection.fields
+            )
+            report.requests += 1
+            items = self.api._page_items(response)
+            completed = None
+            advanced = False
+            for item in items:
+                modified, id_ = self.item_key(item)
+                if skip_to is not None and (modified, id_) <= skip_to:
+                    continue
+                if modified == newest and id_ in newest_ids:
+                    continue
+                self.upsert(self.selection.record(item))
+                report.upserts += 1
+                if newest is None or modified > newest:
+                    if newest_ids:
+                        completed = (newest, max(newest_ids))
+                    newest, newest_ids = modified, set([id_])
+                    advanced = True
+                elif modified == newest:
+                    newest_ids.add(id_)
+            last_page = not self.api._has_next_page(response, page, self.per_page, len(items))
+            if last_page and newest_ids and self.settled(newest, response):
+                completed = (newest, max(newest_ids))
+            if completed is not None:
+                report.watermark = {'modified_gmt': completed[0], 'id': completed[1]}
+                self.store.set(self.key, report.watermark)
+            if last_page:
+                return report
+            page = 1 if advanced else page + 1
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+
+"""
+Wordpress Token Store Classes
+"""
+
+__title__ = "wordpress-tokens"
+
+import json
+import os
+import tempfile
+from contextlib import contextmanager
+from threading import Event, Lock, Timer
+from time import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class MemoryTokenStore(object):
+    """ Keeps tokens in memory. Share one between API instances in a process so
+    only the first of them has to authenticate """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            return dict(entry) if entry is not None else None
+
+    def set(self, key, entry):
+        with self._lock:
+            self._entries[key] = dict(entry)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class FileTokenStore(object):
+    """ Keeps tokens in a JSON file readable only by its owner, so they outlive
+    the process. Changes are made under a lock on a file next to it (where flock
+    is available) and written to a temporary file then renamed, so processes
+    sharing the file never see half written tokens """
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        self.lock_path = self.path + '.lock'
+        self._lock = Lock()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    @contextmanager
+    def locked(self, exclusive):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            handle = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                yield
+            finally:
+                os.close(handle)
+
+    def read(self):
+        try:
+            with open(self.path, 'r') as token_file:
+                entries = json.load(token_file)
+        except (IOError, OSError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def write(self, entries):
+        # mkstemp creates the file readable by its owner only
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)))
+        try:
+            with os.fdopen(handle, 'w') as token_file:
+                json.dump(entries, token_file)
+            os.rename(temp_path, self.path)
+        except Exception:
+            os.remove(temp_path)
+            raise
+
+    def get(self, key):
+        with self.locked(exclusive=False):
+            return self.read().get(key)
+
+    def set(self, key, entry):
+        with self.locked(exclusive=True):
+            entries = self.read()
+            entries[key] = entry
+            self.write(entries)
+
+    def delete(self, key):
+        with self.locked(exclusive=True):
+            entries = self.read()
+            if entries.pop(key, None) is not None:
+                self.write(entries)
+
+
+class OAuth2Grant(object):
+    """ Gets a new OAuth2 token without a login window, for servers and workers.
+
+    grant_type is 'client_credentials', 'password' or 'interactive'. For the
+    password grant, username and password are strings or callables returning
+    them, so they can come from a secrets manager when they are needed.
+    Calling the grant returns the decoded token response """
+
+    environ_prefix = 'WP_OAUTH2_'
+
+    def __init__(self, oauth2, grant_type, username=None, password=None, scope=None):
+        if grant_type not in ['client_credentials', 'password', 'interactive']:
+            raise UserWarning("unknown OAuth2 grant_type %s" % grant_type)
+        if grant_type == 'password' and not (username and password):
+            raise UserWarning("the OAuth2 password grant needs a username and password")
+        self.oauth2 = oauth2
+        self.grant_type = grant_type
+        self.username = username
+        self.password = password
+        self.scope = scope
+
+    @classmethod
+    def from_value(cls, oauth2, value=None, environ=None):
+        """ A grant from the oauth2_grant option: a callable, a grant_type, a dict
+        with grant_type and its credentials, or None to configure it from the
+        WP_OAUTH2_GRANT, WP_OAUTH2_USERNAME, WP_OAUTH2_PASSWORD and WP_OAUTH2_SCOPE
+        environment variables. Without any of them, the login window is used """
+        if callable(value):
+            return value
+        if isinstance(value, dict):
+            config = dict(value)
+            return cls(oauth2, config.pop('grant_type', 'password'), **config)
+        environ = os.environ if environ is None else environ
+        env = dict(
+            (key, environ.get(cls.environ_prefix + key.upper()))
+            for key in ['grant', 'username', 'password', 'scope']
+        )
+        grant_type = value or env['grant']
+        if grant_type is None:
+            grant_type = 'password' if env['username'] and env['password'] else 'interactive'
+        if grant_type == 'interactive':
+            return cls(oauth2, grant_type)
+        return cls(oauth2, grant_type, env['username'], env['password'], env['scope'])
+
+    @classmethod
+    def resolve(cls, value):
+        return value() if callable(value) else value
+
+    def __call__(self):
+        if self.grant_type == 'interactive':
+            return self.oauth2.request_auth_token_json()
+        if self.grant_type == 'client_credentials':
+            response = self.oauth2.request_client_credentials_token(self.scope)
+        else:
+            response = self.oauth2.request_grant_token(
+                username=self.resolve(self.username),
+                password=self.resolve(self.password)
+            )
+        try:
+            token = response.json()
+        except ValueError:
+            token = None
+        if response.status_code != 200 or not isinstance(token, dict) or not token.get('access_token'):
+            raise UserWarning("OAuth2 %s grant failed with %s: %s" % (
+                self.grant_type, response.status_code, response.text[:200]
+            ))
+        return token
+
+
+class OAuth2TokenManager(object):
+    """ Keeps an OAuth2 bearer token valid for as long as the client runs.
+
+    Records when each token expires and, refresh_margin seconds before then,
+    refreshes it on a background timer with the refresh token, so requests never
+    wait on it. A request only blocks for a token when there is none yet or it
+    already expired. However many threads need a new token at once, one request
+    is made for it and the others wait for its result.
+
+    grant is called for a token when there is no refresh token, or refreshing
+    fails, and returns the decoded token response. It is only called from a
+    request's thread, since the grant may be the login window: when the
+    background timer's refresh fails, the token is left to expire and the next
+    request renews it. Tokens are kept in the token store, if there is one, so
+    later runs start with them """
+
+    refresh_margin = 60
+    default_lifetime = 3600
+
+    def __init__(self, oauth2, grant, token_store=None, refresh_margin=None, background=True):
+        self.oauth2 = oauth2
+        self.grant = grant
+        self.token_store = token_store
+        if refresh_margin is not None:
+            self.refresh_margin = refresh_margin
+        self.background = background
+        self.clock = time
+        self.access_token = None
+        self.refresh_token = None
+        self.expires_at = None
+        self.refreshes = 0
+        self.grants = 0
+        self.last_error = None
+        self._lock = Lock()
+        self._inflight = None
+        self._timer = None
+        self._closed = False
+        self._loaded = False
+
+    @property
+    def token_store_key(self):
+        return "oauth2 %s %s" % (self.oauth2.site, self.oauth2.client_id)
+
+    @property
+    def token(self):
+        """ A valid access token, fetching one first only if there is none """
+        if not self._loaded:
+            self.load()
+        access_token = self.access_token
+        if not self.is_valid():
+            self.renew(access_token)
+            if not self.is_valid():
+                raise UserWarning("could not get an OAuth2 token: %s" % self.last_error)
+        return self.access_token
+
+    def is_valid(self):
+        with self._lock:
+            return bool(self.access_token) \
+                and (self.expires_at is None or self.clock() < self.expires_at)
+
+    def load(self):
+        """ Takes the tokens from the token store if it has valid ones """
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            if self.token_store is None:
+                return
+            entry = self.token_store.get(self.token_store_key)
+            if not isinstance(entry, dict) \
+            or entry.get('site') != self.oauth2.site \
+            or entry.get('client_id') != self.oauth2.client_id \
+            or not (entry.get('access_token') or entry.get('refresh_token')):
+                if entry is not None:
+                    self.token_store.delete(self.token_store_key)
+                return
+            self.refresh_token = entry.get('refresh_token')
+            self.expires_at = entry.get('expires_at')
+            self.access_token = entry.get('access_token')
+        self.schedule()
+
+    def renew(self, stale_token=None, grant=True):
+        """ Gets a new token, unless stale_token was already replaced. Joins a
+        renewal another thread already started instead of starting another.
+        Without grant, only the refresh token is tried """
+        while True:
+            with self._lock:
+                if self.access_token != stale_token:
+                    return
+                inflight = self._inflight
+                leader = inflight is None
+                if leader:
+                    inflight = self._inflight = (Event(), grant)
+            if leader:
+                break
+            inflight[0].wait()
+            if inflight[1] or not grant:
+                return
+            # the renewal joined only tried the refresh token, so go on to the grant
+        try:
+            self.set_token(self.fetch(grant))
+        except Exception as exc:
+            self.last_error = exc
+        finally:
+            with self._lock:
+                self._inflight = None
+            inflight[0].set()
+
+    def refresh(self, stale_token):
+        """ Renews the token from the background timer, with the refresh token only """
+        self.renew(stale_token, grant=False)
+
+    def fetch(self, grant=True):
+        """ A token response, from the refresh token if possible, else the grant """
+        if self.refresh_token:
+            response = self.oauth2.request_refresh_token(self.refresh_token)
+            try:
+                token = response.json() if response.status_code == 200 else None
+            except ValueError:
+                token = None
+            if isinstance(token, dict) and token.get('access_token'):
+                self.refreshes += 1
+                return token
+        if not grant:
+            raise UserWarning("OAuth2 refresh token was refused, leaving the grant to the next request")
+        token = self.grant()
+        if not token or not token.get('access_token'):
+            raise UserWarning("OAuth2 grant returned no access_token")
+        self.grants += 1
+        return token
+
+    def set_token(self, token):
+        expires_in = token.get('expires_in') or self.default_lifetime
+        with self._lock:
+            self.refresh_token = token.get('refresh_token') or self.refresh_token
+            self.expires_at = self.clock() + int(expires_in)
+            self.access_token = token['access_token']
+            self.last_error = None
+        if self.token_store is not None:
+            self.token_store.set(self.token_store_key, {
+                'site': self.oauth2.site,
+                'client_id': self.oauth2.client_id,
+                'access_token': self.access_token,
+                'refresh_token': self.refresh_token,
+                'expires_at': self.expires_at,
+            })
+        self.schedule()
+
+    def schedule(self):
+        """ Starts the timer that refreshes the token ahead of its expiry """
+        if not self.background or self.expires_at is None or not self.refresh_token:
+            return
+        timer = Timer(self.refresh_delay(), self.refresh, (self.access_token,))
+        timer.daemon = True
+        with self._lock:
+            if self._closed:
+                return
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = timer
+        timer.start()
+
+    def refresh_delay(self):
+        """ Seconds until the token should be refreshed: refresh_margin before it
+        expires, but no sooner than halfway there, so a margin as long as the
+        tokens last doesn't refresh them back to back """
+        remaining = self.expires_at - self.clock()
+        return max(remaining - self.refresh_margin, remaining / 2.0, 0)
+
+    def invalidate(self, access_token):
+        """ Drops access_token after the server rejected it, so the next request
+        gets a new one. Does nothing if it was already replaced """
+        with self._lock:
+            if self.access_token == access_token:
+                self.expires_at = self.clock()
+
+    def close(self):
+        """ Stops refreshing in the background, for good """
+        with self._lock:
+            self._closed = True
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
@@ -6,8 +6,13 @@ Wordpress Requests Class
 
 __title__ = "wordpress-requests"
 
+import socket
 from requests import Request, Session
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE, DEFAULT_POOLBLOCK
 from json import dumps as jsonencode
+from multiprocessing.pool import ThreadPool
+from threading import Lock, local
+from time import time
 
 try:
     from urllib.parse import urlencode, quote, unquote, parse_qsl, urlparse, urlunparse
@@ -21,6 +26,66 @@ from wordpress import __version__
 from wordpress import __default_api_version__
 from wordpress import __default_api__
 from wordpress.helpers import SeqUtils, UrlUtils, StrUtils
+from wordpress.retry import RetryPolicy
+from wordpress.ratelimit import TokenBucket
+
+class Pooled_HTTPAdapter(HTTPAdapter):
+    """ HTTPAdapter that can enable TCP keepalive probes on its sockets and
+    counts the connections it opens, to show how well they are being reused """
+    def __init__(self, tcp_keepalive=False, **kwargs):
+        self.tcp_keepalive = tcp_keepalive
+        self._stats_lock = Lock()
+        self._connection_classes = {}
+        self.requests_sent = 0
+        self.connections_created = 0
+        super(Pooled_HTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tcp_keepalive:
+            kwargs['socket_options'] = [
+                (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+            ]
+        super(Pooled_HTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+    def get_connection(self, url, proxies=None):
+        pool = super(Pooled_HTTPAdapter, self).get_connection(url, proxies)
+        if pool.ConnectionCls not in self._connection_classes.values():
+            pool.ConnectionCls = self._counting_connection_class(pool.ConnectionCls)
+        return pool
+
+    def _counting_connection_class(self, connection_cls):
+        """ Subclass of connection_cls that counts every socket it opens,
+        including reconnects after the server dropped an idle connection """
+        if connection_cls not in self._connection_classes:
+            adapter = self
+
+            def _new_conn(self):
+                with adapter._stats_lock:
+                    adapter.connections_created += 1
+                return connection_cls._new_conn(self)
+
+            self._connection_classes[connection_cls] = type(
+                connection_cls.__name__, (connection_cls,), {'_new_conn': _new_conn}
+            )
+        return self._connection_classes[connection_cls]
+
+    def send(self, request, **kwargs):
+        with self._stats_lock:
+            self.requests_sent += 1
+        return super(Pooled_HTTPAdapter, self).send(request, **kwargs)
+
+    @property
+    def pool_stats(self):
+        """ Counts of requests sent and connections opened for them. Every
+        request beyond the first on a connection reused it, saving a TCP
+        (and TLS) handshake """
+        with self._stats_lock:
+            return {
+                'requests': self.requests_sent,
+                'connections_created': self.connections_created,
+                'connections_reused': max(self.requests_sent - self.connections_created, 0),
+            }
 
 class API_Requests_Wrapper(object):
     """ provides a wrapper for making requests that handles session info """
@@ -31,11 +96,78 @@ class API_Requests_Wrapper(object):
         self.timeout = kwargs.get("timeout", 5)
         self.verify_ssl = kwargs.get("verify_ssl", True)
         self.query_string_auth = kwargs.get("query_string_auth", False)
-        self.session = Session()
+        self.pool_connections = kwargs.get("pool_connections", DEFAULT_POOLSIZE)
+        self.pool_maxsize = kwargs.get("pool_maxsize", DEFAULT_POOLSIZE)
+        self.pool_block = kwargs.get("pool_block", DEFAULT_POOLBLOCK)
+        self.keep_alive = kwargs.get("keep_alive", True)
+        self.tcp_keepalive = kwargs.get("tcp_keepalive", False)
+        self.thread_sessions = kwargs.get("thread_sessions", True)
+        self.retry_policy = RetryPolicy.from_value(kwargs.get("retries"))
+        self.rate_limiter = TokenBucket.from_value(kwargs.get("rate_limit"))
+        self.adapter = Pooled_HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block,
+            tcp_keepalive=self.tcp_keepalive
+        )
+        self._thread_local = local()
+        self._session = self.new_session()
+
+    @property
+    def session(self):
+        """ The session used for requests from the current thread. By default each
+        thread gets its own session (cookies and headers) on top of the shared
+        connection pool, which is thread safe. A requests Session itself isn't,
+        so the one session used by all threads when thread_sessions is False,
+        or when one is assigned here, is only meant for single threaded use """
+        if not self.thread_sessions:
+            return self._session
+        session = getattr(self._thread_local, 'session', None)
+        if session is None:
+            session = self._thread_local.session = self.new_session()
+        return session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+        self.thread_sessions = False
+
+    def new_session(self):
+        """ Creates a session using the tuned connection pool adapter """
+        session = Session()
+        session.mount('http://', self.adapter)
+        session.mount('https://', self.adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    @property
+    def pool_stats(self):
+        return self.adapter.pool_stats
+
+    @property
+    def url(self):
+        return self._url
+
+    @url.setter
+    def url(self, url):
+        self._url = url
+        # derived once here rather than parsed again for every request
+        self._is_ssl = UrlUtils.is_ssl(url)
+        self._base_urls = {}
+
+    @property
+    def api(self):
+        return self._api
+
+    @api.setter
+    def api(self, api):
+        self._api = api
+        self._base_urls = {}
 
     @property
     def is_ssl(self):
-        return UrlUtils.is_ssl(self.url)
+        return self._is_ssl
 
     @property
     def api_url(self):
@@ -44,16 +176,38 @@ class API_Requests_Wrapper(object):
             self.api
         ])
 
-    def endpoint_url(self, endpoint):
+    def base_url(self, api_version=None):
+        """ The url endpoints of api_version are under, joined once per version """
+        api_version = api_version or self.api_version
+        base_url = self._base_urls.get(api_version)
+        if base_url is None:
+            base_url = self._base_urls[api_version] = UrlUtils.join_components([
+                self.url,
+                self.api,
+                api_version
+            ])
+        return base_url
+
+    def endpoint_url(self, endpoint, api_version=None):
         endpoint = StrUtils.decapitate(endpoint, '/')
-        return UrlUtils.join_components([
-            self.url,
-            self.api,
-            self.api_version,
-            endpoint
-        ])
+        base_url = self.base_url(api_version)
+        if not endpoint:
+            return base_url
+        if endpoint.startswith('/') or not base_url:
+            # absolute paths replace the base, as in posixpath.join
+            return UrlUtils.join_components([base_url, endpoint])
+        if base_url.endswith('/'):
+            return base_url + endpoint
+        return base_url + '/' + endpoint
 
     def request(self, method, url, auth=None, params=None, data=None, **kwargs):
+        """ Makes a request, retrying it according to the retry policy if there is
+        one. Every attempt first waits for the rate limiter, if any. If given, sign
+        is called with url before each attempt, so every attempt gets a fresh
+        signature. The attempts made are recorded on the response as
+        retry_attempts. With stream=True the body is left unread, to be read as
+        it is iterated with response.iter_content """
+        sign = kwargs.pop("sign", None)
         headers = {
             "user-agent": "BCBS Wordpress API Client-Python/%s" % __version__,
             "accept": "application/json",
@@ -84,9 +238,64 @@ class API_Requests_Wrapper(object):
         if data is not None: request_kwargs['data'] = data
         # print "REQUEST KWARGS :" + str(request_kwargs)
 
-        return self.session.request(
-            **request_kwargs
-        )
+        policy = self.retry_policy
+        if policy is not None:
+            policy.start()
+        attempts = []
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            # signed after waiting, so the timestamp is current when sent
+            if sign is not None:
+                request_kwargs['url'] = sign(url)
+            if policy is not None:
+                policy.count_attempt()
+            started = time()
+            response = error = reason = None
+            try:
+                response = self.session.request(
+                    **request_kwargs
+                )
+                if policy is not None and policy.is_retry_status(response.status_code):
+                    reason = str(response.status_code)
+            except RetryPolicy.exceptions as exc:
+                if policy is None:
+                    raise
+                error = exc
+                reason = type(exc).__name__
+            attempt = {
+                'attempt': len(attempts) + 1,
+                'status_code': response.status_code if response is not None else None,
+                'error': repr(error) if error is not None else None,
+                'elapsed': time() - started,
+                'delay': None,
+            }
+            attempts.append(attempt)
+            if reason is None:
+                break
+            delay = policy.delay(len(attempts) - 1, response)
+            # files may be streams that can't be sent again
+            if files or not policy.should_retry(method, len(attempts) - 1, reason, delay):
+                if error is not None:
+                    raise error
+                break
+            attempt['delay'] = delay
+            if response is not None:
+                response.close()
+            policy.wait(delay)
+
+        response.retry_attempts = attempts
+        return response
+
+    @property
+    def retry_metrics(self):
+        if self.retry_policy is not None:
+            return self.retry_policy.metrics
+
+    @property
+    def rate_limit_metrics(self):
+        if self.rate_limiter is not None:
+            return self.rate_limiter.metrics
 
     def get(self, *args, **kwargs):
         return self.request("GET", *args, **kwargs)
@@ -96,3 +305,40 @@ class API_Requests_Wrapper(object):
 
     def set_api_version(self, api):
         self.api_version = api
+
+
+class Async_Requests_Wrapper(API_Requests_Wrapper):
+    """ provides a wrapper for making requests in the background. All requests
+    share the session and a bounded pool of max_in_flight workers, so any number
+    of requests can be queued without taking a thread each """
+    def __init__(self, url, **kwargs):
+        self.max_in_flight = kwargs.get("max_in_flight", 10)
+        # keep a pooled connection for every worker
+        kwargs.setdefault("pool_maxsize", max(self.max_in_flight, DEFAULT_POOLSIZE))
+        super(Async_Requests_Wrapper, self).__init__(url, **kwargs)
+        self._pool = None
+        self._pool_lock = Lock()
+
+    @property
+    def pool(self):
+        """ The worker pool, started on first use """
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPool(self.max_in_flight)
+        return self._pool
+
+    def submit(self, func, *args, **kwargs):
+        """ Queues func to run on the pool, returning an AsyncResult """
+        return self.pool.apply_async(func, args, kwargs)
+
+    def request_async(self, *args, **kwargs):
+        return self.submit(self.request, *args, **kwargs)
+
+    def close(self):
+        """ Waits for queued requests to finish and stops the pool """
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.close()
+            pool.join()
@@ -19,4 +19,4 @@ __default_api_version__ = "wp/v2"
 __default_api__ = "wp-json"
 
 from wpoauth2 import oauth2
-from wpoauth2 import login_frame
+# login_frame needs Tk, so it is only imported by the interactive flow
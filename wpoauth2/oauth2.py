@@ -2,6 +2,7 @@
 
 """
 OAuth2 Class supporting client credential token grants.
+The Tk login window is only imported when the interactive flow is used.
 """
 
 
@@ -13,12 +14,7 @@ try:
 except ImportError:
     import json
 import base64
-import tkMessageBox
-from login_frame import LoginFrame
-
 import sys
-sys.path.append('C:/Users/Andrew/Desktop/bcbstore/POSSystem/')
-from SharedUtilities import printt
 
 
 class OAuth2(object):
@@ -83,7 +79,69 @@ class OAuth2(object):
 
         return requests.post(self.site + self.token_url, headers=headers, data=data)
 
+    def request_client_credentials_token(self, scope=None):
+        """
+        Requests a token for the client itself, without a user
+        :param scope:
+        :return: the token endpoint response
+        """
+        base64string = base64.encodestring('%s:%s' % (self.client_id, self.client_secret)).replace('\n', '')
+        headers = {
+            "Authorization": "Basic %s" % base64string,
+            "Content-Type": "application/x-www-form-urlencoded",
+            "user-agent": "BCBS Wordpress API Client-Python, oauth2",
+            "accept": "application/json"
+        }
+        data = {
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            "grant_type": "client_credentials"
+        }
+        if scope:
+            data['scope'] = scope
+
+        return requests.post(self.site + self.token_url, headers=headers, data=data)
+
+    def request_refresh_token(self, refresh_token):
+        """
+        Exchanges a refresh token for a new access token
+        :param refresh_token:
+        :return: the token endpoint response
+        """
+        base64string = base64.encodestring('%s:%s' % (self.client_id, self.client_secret)).replace('\n', '')
+        headers = {
+            "Authorization": "Basic %s" % base64string,
+            "Content-Type": "application/x-www-form-urlencoded",
+            "user-agent": "BCBS Wordpress API Client-Python, oauth2",
+            "accept": "application/json"
+        }
+        data = {
+            'client_id': self.client_id,
+            'client_secret': self.client_secret,
+            'refresh_token': refresh_token,
+            "grant_type": "refresh_token"
+        }
+
+        return requests.post(self.site + self.token_url, headers=headers, data=data)
+
     def request_auth_token(self, error_title=None):
+        """
+        Asks for credentials with a login window and requests a token with them
+        :return: the access token and refresh token
+        """
+        token = self.request_auth_token_json(error_title)
+        if 'access_token' in token and 'refresh_token' in token:
+            return token['access_token'], token['refresh_token']
+        return {}
+
+    def request_auth_token_json(self, error_title=None):
+        """
+        Asks for credentials with a login window and requests a token with them
+        :return: the decoded token response, including expires_in, or {} on failure
+        """
+        import tkMessageBox
+        from login_frame import LoginFrame
+
         if not error_title:
             error_title = "Error Authenticating with the Server"
 
@@ -96,7 +154,6 @@ class OAuth2(object):
             username=client_creds[0],
             password=client_creds[1]
         )
-        printt(response.status_code)
 
         if response.status_code in (403, 401):
             tkMessageBox.showerror(
@@ -118,15 +175,14 @@ class OAuth2(object):
                     "communications issue, and is (probably) not an issue with your password. Please try again in 10 "
                     "minutes, and if the issue persists contact: webmaster@bcbud.store for assistance.")
             )
-            printt("There was an issue while authenticating with the store. Details: \n" + str(response.status_code))
-            printt("Response that indicated an exception:")
-            printt(response, pretty=True)
+            sys.stderr.write(
+                "There was an issue while authenticating with the store. Details: \n%s\n%s\n"
+                % (response.status_code, response.text)
+            )
             return {}
         elif 'access_token' in response.json() and 'refresh_token' in response.json():
-            return {
-                response.json()['access_token'],
-                response.json()['refresh_token']
-            }
+            return response.json()
+        return {}
 
     def is_json(self, data):
         """